@@ -0,0 +1,38 @@
+-- Order columns for BoK Pharm checkout and order status changes
+-- Run after create_tables.sql and before functions.sql; safe to re-run.
+-- checkout() (functions.sql) records the delivery location on each order
+-- and, on each order item, the medication name and dosage and the inventory
+-- row its stock came from, which cancel_order() restocks. updated_at is the
+-- time of the last status change, streamed by GET /orders/{id}/events.
+
+-- Databases built from an older SETUP_GUIDE.md name the totals total_amount
+-- and total_price; checkout() writes total and subtotal.
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM information_schema.columns
+             WHERE table_schema = current_schema() AND table_name = 'order' AND column_name = 'total_amount')
+     AND NOT EXISTS (SELECT 1 FROM information_schema.columns
+                     WHERE table_schema = current_schema() AND table_name = 'order' AND column_name = 'total') THEN
+    ALTER TABLE "order" RENAME COLUMN total_amount TO total;
+  END IF;
+  IF EXISTS (SELECT 1 FROM information_schema.columns
+             WHERE table_schema = current_schema() AND table_name = 'order_item' AND column_name = 'total_price')
+     AND NOT EXISTS (SELECT 1 FROM information_schema.columns
+                     WHERE table_schema = current_schema() AND table_name = 'order_item' AND column_name = 'subtotal') THEN
+    ALTER TABLE order_item RENAME COLUMN total_price TO subtotal;
+  END IF;
+END;
+$$;
+
+ALTER TABLE "order"
+  ADD COLUMN IF NOT EXISTS payment_method TEXT,
+  ADD COLUMN IF NOT EXISTS delivery_city TEXT,
+  ADD COLUMN IF NOT EXISTS delivery_state TEXT,
+  ADD COLUMN IF NOT EXISTS delivery_latitude DECIMAL(10, 8),
+  ADD COLUMN IF NOT EXISTS delivery_longitude DECIMAL(11, 8),
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();
+
+ALTER TABLE order_item
+  ADD COLUMN IF NOT EXISTS medication_name TEXT,
+  ADD COLUMN IF NOT EXISTS dosage TEXT,
+  ADD COLUMN IF NOT EXISTS inventory_id VARCHAR REFERENCES inventory(id);
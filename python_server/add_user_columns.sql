@@ -0,0 +1,19 @@
+-- User columns for BoK Pharm sign-in
+-- Run after create_tables.sql and before functions.sql; safe to re-run.
+-- Both backends find a user by firebase_uid, and sync_user() (functions.sql)
+-- creates the row on first sign-in with ON CONFLICT (firebase_uid), which
+-- needs the unique index. The profile columns are the ones the FastAPI
+-- backend's /auth/sync-user writes.
+
+ALTER TABLE "user"
+  ADD COLUMN IF NOT EXISTS firebase_uid VARCHAR,
+  ADD COLUMN IF NOT EXISTS name TEXT,
+  ADD COLUMN IF NOT EXISTS surname TEXT,
+  ADD COLUMN IF NOT EXISTS mobile_number TEXT,
+  ADD COLUMN IF NOT EXISTS date_of_birth TIMESTAMP;
+
+-- The Flask backend used to store the Firebase uid as the row id.
+UPDATE "user" SET firebase_uid = id WHERE firebase_uid IS NULL;
+
+-- Named like the index of a "firebase_uid ... UNIQUE" column, so tables created that way keep theirs.
+CREATE UNIQUE INDEX IF NOT EXISTS user_firebase_uid_key ON "user"(firebase_uid);
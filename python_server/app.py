@@ -1,38 +1,145 @@
 import os
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from supabase import create_client, Client
 from dotenv import load_dotenv
 from typing import Optional, Dict, Any
 from functools import wraps
 import json
-import firebase_admin
-from firebase_admin import credentials, auth as firebase_auth
+from firebase_tokens import TokenVerifier
+from snapshot import SnapshotCache
+from geo import PharmacyLocator
+from delivery import DeliveryQuoter
+from search_index import MedicationSearch
+from availability import StockIndex, INVENTORY_COLUMNS
+from pharmacy_context import PharmacyContext
+from known_users import KnownUsers
+import inventory_import
+from inventory_sweeper import InventorySweeper
+import idempotency
+import upstream
+import responses
+import metrics
+from pagination import (
+    NEXT_CURSOR_HEADER, MEDICATION_FIELDS, PHARMACY_FIELDS, INVENTORY_FIELDS, PageRequestError,
+    decode_cursor, parse_limit, parse_fields, select_columns, page_query, finish_page, paginate_rows, project
+)
+import db
+import storage
+import lifecycle
 
 load_dotenv()
 load_dotenv("../.env")
 
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return responses.dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with metrics.timer("encode"):
+            body = responses.dumps(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
-CORS(app, supports_credentials=True)
+if responses.FAST_JSON:
+    app.json = FastJSONProvider(app)
+CORS(app, supports_credentials=True, expose_headers=[NEXT_CURSOR_HEADER, "ETag", idempotency.REPLAYED_HEADER])
+# Registered before compress_response so its after_request hook runs last.
+metrics.install_flask(app)
+
+@app.before_request
+def start_worker():
+    # Normally done by gunicorn's post_worker_init; covers the development server.
+    lifecycle.worker.start()
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+def catalog_etag(snapshot_etag):
+    # Gzip, br and identity bodies differ byte for byte, so each gets its own validator.
+    return responses.make_etag(snapshot_etag, request.path, sorted(request.args.items(multi=True)),
+                               encoding=responses.etag_encoding(request.headers.get("Accept-Encoding")))
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
+def catalog_headers(etag, next_cursor=None):
+    # Vary on every catalog response, 304s included, so caches keep one copy per coding.
+    headers = {"ETag": etag, "Cache-Control": responses.CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return headers
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+@app.after_request
+def compress_response(response):
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    encoding = responses.choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if responses.should_compress(response.mimetype, response.headers.get("Content-Encoding"), len(body)):
+        response.set_data(responses.compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+    return response
+
+# Registered after compress_response so stored responses are kept uncompressed.
+idempotency_store = idempotency.IdempotencyStore()
+idempotency.install_flask(app, idempotency_store)
+# Registered last so a refused storage call's 500 becomes 503 before the other hooks see it.
+upstream.install_flask(app)
+
+# Supabase by default; STORAGE_BACKEND=sqlmodel serves the same calls from a local database.
+# Identical reads in flight together are merged and upstream concurrency is capped.
+supabase = upstream.guard(metrics.instrument_client(storage.create_client()))
+idempotency_store.attach(supabase)
 
-# Initialize Firebase Admin SDK
 FIREBASE_PROJECT_ID = os.getenv("VITE_FIREBASE_PROJECT_ID")
 if not FIREBASE_PROJECT_ID:
     raise ValueError("VITE_FIREBASE_PROJECT_ID environment variable is required")
 
-# Initialize Firebase Admin with minimal config (uses environment for credentials)
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(options={
-        'projectId': FIREBASE_PROJECT_ID
-    })
+# Verified ID tokens are cached until they expire; Google's signing keys are
+# prefetched when the worker starts and refreshed in the background.
+token_verifier = TokenVerifier(FIREBASE_PROJECT_ID)
+lifecycle.worker.on_start(token_verifier.start)
+idempotency_store.identify_with(token_verifier)
+
+def load_medications():
+    return db.select_all(lambda: supabase.table("medication").select("*"))
+
+medication_catalog = SnapshotCache(load_medications)
+medication_search = MedicationSearch(medication_catalog)
+
+def load_pharmacies():
+    return db.select_all(lambda: supabase.table("pharmacy").select("*"))
+
+pharmacy_directory = SnapshotCache(load_pharmacies)
+pharmacy_locator = PharmacyLocator(pharmacy_directory)
+delivery_quoter = DeliveryQuoter(pharmacy_directory)
+
+def load_stock():
+    return db.select_all(lambda: supabase.table("inventory").select(INVENTORY_COLUMNS).eq("in_stock", True).gt("quantity", 0))
+
+stock_index = StockIndex(load_stock, pharmacy_locator)
+INVENTORY_KEYS = INVENTORY_COLUMNS.split(",")
+
+def apply_stock(rows):
+    for row in rows:
+        stock_index.apply({key: row[key] for key in INVENTORY_KEYS})
+
+# Marks expired and empty batches out of stock and keeps the alert rows behind /inventory/alerts.
+inventory_sweeper = InventorySweeper(supabase, on_rows=apply_stock)
+lifecycle.worker.on_start(inventory_sweeper.start)
+
+def warm_caches():
+    medication_catalog.get()
+    pharmacy_directory.get()
+
+lifecycle.worker.on_start(warm_caches, background=True)
+lifecycle.worker.ready_when("caches", lambda: medication_catalog.loads > 0 and pharmacy_directory.loads > 0)
+
+def load_pharmacy_id(user_id):
+    response = supabase.table("user").select("pharmacy_id").eq("id", user_id).execute()
+    return response.data[0].get("pharmacy_id") if response.data else None
+
+pharmacy_context = PharmacyContext(load_pharmacy_id)
+known_users = KnownUsers()
 
 def verify_firebase_token(f):
     @wraps(f)
@@ -44,7 +151,8 @@ def verify_firebase_token(f):
         
         try:
             id_token = auth_header.split('Bearer ')[1]
-            decoded_token = firebase_auth.verify_id_token(id_token)
+            with metrics.timer("auth"):
+                decoded_token = token_verifier.verify(id_token)
             request.firebase_user = decoded_token
             request.user_id = decoded_token['uid']
             return f(*args, **kwargs)
@@ -56,13 +164,41 @@ def verify_firebase_token(f):
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    return jsonify({"status": "ok", "message": "BoK Pharm Python Backend Running"}), 200
+    tokens = token_verifier.stats()
+    return jsonify({
+        "status": "ok",
+        "message": "BoK Pharm Python Backend Running",
+        "worker": lifecycle.worker.health(),
+        "signing_keys": tokens["keys"],
+        "token_cache": tokens["tokens"],
+    }), 200
+
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    ready, body = lifecycle.worker.readiness()
+    return jsonify(body), 200 if ready else 503
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
 
 @app.route("/medications", methods=["GET"])
 def get_medications():
     try:
-        response = supabase.table("medication").select("*").eq("is_otc", True).execute()
-        return jsonify(response.data), 200
+        after = decode_cursor(request.args.get("cursor"))
+        limit = parse_limit(request.args.get("limit"))
+        fields = parse_fields(request.args.get("fields"), MEDICATION_FIELDS)
+    except PageRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        medication_catalog.get()
+        etag = catalog_etag(medication_catalog.etag())
+        if responses.not_modified(request.headers.get("If-None-Match"), etag):
+            return "", 304, catalog_headers(etag)
+        ids, rows = medication_catalog.ordered()
+        medications, next_cursor = paginate_rows(ids, rows, after, limit, fields, where=lambda m: m.get("is_otc"))
+        return jsonify(medications), 200, catalog_headers(etag, next_cursor)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -78,15 +214,92 @@ def create_medication():
         data["requires_prescription"] = False
         
         response = supabase.table("medication").insert(data).execute()
+        medication_search.add(response.data[0])
         return jsonify(response.data[0]), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/medications/search", methods=["GET"])
+def search_medications():
+    query = request.args.get("q", "").strip()
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    
+    if not query or not 1 <= limit <= 50:
+        return jsonify({"error": "q is required and limit must be between 1 and 50"}), 400
+    
+    try:
+        return jsonify(medication_search.search(query, limit)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/medications/<medication_id>/availability", methods=["GET"])
+def get_medication_availability(medication_id):
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+        radius = float(request.args["radius"]) if request.args.get("radius") else None
+        limit = int(request.args.get("limit", 20))
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lng are required; radius and limit must be numbers"}), 400
+    
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (radius is not None and radius <= 0) or not 1 <= limit <= 100:
+        return jsonify({"error": "lat/lng out of range, radius must be positive and limit between 1 and 100"}), 400
+    
+    try:
+        return jsonify(stock_index.nearest(medication_id, lat, lng, radius, limit)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/pharmacies", methods=["GET"])
 def get_pharmacies():
     try:
-        response = supabase.table("pharmacy").select("*").execute()
-        return jsonify(response.data), 200
+        after = decode_cursor(request.args.get("cursor"))
+        limit = parse_limit(request.args.get("limit"))
+        fields = parse_fields(request.args.get("fields"), PHARMACY_FIELDS)
+    except PageRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        # With the customer's location, distance, delivery fee and time are quoted live.
+        lat = float(request.args["lat"]) if request.args.get("lat") else None
+        lng = float(request.args["lng"]) if request.args.get("lng") else None
+    except ValueError:
+        return jsonify({"error": "lat and lng must be numbers"}), 400
+    if (lat is None) != (lng is None) or (lat is not None and not (-90 <= lat <= 90 and -180 <= lng <= 180)):
+        return jsonify({"error": "lat and lng go together and must be in range"}), 400
+    
+    try:
+        pharmacy_directory.get()
+        etag = catalog_etag(pharmacy_directory.etag())
+        if responses.not_modified(request.headers.get("If-None-Match"), etag):
+            return "", 304, catalog_headers(etag)
+        ids, rows = pharmacy_directory.ordered()
+        if lat is None:
+            pharmacies, next_cursor = paginate_rows(ids, rows, after, limit, fields)
+        else:
+            pharmacies, next_cursor = paginate_rows(ids, rows, after, limit)
+            pharmacies = project(delivery_quoter.annotate(pharmacies, lat, lng), fields)
+        return jsonify(pharmacies), 200, catalog_headers(etag, next_cursor)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/pharmacies/nearby", methods=["GET"])
+def get_nearby_pharmacies():
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+        radius = float(request.args["radius"]) if request.args.get("radius") else None
+        limit = int(request.args.get("limit", 20))
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lng are required; radius and limit must be numbers"}), 400
+    
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (radius is not None and radius <= 0) or not 1 <= limit <= 100:
+        return jsonify({"error": "lat/lng out of range, radius must be positive and limit between 1 and 100"}), 400
+    
+    try:
+        return jsonify(delivery_quoter.annotate(pharmacy_locator.nearby(lat, lng, radius, limit), lat, lng)), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -95,6 +308,7 @@ def create_pharmacy():
     try:
         data = request.get_json()
         response = supabase.table("pharmacy").insert(data).execute()
+        pharmacy_locator.add(response.data[0])
         return jsonify(response.data[0]), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -103,18 +317,24 @@ def create_pharmacy():
 @verify_firebase_token
 def get_inventory():
     try:
-        user_id = request.user_id
-        
-        user_response = supabase.table("user").select("pharmacy_id").eq("id", user_id).execute()
-        
-        if not user_response.data or not user_response.data[0].get("pharmacy_id"):
-            return jsonify({"items": [], "needsSetup": True}), 200
+        after = decode_cursor(request.args.get("cursor"))
+        limit = parse_limit(request.args.get("limit"))
+        fields = parse_fields(request.args.get("fields"), INVENTORY_FIELDS)
+    except PageRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        pharmacy_id = pharmacy_context.get(request.user_id)
         
-        pharmacy_id = user_response.data[0]["pharmacy_id"]
+        if not pharmacy_id:
+            return jsonify({"items": [], "needsSetup": True, "next_cursor": None}), 200
         
-        response = supabase.table("inventory").select("*").eq("pharmacy_id", pharmacy_id).execute()
+        query = supabase.table("inventory").select(select_columns(fields)).eq("pharmacy_id", pharmacy_id)
+        response = page_query(query, after, limit).execute()
+        items, next_cursor = finish_page(response.data, limit)
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
         
-        return jsonify({"items": response.data, "needsSetup": False}), 200
+        return jsonify({"items": items, "needsSetup": False, "next_cursor": next_cursor}), 200, headers
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -122,43 +342,85 @@ def get_inventory():
 @verify_firebase_token
 def create_inventory():
     try:
-        user_id = request.user_id
+        pharmacy_id = pharmacy_context.get(request.user_id)
         
-        user_response = supabase.table("user").select("pharmacy_id").eq("id", user_id).execute()
-        
-        if not user_response.data or not user_response.data[0].get("pharmacy_id"):
+        if not pharmacy_id:
             return jsonify({"error": "Please set up your pharmacy first"}), 400
         
-        pharmacy_id = user_response.data[0]["pharmacy_id"]
-        
         data = request.get_json()
         data["pharmacy_id"] = pharmacy_id
         
         response = supabase.table("inventory").insert(data).execute()
+        stock_index.apply(response.data[0])
+        inventory_sweeper.apply(response.data[0])
         return jsonify(response.data[0]), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route("/inventory/<inventory_id>", methods=["DELETE"])
+@app.route("/inventory/alerts", methods=["GET"])
 @verify_firebase_token
-def delete_inventory(inventory_id):
+def get_inventory_alerts():
     try:
-        user_id = request.user_id
+        pharmacy_id = pharmacy_context.get(request.user_id)
         
-        # Verify user owns this inventory item
-        inventory_response = supabase.table("inventory").select("pharmacy_id").eq("id", inventory_id).execute()
+        if not pharmacy_id:
+            return jsonify({"error": "Please set up your pharmacy first"}), 400
         
-        if not inventory_response.data:
-            return jsonify({"error": "Inventory item not found"}), 404
+        alerts = inventory_sweeper.alerts(pharmacy_id)
+        if alerts is None:
+            return jsonify({"error": "Inventory alerts are not available yet"}), 503, {"Retry-After": "30"}
+        return jsonify(alerts), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/inventory/bulk", methods=["POST"])
+@verify_firebase_token
+def bulk_import_inventory():
+    try:
+        fmt = inventory_import.upload_format(request.args.get("format"), request.mimetype)
+        batch_size = int(request.args.get("batch_size", inventory_import.INVENTORY_BULK_BATCH_SIZE))
+        if not 1 <= batch_size <= inventory_import.INVENTORY_BULK_MAX_BATCH_SIZE:
+            raise ValueError
+    except inventory_import.ImportFormatError as e:
+        return jsonify({"error": str(e)}), 415
+    except ValueError:
+        return jsonify({"error": f"batch_size must be 1-{inventory_import.INVENTORY_BULK_MAX_BATCH_SIZE}"}), 400
+    
+    try:
+        pharmacy_id = pharmacy_context.get(request.user_id)
+        
+        if not pharmacy_id:
+            return jsonify({"error": "Please set up your pharmacy first"}), 400
         
-        inventory_pharmacy_id = inventory_response.data[0]["pharmacy_id"]
+        def apply_rows(rows):
+            apply_stock(rows)
+            for row in rows:
+                inventory_sweeper.apply(row)
         
-        user_response = supabase.table("user").select("pharmacy_id").eq("id", user_id).execute()
+        job = inventory_import.InventoryImport(supabase, pharmacy_id, batch_size, on_rows=apply_rows)
+        records = inventory_import.read_records(request.stream, fmt)
+        report = job.run(records, lambda medication_id: medication_catalog.get_by_id(medication_id) is not None)
+        return jsonify(report), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/inventory/<inventory_id>", methods=["DELETE"])
+@verify_firebase_token
+def delete_inventory(inventory_id):
+    try:
+        pharmacy_id = pharmacy_context.get(request.user_id)
         
-        if not user_response.data or user_response.data[0].get("pharmacy_id") != inventory_pharmacy_id:
+        if not pharmacy_id:
             return jsonify({"error": "Unauthorized"}), 403
         
-        response = supabase.table("inventory").delete().eq("id", inventory_id).execute()
+        # The pharmacy filter is the ownership check: another pharmacy's item matches no row.
+        response = supabase.table("inventory").delete().eq("id", inventory_id).eq("pharmacy_id", pharmacy_id).execute()
+        
+        if not response.data:
+            return jsonify({"error": "Inventory item not found"}), 404
+        
+        stock_index.discard(inventory_id)
+        inventory_sweeper.discard(inventory_id)
         
         return jsonify({"success": True}), 200
     except Exception as e:
@@ -193,6 +455,7 @@ def setup_pharmacy():
         user = user_response.data[0]
         
         if user.get("pharmacy_id"):
+            pharmacy_context.set(user_id, user["pharmacy_id"])
             return jsonify({"message": "Pharmacy already set up", "pharmacy_id": user["pharmacy_id"]}), 200
         
         pharmacy_data = {
@@ -206,11 +469,14 @@ def setup_pharmacy():
         
         pharmacy_response = supabase.table("pharmacy").insert(pharmacy_data).execute()
         pharmacy_id = pharmacy_response.data[0]["id"]
+        pharmacy_locator.add(pharmacy_response.data[0])
         
         supabase.table("user").update({
             "pharmacy_id": pharmacy_id,
             "role": "pharmacy_owner"
         }).eq("id", user_id).execute()
+        pharmacy_context.set(user_id, pharmacy_id)
+        known_users.changed(user_id)
         
         return jsonify({"success": True, "pharmacy_id": pharmacy_id}), 201
     except Exception as e:
@@ -230,26 +496,32 @@ def sync_user():
         if not firebase_uid or not email:
             return jsonify({"error": "firebase_uid and email are required"}), 400
         
-        existing_user = supabase.table("user").select("*").eq("id", firebase_uid).execute()
-        
-        if existing_user.data:
-            user = existing_user.data[0]
+        user = known_users.get(firebase_uid)
+        if user is not None:
             return jsonify(user), 200
-        else:
-            new_user = {
-                "id": firebase_uid,
-                "email": email,
-                "first_name": first_name,
-                "last_name": last_name,
-                "profile_image_url": profile_image_url,
-                "role": "customer"
-            }
-            
-            response = supabase.table("user").insert(new_user).execute()
-            return jsonify(response.data[0]), 201
+
+        # One round trip: sync_user (functions.sql) inserts the user or, when the
+        # firebase_uid exists, returns the stored row without touching its profile.
+        # The other routes look users up by id, so new rows keep the uid as their id.
+        response = supabase.rpc("sync_user", {"p_user": {
+            "id": firebase_uid,
+            "firebase_uid": firebase_uid,
+            "email": email,
+            "first_name": first_name,
+            "last_name": last_name,
+            "profile_image_url": profile_image_url,
+        }}).execute()
+        user = response.data["user"]
+        status = 200
+        if response.data["created"]:
+            status = 201
+            pharmacy_context.changed(firebase_uid)
+        known_users.set(firebase_uid, user)
+        return jsonify(user), status
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5001))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    # Development server; FLASK_DEBUG=1 turns on the debugger and reloader. serve.sh runs production.
+    app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,196 @@
+import time
+import threading
+
+import numpy as np
+
+from geo import haversine_km
+from inventory_sweeper import expiry
+from snapshot import CATALOG_TTL_SECONDS
+import db
+
+INVENTORY_COLUMNS = "id,pharmacy_id,medication_id,quantity,price,in_stock,expiry_date"
+
+def pick_order(row):
+    """Sort key of checkout's batch choice (functions.sql): earliest expiry first, undated last, then id."""
+    expires = expiry(row)
+    return (expires is None, expires or 0, row["id"])
+
+def in_stock(row):
+    return bool(row.get("in_stock", True)) and (row.get("quantity") or 0) > 0
+
+class StockIndex:
+    """medication_id -> in-stock inventory rows, kept current by the inventory write paths.
+
+    Answers "which pharmacies near me have this in stock" without touching the
+    inventory table: offers for the medication are joined in memory with the
+    PharmacyLocator's coordinate arrays.
+    """
+
+    def __init__(self, loader, locator, ttl=CATALOG_TTL_SECONDS):
+        self.loader = loader
+        self.locator = locator
+        self.ttl = ttl
+        self.by_medication = {}
+        self.medication_of = {}
+        self.loaded_at = 0.0
+        self.loads = 0
+        self._arrays = {}
+        self._batches = {}
+        self._pending = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def fresh(self):
+        return self.loaded_at > 0 and time.monotonic() - self.loaded_at < self.ttl
+
+    def ensure_loaded(self):
+        if self.fresh():
+            return
+        with self._load_lock:
+            if self.fresh():
+                return
+            # Writes keep landing while the select runs; they are recorded and
+            # replayed on top, since the rows read may predate them.
+            with self._lock:
+                self._pending = []
+            try:
+                by_medication = {}
+                medication_of = {}
+                for row in self.loader():
+                    if in_stock(row):
+                        by_medication.setdefault(row["medication_id"], {})[row["id"]] = row
+                        medication_of[row["id"]] = row["medication_id"]
+                with self._lock:
+                    self.by_medication = by_medication
+                    self.medication_of = medication_of
+                    self._arrays = {}
+                    self._batches = {}
+                    for change in self._pending:
+                        if isinstance(change, dict):
+                            self._apply(change)
+                        else:
+                            self._discard(change)
+                    self.loads += 1
+                    self.loaded_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    async def aensure_loaded(self):
+        if not self.fresh():
+            await db.run_sync(self.ensure_loaded)
+
+    def apply(self, row):
+        """Record an inserted or updated inventory row."""
+        with self._lock:
+            self._apply(row)
+            if self._pending is not None:
+                self._pending.append(row)
+
+    def discard(self, inventory_id):
+        with self._lock:
+            self._discard(inventory_id)
+            if self._pending is not None:
+                self._pending.append(inventory_id)
+
+    def _apply(self, row):
+        self._discard(row["id"])
+        if in_stock(row):
+            self.by_medication.setdefault(row["medication_id"], {})[row["id"]] = row
+            self.medication_of[row["id"]] = row["medication_id"]
+            self._arrays.pop(row["medication_id"], None)
+            self._batches.pop(row["medication_id"], None)
+
+    def _discard(self, inventory_id):
+        medication_id = self.medication_of.pop(inventory_id, None)
+        if medication_id is not None:
+            self.by_medication.get(medication_id, {}).pop(inventory_id, None)
+            self._arrays.pop(medication_id, None)
+            self._batches.pop(medication_id, None)
+
+    def offers(self, medication_id):
+        # One entry per pharmacy: cheapest price and total quantity across its
+        # batches, cached until the medication's stock or the grid changes.
+        index = self.locator.index
+        cached = self._arrays.get(medication_id)
+        if cached is not None and cached[0] is index:
+            return cached
+        per_pharmacy = {}
+        for row in list(self.by_medication.get(medication_id, {}).values()):
+            price = float(row.get("price") or 0)
+            best, quantity = per_pharmacy.get(row["pharmacy_id"], (price, 0))
+            per_pharmacy[row["pharmacy_id"]] = (min(best, price), quantity + row["quantity"])
+        pharmacy_ids, positions, prices, quantities = [], [], [], []
+        for pharmacy_id, (price, quantity) in per_pharmacy.items():
+            position = index.positions.get(pharmacy_id)
+            if position is not None:
+                pharmacy_ids.append(pharmacy_id)
+                positions.append(position)
+                prices.append(price)
+                quantities.append(quantity)
+        cached = (index, pharmacy_ids, np.array(positions, dtype=np.int64), np.array(prices), np.array(quantities))
+        self._arrays[medication_id] = cached
+        return cached
+
+    def batches(self, medication_id):
+        """(index, positions, prices, quantities) per in-stock row, in the order checkout picks them.
+
+        Checkout fills a line from one row: the first, in this order, of the
+        pharmacy's rows holding the whole quantity, at that row's price.
+        """
+        index = self.locator.index
+        cached = self._batches.get(medication_id)
+        if cached is not None and cached[0] is index:
+            return cached
+        positions, prices, quantities = [], [], []
+        for row in sorted(self.by_medication.get(medication_id, {}).values(), key=pick_order):
+            position = index.positions.get(row["pharmacy_id"])
+            if position is not None:
+                positions.append(position)
+                prices.append(float(row.get("price") or 0))
+                quantities.append(row["quantity"])
+        cached = (index, np.array(positions, dtype=np.int64), np.array(prices), np.array(quantities))
+        self._batches[medication_id] = cached
+        return cached
+
+    def _nearest(self, medication_id, lat, lng, radius_km, limit):
+        self.locator.sync()
+        index, pharmacy_ids, positions, prices, quantities = self.offers(medication_id)
+        if not len(positions):
+            return []
+        alive = index.alive[positions]
+        distances = haversine_km(lat, lng, index.lats[positions], index.lngs[positions])
+        keep = alive if radius_km is None else alive & (distances <= radius_km)
+        candidates = np.flatnonzero(keep)
+        candidates = candidates[np.argsort(distances[candidates], kind="stable")[:limit]]
+        results = []
+        for i in candidates:
+            pharmacy = self.locator.directory.by_id.get(pharmacy_ids[i])
+            if pharmacy is not None:
+                results.append({
+                    **pharmacy,
+                    "price": float(prices[i]),
+                    "quantity": int(quantities[i]),
+                    "distance_km": round(float(distances[i]), 3),
+                })
+        return results
+
+    def nearest(self, medication_id, lat, lng, radius_km=None, limit=20):
+        self.locator.directory.get()
+        self.ensure_loaded()
+        return self._nearest(medication_id, lat, lng, radius_km, limit)
+
+    async def anearest(self, medication_id, lat, lng, radius_km=None, limit=20):
+        await self.locator.directory.aget()
+        if self.locator.index_version != self.locator.directory.version:
+            await db.run_sync(self.locator.sync)
+        await self.aensure_loaded()
+        return self._nearest(medication_id, lat, lng, radius_km, limit)
+
+    def stats(self):
+        return {
+            "medications": len(self.by_medication),
+            "offers": len(self.medication_of),
+            "loads": self.loads,
+            "age_seconds": time.monotonic() - self.loaded_at if self.loaded_at else None,
+        }
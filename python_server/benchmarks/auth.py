@@ -0,0 +1,46 @@
+"""Microbenchmark for Firebase ID token verification.
+
+Compares a full RS256 verification per request with the verified-token cache
+and prints the per-call cost and the cache's hit/miss counters.
+
+    python benchmarks/auth.py --iterations 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_firebase import StubFirebase
+from firebase_tokens import PublicKeyCache, TokenVerifier
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+
+    firebase = StubFirebase("bench-project")
+    keys = PublicKeyCache(url="unused")
+    keys.load(firebase.certs, max_age=3600)
+    tokens = [firebase.token(f"user-{i}") for i in range(args.users)]
+
+    verifier = TokenVerifier("bench-project", keys=keys)
+    uncached = timed(lambda i: verifier._decode(tokens[i % len(tokens)]), args.iterations)
+    for token in tokens:
+        verifier.verify(token)
+    cached = timed(lambda i: verifier.verify(tokens[i % len(tokens)]), args.iterations)
+
+    print(f"uncached verify  {uncached:>9.2f} us/call")
+    print(f"cached verify    {cached:>9.2f} us/call  ({uncached / cached:.0f}x)")
+    print(f"token cache      {verifier.stats()['tokens']}")
+
+if __name__ == "__main__":
+    main()
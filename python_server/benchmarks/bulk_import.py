@@ -0,0 +1,121 @@
+"""POST /inventory/bulk: time to import a large CSV or JSONL upload, and the memory it takes.
+
+The Flask app runs in-process on the chosen backend: "sqlmodel" is a SQLite
+file, "supabase" is the stub PostgREST with --latency-ms per round trip. The
+upload is generated into a temporary file and streamed from disk, one SKU
+per row (medication x batch number). The import runs twice: untraced for the
+wall time, then under tracemalloc at the full size and at a tenth of it.
+"Retained" is what is still allocated afterwards, mostly the new rows in the
+app's StockIndex; "working set" is the peak above that. For comparison,
+--single rows go through the one-row POST /inventory.
+
+    python benchmarks/bulk_import.py --rows 100000 --format csv --backend sqlmodel
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_firebase import StubFirebase
+from benchmarks.stub_postgrest import StubPostgrest
+
+def write_upload(path, rows, medications, fmt):
+    with open(path, "w", newline="") as f:
+        if fmt == "csv":
+            f.write("medication_id,quantity,price,in_stock,expiry_date,batch_number\n")
+        for i in range(rows):
+            medication_id, batch = f"med-{i % medications:05d}", f"B{i // medications}"
+            if fmt == "csv":
+                f.write(f"{medication_id},{i % 50},{100 + i % 900}.5,true,2027-06-30,{batch}\n")
+            else:
+                f.write(json.dumps({"medicationId": medication_id, "quantity": i % 50, "price": 100 + i % 900 + 0.5,
+                                    "inStock": True, "expiryDate": "2027-06-30", "batchNumber": batch}) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--backend", choices=("sqlmodel", "supabase"), default="sqlmodel")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="stub PostgREST latency (supabase backend)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--medications", type=int, default=2000)
+    parser.add_argument("--single", type=int, default=200, help="rows to send through POST /inventory one by one")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bulk-import-")
+    firebase = StubFirebase("bench").start()
+    os.environ.update(VITE_FIREBASE_PROJECT_ID="bench", FIREBASE_CERTS_URL=firebase.certs_url)
+    stub = None
+    if args.backend == "supabase":
+        stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+        os.environ.update(STORAGE_BACKEND="supabase", SUPABASE_URL=stub.url, SUPABASE_SERVICE_KEY="stub.stub.stub")
+    else:
+        os.environ.update(STORAGE_BACKEND="sqlmodel", STORAGE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    import app as flask_app
+
+    medications = [{"id": f"med-{i:05d}", "name": f"Medication {i}", "is_otc": True, "price": 100.0}
+                   for i in range(args.medications)]
+    owners = [{"id": f"owner-{n}", "email": f"owner{n}@example.com", "pharmacy_id": f"pharm-{n}"} for n in range(4)]
+    pharmacies = [{"id": f"pharm-{n}", "name": f"Pharmacy {n}", "address": "Lagos", "phone": "0800"} for n in range(4)]
+    if stub is not None:
+        stub.database.seed("medication", medications)
+        stub.database.seed("user", owners)
+        stub.database.seed("pharmacy", pharmacies)
+    else:
+        for table, rows in (("medication", medications), ("user", owners), ("pharmacy", pharmacies)):
+            flask_app.supabase.table(table).insert(rows).execute()
+    client = flask_app.app.test_client()
+    content_type = "text/csv" if args.format == "csv" else "application/x-ndjson"
+
+    def upload(owner, rows):
+        path = os.path.join(workdir, f"upload-{rows}.{args.format}")
+        if not os.path.exists(path):
+            write_upload(path, rows, args.medications, args.format)
+        headers = {"Authorization": f"Bearer {firebase.token(owner)}", "Content-Type": content_type}
+        with open(path, "rb") as f:
+            response = client.post("/inventory/bulk", headers=headers, input_stream=f,
+                                   query_string={"batch_size": args.batch_size},
+                                   environ_base={"CONTENT_LENGTH": str(os.path.getsize(path))})
+        report = response.get_json()
+        assert response.status_code == 200 and report["failed"] == 0, (response.status_code, report)
+        return report
+
+    start = time.perf_counter()
+    report = upload("owner-0", args.rows)
+    elapsed = time.perf_counter() - start
+    print(f"{args.rows} {args.format} rows on {args.backend}: {elapsed:.2f} s "
+          f"({args.rows / elapsed:,.0f} rows/s, {report['batches']} batches of {args.batch_size})")
+
+    start = time.perf_counter()
+    upload("owner-0", args.rows)
+    elapsed = time.perf_counter() - start
+    print(f"re-import of the same rows (all updates): {elapsed:.2f} s")
+
+    for owner, rows in (("owner-1", args.rows // 10), ("owner-2", args.rows)):
+        tracemalloc.start()
+        upload(owner, rows)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{rows} rows: working set {(peak - retained) / 2**20:.1f} MiB, retained {retained / 2**20:.1f} MiB")
+
+    if args.single:
+        headers = {"Authorization": f"Bearer {firebase.token('owner-3')}"}
+        start = time.perf_counter()
+        for i in range(args.single):
+            response = client.post("/inventory", headers=headers, json={
+                "medication_id": f"med-{i % args.medications:05d}", "quantity": 5, "price": 100.5,
+            })
+            assert response.status_code == 201, response.get_json()
+        per_row = (time.perf_counter() - start) / args.single
+        print(f"one-row POST /inventory: {per_row * 1000:.2f} ms per row, "
+              f"{per_row * args.rows:.0f} s projected for {args.rows} rows")
+    if stub is not None:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
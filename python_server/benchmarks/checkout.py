@@ -0,0 +1,260 @@
+"""Concurrent POST /checkout against a SQLite stand-in for the checkout() SQL function.
+
+Boots fastapi_app.py against the stub PostgREST and routes rpc/checkout to a
+SQLite database that mirrors functions.sql: guarded decrements, one order per
+pharmacy, batched order_item inserts and the cart cleared, all in one
+transaction. Two phases run:
+
+  contended    every user checks out the same SKU, which has less stock than
+               there are buyers; exactly `stock` checkouts may succeed.
+  independent  every user buys a different SKU; measures checkout latency.
+
+Exits non-zero if any unit is oversold or a successful order is inconsistent.
+
+    python benchmarks/checkout.py --users 200 --stock 50 --concurrency 32 --latency-ms 20
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import free_port, percentile, wait_until_up, boot_fastapi
+from benchmarks.stub_firebase import StubFirebase
+from benchmarks.stub_postgrest import StubPostgrest
+
+SCHEMA = """
+CREATE TABLE inventory (
+  id TEXT PRIMARY KEY, pharmacy_id TEXT NOT NULL, medication_id TEXT NOT NULL,
+  quantity INTEGER NOT NULL, price REAL NOT NULL, in_stock INTEGER NOT NULL DEFAULT 1,
+  expiry_date TEXT, last_updated TEXT
+);
+CREATE INDEX idx_inventory_pharmacy_medication ON inventory(pharmacy_id, medication_id);
+CREATE TABLE cart (id TEXT PRIMARY KEY, user_id TEXT NOT NULL UNIQUE);
+CREATE TABLE cart_item (
+  id TEXT PRIMARY KEY, cart_id TEXT NOT NULL, medication_id TEXT NOT NULL, medication_name TEXT NOT NULL,
+  dosage TEXT, quantity INTEGER NOT NULL, unit_price REAL NOT NULL, total_price REAL NOT NULL
+);
+CREATE TABLE "order" (
+  id TEXT PRIMARY KEY, user_id TEXT NOT NULL, pharmacy_id TEXT NOT NULL, status TEXT NOT NULL,
+  total REAL NOT NULL, delivery_address TEXT NOT NULL, delivery_city TEXT, delivery_state TEXT,
+  delivery_latitude REAL, delivery_longitude REAL, created_at TEXT
+);
+CREATE TABLE order_item (
+  id TEXT PRIMARY KEY, order_id TEXT NOT NULL, medication_id TEXT NOT NULL, medication_name TEXT,
+  dosage TEXT, quantity INTEGER NOT NULL, unit_price REAL NOT NULL, subtotal REAL NOT NULL, inventory_id TEXT
+);
+"""
+
+class CheckoutError(Exception):
+    pass
+
+class SqliteCheckout:
+    """Python/SQLite translation of checkout() in functions.sql.
+
+    SQLite has no row locks; BEGIN IMMEDIATE takes the write lock for the whole
+    transaction, which is stricter than the Postgres function's row locks.
+    The guarded decrement is the same statement in both.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def __call__(self, stub_db, payload):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = self._checkout(conn, payload)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _checkout(self, conn, payload):
+        routes = payload.get("p_routes") or {}
+        delivery = payload.get("p_delivery") or {}
+        lines = [dict(row) for row in conn.execute(
+            "SELECT ci.* FROM cart_item ci JOIN cart c ON c.id = ci.cart_id WHERE c.user_id = ?",
+            (payload["p_user_id"],),
+        )]
+        if not lines:
+            raise CheckoutError("empty_cart")
+        for line in lines:
+            line["pharmacy_id"] = routes.get(line["medication_id"]) or payload.get("p_pharmacy_id")
+            if not line["pharmacy_id"]:
+                raise CheckoutError("unrouted_item")
+
+        reserved = []
+        for line in lines:
+            row = conn.execute(
+                """UPDATE inventory SET quantity = quantity - :qty, in_stock = quantity > :qty,
+                          last_updated = datetime('now')
+                   WHERE id = (SELECT id FROM inventory
+                               WHERE pharmacy_id = :pharmacy AND medication_id = :med AND in_stock AND quantity >= :qty
+                               ORDER BY expiry_date IS NULL, expiry_date, id LIMIT 1)
+                     AND quantity >= :qty
+                   RETURNING *""",
+                {"qty": line["quantity"], "pharmacy": line["pharmacy_id"], "med": line["medication_id"]},
+            ).fetchone()
+            if row is None:
+                raise CheckoutError("insufficient_stock")
+            reserved.append(dict(row))
+            line["inventory_id"] = row["id"]
+            line["unit_price"] = row["price"]
+            line["subtotal"] = row["price"] * line["quantity"]
+
+        orders = {}
+        for line in lines:
+            order = orders.get(line["pharmacy_id"])
+            if order is None:
+                order = orders[line["pharmacy_id"]] = {
+                    "id": str(uuid.uuid4()), "user_id": payload["p_user_id"], "pharmacy_id": line["pharmacy_id"],
+                    "status": "created", "total": 0.0,
+                    **{key: delivery.get(key) for key in ("delivery_address", "delivery_city", "delivery_state",
+                                                          "delivery_latitude", "delivery_longitude")},
+                    "items": [],
+                }
+            order["total"] += line["subtotal"]
+            order["items"].append({
+                "id": str(uuid.uuid4()), "order_id": order["id"], "medication_id": line["medication_id"],
+                "medication_name": line["medication_name"], "dosage": line["dosage"], "quantity": line["quantity"],
+                "unit_price": line["unit_price"], "subtotal": line["subtotal"], "inventory_id": line["inventory_id"],
+            })
+        conn.executemany(
+            """INSERT INTO "order" (id, user_id, pharmacy_id, status, total, delivery_address, delivery_city,
+                                    delivery_state, delivery_latitude, delivery_longitude, created_at)
+               VALUES (:id, :user_id, :pharmacy_id, :status, :total, :delivery_address, :delivery_city,
+                       :delivery_state, :delivery_latitude, :delivery_longitude, datetime('now'))""",
+            list(orders.values()),
+        )
+        conn.executemany(
+            """INSERT INTO order_item (id, order_id, medication_id, medication_name, dosage, quantity, unit_price, subtotal,
+                                       inventory_id)
+               VALUES (:id, :order_id, :medication_id, :medication_name, :dosage, :quantity, :unit_price, :subtotal,
+                       :inventory_id)""",
+            [item for order in orders.values() for item in order["items"]],
+        )
+        conn.executemany("DELETE FROM cart_item WHERE id = ?", [(line["id"],) for line in lines])
+        for row in reserved:
+            row["in_stock"] = bool(row["in_stock"])
+        return {"orders": list(orders.values()), "inventory": reserved}
+
+def seed(store, users, stock):
+    with store.connect() as conn:
+        conn.executemany(
+            "INSERT INTO inventory (id, pharmacy_id, medication_id, quantity, price, in_stock) VALUES (?, ?, ?, ?, ?, 1)",
+            [("inv-hot", "pharm-1", "med-hot", stock, 1500.0)]
+            + [(f"inv-{i}", "pharm-1", f"med-{i}", 10, 200.0 + i) for i in range(users)],
+        )
+
+def fill_carts(store, users, medication):
+    with store.connect() as conn:
+        conn.execute("DELETE FROM cart_item")
+        conn.executemany("INSERT OR IGNORE INTO cart (id, user_id) VALUES (?, ?)",
+                         [(f"cart-{u}", f"user-{u}") for u in range(users)])
+        conn.executemany(
+            "INSERT INTO cart_item (id, cart_id, medication_id, medication_name, quantity, unit_price, total_price) "
+            "VALUES (?, ?, ?, ?, 1, 0, 0)",
+            [(str(uuid.uuid4()), f"cart-{u}", medication(u), "Paracetamol 500mg") for u in range(users)],
+        )
+
+async def checkout_all(base_url, tokens, concurrency):
+    latencies = []
+    statuses = {}
+    gate = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(token):
+            async with gate:
+                await post(token)
+
+        async def post(token):
+            start = time.perf_counter()
+            response = await client.post("/checkout", headers={"Authorization": f"Bearer {token}"},
+                                         json={"pharmacy_id": "pharm-1", "delivery_address": "12 Marina, Lagos"})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await asyncio.gather(*(one(token) for token in tokens))
+    return statuses, latencies
+
+def report(label, statuses, latencies):
+    print(f"{label:<12} statuses {dict(sorted(statuses.items()))}  p50 {percentile(latencies, 50) * 1000:6.1f} ms  "
+          f"p95 {percentile(latencies, 95) * 1000:6.1f} ms  p99 {percentile(latencies, 99) * 1000:6.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--stock", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=32, help="checkouts in flight at once")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="checkout-bench-")
+    store = SqliteCheckout(os.path.join(workdir, "checkout.db"))
+    seed(store, args.users, args.stock)
+
+    stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+    stub.database.register_rpc("checkout", store, locked=False)
+    firebase = StubFirebase("bench-project").start()
+    tokens = [firebase.token(f"user-{u}") for u in range(args.users)]
+    port = free_port()
+    server = boot_fastapi(stub.url, port, {"FIREBASE_CERTS_URL": firebase.certs_url})
+    failures = []
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url)
+
+        fill_carts(store, args.users, lambda u: "med-hot")
+        statuses, latencies = asyncio.run(checkout_all(base_url, tokens, args.concurrency))
+        report("contended", statuses, latencies)
+        with store.connect() as conn:
+            left = conn.execute("SELECT quantity FROM inventory WHERE id = 'inv-hot'").fetchone()[0]
+            sold = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_item WHERE medication_id = 'med-hot'").fetchone()[0]
+        expected = min(args.stock, args.users)
+        print(f"             stock {args.stock}, sold {sold}, left {left}")
+        if left < 0 or sold + left != args.stock or statuses.get(201, 0) != expected or sold != expected:
+            failures.append("contended checkout oversold or lost stock")
+
+        fill_carts(store, args.users, lambda u: f"med-{u}")
+        statuses, latencies = asyncio.run(checkout_all(base_url, tokens, args.concurrency))
+        report("independent", statuses, latencies)
+        with store.connect() as conn:
+            mismatched = conn.execute(
+                """SELECT COUNT(*) FROM "order" o
+                   WHERE o.total != (SELECT SUM(subtotal) FROM order_item WHERE order_id = o.id)"""
+            ).fetchone()[0]
+            leftover = conn.execute("SELECT COUNT(*) FROM cart_item").fetchone()[0]
+        if statuses.get(201, 0) != args.users or mismatched or leftover:
+            failures.append("independent checkouts did not all complete consistently")
+        print(f"             rpc calls {stub.database.calls['rpc:checkout']} for {2 * args.users} checkouts")
+    finally:
+        server.terminate()
+        server.wait()
+        stub.stop()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
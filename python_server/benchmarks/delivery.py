@@ -0,0 +1,69 @@
+"""Latency of live delivery quotes (distance, fee, ETA) from one customer location.
+
+Quotes every pharmacy of a synthetic national set in one NumPy pass, then
+the rows of a /pharmacies page and a /pharmacies/nearby result.
+
+    python benchmarks/delivery.py --pharmacies 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.geo import synthetic_points
+from delivery import DeliveryQuoter
+from geo import PharmacyLocator
+from snapshot import SnapshotCache
+
+def timed(fn, queries):
+    samples = []
+    for lat, lng in queries:
+        start = time.perf_counter()
+        fn(lat, lng)
+        samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1e6
+    return np.percentile(samples, 50), np.percentile(samples, 99)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pharmacies", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--page", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    lats, lngs = synthetic_points(args.pharmacies, rng)
+    rows = [{"id": f"pharm-{i:06d}", "name": f"Pharmacy {i}", "latitude": float(lat), "longitude": float(lng),
+             "delivery_fee": float(rng.choice([0, 0, 300, 600])), "is_active": True}
+            for i, (lat, lng) in enumerate(zip(lats, lngs))]
+    directory = SnapshotCache(lambda: rows)
+    quoter = DeliveryQuoter(directory)
+    locator = PharmacyLocator(directory)
+    directory.get()
+    start = time.perf_counter()
+    quoter.sync()
+    print(f"build {args.pharmacies} pharmacies: {(time.perf_counter() - start) * 1000:.1f} ms")
+    locator.sync()
+
+    centres = rng.integers(0, args.pharmacies, args.queries)
+    queries = [(lats[i] + 0.01, lngs[i] - 0.01) for i in centres]
+    page = rows[:args.page]
+    for label, fn in [
+        (f"all {args.pharmacies}", quoter.quote_all),
+        (f"page of {args.page}", lambda lat, lng: quoter.annotate(page, lat, lng)),
+        ("nearby k=20", lambda lat, lng: quoter.annotate(locator.nearby(lat, lng, None, 20), lat, lng)),
+    ]:
+        p50, p99 = timed(fn, queries)
+        print(f"{label:<14} p50 {p50:>7.0f} us  p99 {p99:>7.0f} us")
+
+    distance, fee, eta = quoter.quote_all(*queries[0])
+    nearest = np.argsort(distance)[:3]
+    for i in nearest:
+        print(f"  {rows[i]['id']}: {distance[i]:.2f} km, fee {fee[i]:.2f}, eta {eta[i]:.0f} min")
+
+if __name__ == "__main__":
+    main()
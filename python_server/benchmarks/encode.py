@@ -0,0 +1,100 @@
+"""CPU cost per request of a 10k-row /medications response, before and after the fast JSON path.
+
+Both apps run in-process against a stub PostgREST; the catalog is warmed first
+so only validation, encoding and compression are measured. The compressed rows
+also include the test client decompressing the body.
+
+    python benchmarks/encode.py --rows 10000 --requests 30
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_postgrest import StubPostgrest
+from benchmarks.stub_firebase import StubFirebase
+
+def medication_rows(n):
+    return [{
+        "id": f"med-{i:06d}", "name": f"Paracetamol Tablet {i}", "strength": "500mg", "dosage": "1-2 tablets every 6 hours",
+        "manufacturer": "Emzor Pharmaceuticals", "category": "Pain Relief", "description": "Relieves mild to moderate pain and fever.",
+        "form_factor": "Tablet", "requires_prescription": False, "is_otc": True, "price": 150.0 + i % 500,
+        "image_url": None, "created_at": "2025-01-01T00:00:00+00:00",
+    } for i in range(n)]
+
+def measure(get, requests):
+    get()
+    size = None
+    start = time.process_time()
+    for _ in range(requests):
+        size = get()
+    return (time.process_time() - start) / requests * 1000, size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=30)
+    args = parser.parse_args()
+
+    stub = StubPostgrest().start()
+    stub.database.seed("medication", medication_rows(args.rows))
+    firebase = StubFirebase("bench").start()
+    os.environ.update(
+        SUPABASE_URL=stub.url, SUPABASE_SERVICE_KEY="stub.stub.stub", VITE_FIREBASE_PROJECT_ID="bench",
+        FIREBASE_CERTS_URL=firebase.certs_url, MAX_PAGE_SIZE=str(args.rows),
+    )
+
+    from fastapi.testclient import TestClient
+    from flask.json.provider import DefaultJSONProvider
+    import fastapi_app
+    import app as flask_app
+
+    @fastapi_app.app.get("/__legacy/medications", response_model=List[Dict[str, Any]])
+    async def legacy_medications():
+        return await fastapi_app.medication_catalog.aget()
+
+    def fastapi_get(client, path, encoding):
+        def get():
+            response = client.get(path, headers={"Accept-Encoding": encoding})
+            assert response.status_code == 200, response.text
+            return response.num_bytes_downloaded, response.headers.get("content-encoding", "identity")
+        return get
+
+    print(f"{args.rows} rows, {args.requests} requests each, CPU ms per request")
+    with TestClient(fastapi_app.app) as client:
+        client.get(f"/medications?limit={args.rows}")
+        for label, path, encoding in [
+            ("fastapi default response_model", "/__legacy/medications", "identity"),
+            ("fastapi fast path", f"/medications?limit={args.rows}", "identity"),
+            ("fastapi fast path + gzip", f"/medications?limit={args.rows}", "gzip"),
+            ("fastapi fast path + br", f"/medications?limit={args.rows}", "br, gzip"),
+        ]:
+            cpu, (size, used) = measure(fastapi_get(client, path, encoding), args.requests)
+            print(f"  {label:<34} {cpu:8.2f} ms  {size / 1024:8.0f} KiB ({used})")
+
+    flask = flask_app.app
+    fast_provider = flask.json
+    client = flask.test_client()
+
+    def flask_get(encoding):
+        def get():
+            response = client.get(f"/medications?limit={args.rows}", headers={"Accept-Encoding": encoding})
+            assert response.status_code == 200, response.data
+            return len(response.data), response.headers.get("Content-Encoding", "identity")
+        return get
+
+    for label, provider, encoding in [
+        ("flask jsonify (stdlib json)", DefaultJSONProvider(flask), "identity"),
+        ("flask fast path", fast_provider, "identity"),
+        ("flask fast path + gzip", fast_provider, "gzip"),
+    ]:
+        flask.json = provider
+        cpu, (size, used) = measure(flask_get(encoding), args.requests)
+        print(f"  {label:<34} {cpu:8.2f} ms  {size / 1024:8.0f} KiB ({used})")
+    stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Latency of nearest-pharmacy queries on a synthetic national pharmacy set.
+
+    python benchmarks/geo.py --pharmacies 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import GridIndex
+
+# Rough population centres (lat, lng, share of pharmacies); the rest are
+# scattered uniformly over Nigeria's bounding box.
+CITIES = [(6.52, 3.38, 0.30), (9.06, 7.49, 0.10), (7.38, 3.93, 0.08), (12.00, 8.52, 0.08), (4.82, 7.03, 0.06)]
+
+def synthetic_points(n, rng):
+    lats, lngs = [], []
+    for lat, lng, share in CITIES:
+        k = int(n * share)
+        lats.append(rng.normal(lat, 0.15, k))
+        lngs.append(rng.normal(lng, 0.15, k))
+    rest = n - sum(len(a) for a in lats)
+    lats.append(rng.uniform(4.3, 13.9, rest))
+    lngs.append(rng.uniform(2.7, 14.7, rest))
+    return np.concatenate(lats), np.concatenate(lngs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pharmacies", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    lats, lngs = synthetic_points(args.pharmacies, rng)
+    index = GridIndex()
+    start = time.perf_counter()
+    index.build(zip(range(args.pharmacies), lats, lngs))
+    print(f"build {args.pharmacies} points: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    centres = rng.integers(0, args.pharmacies, args.queries)
+    for label, radius, limit in [("knn k=20", None, 20), ("radius 5km", 5.0, 50), ("radius 20km", 20.0, 100)]:
+        samples = []
+        for i in centres:
+            start = time.perf_counter()
+            index.query(lats[i] + 0.003, lngs[i] - 0.003, radius, limit)
+            samples.append(time.perf_counter() - start)
+        samples = np.array(samples) * 1e6
+        print(f"{label:<12} p50 {np.percentile(samples, 50):>7.0f} us  p99 {np.percentile(samples, 99):>7.0f} us")
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add(f"new-{i}", 6.5 + i * 1e-4, 3.4)
+    print(f"incremental add: {(time.perf_counter() - start) / 1000 * 1e6:.0f} us/pharmacy")
+
+if __name__ == "__main__":
+    main()
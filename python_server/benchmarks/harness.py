@@ -0,0 +1,368 @@
+"""Repeatable load test for fastapi_app.py and app.py.
+
+Boots each app as a real server (uvicorn / gunicorn gthread) against the stub
+PostgREST and stub Firebase, drives a weighted mix of user journeys from
+--concurrency closed-loop clients, and reports requests/sec, p50/p95/p99 per
+action and overall, and Supabase calls per request (from the stub's counters).
+
+Mix categories: browse (catalog, search, pharmacies, availability), cart
+(add / update / remove / view, FastAPI), inventory (list / create / delete,
+Flask) and sync (sync-user, half new users). Categories an app does not serve
+are skipped for that app.
+
+--backend sqlmodel runs the apps on a seeded local SQLite database instead
+(STORAGE_BACKEND=sqlmodel); Supabase call counts are then not available.
+
+Results go to --output as JSON; --compare a previous file to print the change
+and exit non-zero when RPS or p95 regress by more than --tolerance.
+
+    python benchmarks/harness.py --app both --latency-ms 20 --concurrency 32 --duration 15 \\
+        --output results.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import SERVER_DIR, free_port, percentile, wait_until_up
+from benchmarks.stub_firebase import StubFirebase
+from benchmarks.stub_postgrest import StubPostgrest, install_cart_functions
+
+PROJECT_ID = "bench-project"
+LAGOS = (6.5244, 3.3792)
+
+def world(medications, pharmacies, users, seed=7):
+    rng = random.Random(seed)
+    medication_rows = [{
+        "id": f"med-{i:05d}", "name": f"{rng.choice(['Paracetamol', 'Ibuprofen', 'Vitamin C', 'Loratadine', 'Omeprazole'])} {i}",
+        "strength": "500mg", "dosage": "1 tablet", "manufacturer": "Emzor Pharmaceuticals", "category": "Pain Relief",
+        "is_otc": True, "price": 100.0 + i,
+    } for i in range(medications)]
+    pharmacy_rows = [{
+        "id": f"pharm-{i:04d}", "name": f"Pharmacy {i}", "address": "Lagos", "phone": "0800", "is_active": True,
+        "latitude": LAGOS[0] + rng.gauss(0, 0.05), "longitude": LAGOS[1] + rng.gauss(0, 0.05), "delivery_fee": 500.0,
+    } for i in range(pharmacies)]
+    inventory_rows = [{
+        "id": f"inv-{p:04d}-{m:05d}", "pharmacy_id": f"pharm-{p:04d}", "medication_id": f"med-{m:05d}",
+        "quantity": rng.randint(1, 50), "price": round(120.0 + m * rng.uniform(0.9, 1.1), 2), "in_stock": True,
+    } for p in range(pharmacies) for m in range(medications) if rng.random() < 0.2]
+    # Rows serve both schemas: Flask looks users up by id, FastAPI by firebase_uid.
+    user_rows = [{
+        "id": f"user-{u}", "firebase_uid": f"user-{u}", "email": f"user{u}@example.com", "name": f"User {u}",
+        "role": "pharmacy_owner", "pharmacy_id": f"pharm-{u % pharmacies:04d}",
+    } for u in range(users)]
+    return {"medication": medication_rows, "pharmacy": pharmacy_rows, "inventory": inventory_rows, "user": user_rows}
+
+class Session:
+    """One virtual user: identity, HTTP client and the ids it has created."""
+
+    def __init__(self, client, uid, token, rng, data):
+        self.client = client
+        self.uid = uid
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.rng = rng
+        self.data = data
+        self.cart_items = []
+        self.inventory_ids = []
+
+    def medication_id(self):
+        return self.rng.choice(self.data["medication"])["id"]
+
+    def near(self):
+        return LAGOS[0] + self.rng.gauss(0, 0.03), LAGOS[1] + self.rng.gauss(0, 0.03)
+
+async def list_medications(s):
+    return await s.client.get("/medications", params={"limit": 50})
+
+async def medication_detail(s):
+    return await s.client.get(f"/medications/{s.medication_id()}")
+
+async def search_medications(s):
+    return await s.client.get("/medications/search", params={"q": s.rng.choice(["para", "ibu", "vitamin", "lora"])})
+
+async def list_pharmacies(s):
+    return await s.client.get("/pharmacies", params={"limit": 50})
+
+async def nearby_pharmacies(s):
+    lat, lng = s.near()
+    return await s.client.get("/pharmacies/nearby", params={"lat": lat, "lng": lng, "limit": 10})
+
+async def availability(s):
+    lat, lng = s.near()
+    return await s.client.get(f"/medications/{s.medication_id()}/availability", params={"lat": lat, "lng": lng})
+
+async def view_cart(s):
+    return await s.client.get("/cart", headers=s.headers)
+
+async def add_to_cart(s):
+    response = await s.client.post("/cart/add", headers=s.headers,
+                                   json={"medication_id": s.medication_id(), "quantity": s.rng.randint(1, 3)})
+    if response.status_code == 200 and response.json()["id"] not in s.cart_items:
+        s.cart_items.append(response.json()["id"])
+    return response
+
+async def update_cart_item(s):
+    if not s.cart_items:
+        return await add_to_cart(s)
+    return await s.client.patch(f"/cart/items/{s.rng.choice(s.cart_items)}", headers=s.headers,
+                                json={"quantity": s.rng.randint(1, 5)})
+
+async def remove_cart_item(s):
+    if not s.cart_items:
+        return await add_to_cart(s)
+    return await s.client.delete(f"/cart/items/{s.cart_items.pop()}", headers=s.headers)
+
+async def list_inventory(s):
+    return await s.client.get("/inventory", headers=s.headers, params={"limit": 50})
+
+async def create_inventory(s):
+    response = await s.client.post("/inventory", headers=s.headers, json={
+        "medication_id": s.medication_id(), "quantity": s.rng.randint(1, 40), "price": 150.0, "in_stock": True,
+    })
+    if response.status_code == 201:
+        s.inventory_ids.append(response.json()["id"])
+    return response
+
+async def delete_inventory(s):
+    if not s.inventory_ids:
+        return await create_inventory(s)
+    return await s.client.delete(f"/inventory/{s.inventory_ids.pop()}", headers=s.headers)
+
+async def sync_user(s):
+    uid = s.uid if s.rng.random() < 0.5 else f"new-{uuid.uuid4()}"
+    return await s.client.post("/auth/sync-user", json={
+        "firebase_uid": uid, "email": f"{uid}@example.com", "name": "Ada", "surname": "Obi",
+        "first_name": "Ada", "last_name": "Obi",
+    })
+
+# (weight, action) per category, for each app.
+ACTIONS = {
+    "fastapi": {
+        "browse": [(3, list_medications), (2, medication_detail), (2, search_medications), (1, list_pharmacies),
+                   (1, nearby_pharmacies), (1, availability)],
+        "cart": [(2, view_cart), (3, add_to_cart), (2, update_cart_item), (2, remove_cart_item)],
+        "sync": [(1, sync_user)],
+    },
+    "flask": {
+        "browse": [(3, list_medications), (2, search_medications), (1, list_pharmacies), (1, nearby_pharmacies),
+                   (1, availability)],
+        "inventory": [(2, list_inventory), (2, create_inventory), (1, delete_inventory)],
+        "sync": [(1, sync_user)],
+    },
+}
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {category for actions in ACTIONS.values() for category in actions}
+    if unknown:
+        raise SystemExit(f"unknown mix categories: {', '.join(sorted(unknown))}")
+    return mix
+
+def app_mix(app, mix):
+    categories = [(weight, ACTIONS[app][name]) for name, weight in mix.items() if name in ACTIONS[app] and weight > 0]
+    actions = [(category_weight * weight / sum(w for w, _ in category), action)
+               for category_weight, category in categories for weight, action in category]
+    return [action for _, action in actions], [weight for weight, _ in actions]
+
+def boot(app, port, env, workers, threads):
+    if app == "fastapi":
+        command = [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--port", str(port),
+                   "--workers", str(workers), "--log-level", "warning", "--no-access-log"]
+    else:
+        command = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+                   "--workers", str(workers), "--worker-class", "gthread", "--threads", str(threads),
+                   "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=SERVER_DIR, env={**os.environ, **env})
+
+async def drive(base_url, actions, weights, tokens, data, args):
+    samples = {action.__name__: [] for action in actions}
+    errors = {action.__name__: 0 for action in actions}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    recording = False
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker(n, deadline):
+            rng = random.Random(args.seed * 1000 + n)
+            # Each worker owns its users so cart and inventory state is not shared between clients.
+            sessions = [Session(client, uid, tokens[uid], rng, data) for k, uid in enumerate(tokens)
+                        if k % args.concurrency == n]
+            while time.perf_counter() < deadline:
+                session = rng.choice(sessions)
+                action = rng.choices(actions, weights)[0]
+                start = time.perf_counter()
+                try:
+                    response = await action(session)
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                if recording:
+                    samples[action.__name__].append(time.perf_counter() - start)
+                    errors[action.__name__] += failed
+
+        if args.warmup > 0:
+            await asyncio.gather(*(worker(n, time.perf_counter() + args.warmup) for n in range(args.concurrency)))
+        await args.reset_stats()
+        recording = True
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n, started + args.duration) for n in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return samples, errors, elapsed
+
+def summarize(samples, errors, elapsed):
+    def stats(values, failed):
+        return {
+            "requests": len(values), "errors": failed,
+            "p50_ms": round(percentile(values, 50) * 1000, 2), "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    everything = [value for values in samples.values() for value in values]
+    overall = stats(everything, sum(errors.values()))
+    overall["rps"] = round(len(everything) / elapsed, 1)
+    return overall, {name: stats(values, errors[name]) for name, values in samples.items() if values}
+
+def run(app, args, stub, firebase, data):
+    port = free_port()
+    env = {"VITE_FIREBASE_PROJECT_ID": PROJECT_ID, "FIREBASE_CERTS_URL": firebase.certs_url}
+    if args.backend == "stub":
+        env.update(SUPABASE_URL=stub.url, SUPABASE_SERVICE_KEY="stub.stub.stub", STORAGE_BACKEND="supabase")
+    else:
+        env.update(STORAGE_BACKEND="sqlmodel", STORAGE_URL=args.storage_url)
+    env.update(dict(item.split("=", 1) for item in args.env))
+
+    async def reset_stats():
+        if stub is not None:
+            async with httpx.AsyncClient() as client:
+                await client.get(f"{stub.url}/__reset")
+
+    args.reset_stats = reset_stats
+    actions, weights = app_mix(app, args.mix)
+    tokens = {f"user-{u}": firebase.token(f"user-{u}") for u in range(max(args.users, args.concurrency))}
+    server = boot(app, port, env, args.workers, args.threads)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url, timeout=60)
+        samples, errors, elapsed = asyncio.run(drive(base_url, actions, weights, tokens, data, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    overall, per_action = summarize(samples, errors, elapsed)
+    result = {"app": app, **overall, "actions": per_action}
+    if stub is not None:
+        calls = dict(httpx.get(f"{stub.url}/__stats").json())
+        result["supabase_calls"] = calls
+        result["supabase_calls_per_request"] = round(sum(calls.values()) / max(overall["requests"], 1), 3)
+    return result
+
+def report(result):
+    calls = result.get("supabase_calls_per_request")
+    print(f"{result['app']:<8} {result['rps']:>8.1f} req/s  p50 {result['p50_ms']:>7.1f} ms  p95 {result['p95_ms']:>7.1f} ms  "
+          f"p99 {result['p99_ms']:>7.1f} ms  errors {result['errors']}/{result['requests']}  "
+          f"supabase calls/request {'n/a' if calls is None else f'{calls:.2f}'}")
+    for name, stats in sorted(result["actions"].items()):
+        print(f"  {name:<20} {stats['requests']:>7}  p50 {stats['p50_ms']:>7.1f}  p95 {stats['p95_ms']:>7.1f}  "
+              f"p99 {stats['p99_ms']:>7.1f}  errors {stats['errors']}")
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {result["app"]: result for result in json.load(f)["results"]}
+    regressions = []
+    print(f"compared with {baseline_path}")
+    for result in results:
+        before = baseline.get(result["app"])
+        if before is None:
+            continue
+        rps = result["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        p95 = result["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        print(f"  {result['app']:<8} rps {before['rps']:.1f} -> {result['rps']:.1f} ({rps:+.1%})  "
+              f"p95 {before['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms ({p95:+.1%})")
+        if rps < -tolerance or p95 > tolerance:
+            regressions.append(result["app"])
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=["fastapi", "flask", "both"], default="both")
+    parser.add_argument("--backend", choices=["stub", "sqlmodel"], default="stub")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("browse=60,cart=25,inventory=25,sync=10"),
+                        help="category=weight list, e.g. browse=70,cart=30")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="injected per stub PostgREST request")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn threads per Flask worker")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--medications", type=int, default=500)
+    parser.add_argument("--pharmacies", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra server environment")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="previous --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed fractional RPS / p95 regression")
+    args = parser.parse_args()
+
+    data = world(args.medications, args.pharmacies, max(args.users, args.concurrency))
+    firebase = StubFirebase(PROJECT_ID).start()
+    stub = None
+    if args.backend == "stub":
+        stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+        install_cart_functions(stub.database)
+    else:
+        from storage import SQLModelClient
+
+        args.storage_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='harness-'), 'bench.db')}"
+        client = SQLModelClient(args.storage_url)
+        for table, rows in data.items():
+            for start in range(0, len(rows), 500):
+                client.table(table).insert(rows[start:start + 500]).execute()
+        client.engine.dispose()
+
+    results = []
+    try:
+        for app in (["fastapi", "flask"] if args.app == "both" else [args.app]):
+            if stub is not None:
+                stub.database.tables.clear()
+                for table, rows in data.items():
+                    stub.database.seed(table, rows)
+            result = run(app, args, stub, firebase, data)
+            report(result)
+            results.append(result)
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    if args.output:
+        meta = {key: value for key, value in vars(args).items() if key not in ("reset_stats", "mix")}
+        meta.update(mix=args.mix, revision=git_revision(), python=platform.python_version(),
+                    cpus=os.cpu_count(), timestamp=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"wrote {args.output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""CPU cost per request of the metrics layer (MetricsMiddleware, timed storage calls, Server-Timing).
+
+Each app serves a cached read and an authenticated read that makes one
+storage call, in-process, once with METRICS_ENABLED=0 and once with it on.
+Storage is an in-memory SQLite database (STORAGE_BACKEND=sqlmodel) so no stub
+server threads share the measured CPU. Every configuration runs in its own
+interpreter because the flag is read at import time; each figure is the best
+of --repeat runs. On a busy machine the app figures are noisy, so the cost
+of the instrumentation itself (what one request with three storage calls adds)
+is also timed in isolation: MetricsMiddleware around a bare ASGI handler
+that runs the auth / encode timers and three storage calls on a no-op builder.
+
+    python benchmarks/instrumentation.py --requests 1000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def measure(requests, repeat):
+    from benchmarks.stub_firebase import StubFirebase
+
+    firebase = StubFirebase("bench").start()
+    os.environ.update(STORAGE_BACKEND="sqlmodel", STORAGE_URL="sqlite://", VITE_FIREBASE_PROJECT_ID="bench",
+                      FIREBASE_CERTS_URL=firebase.certs_url)
+    from fastapi.testclient import TestClient
+    import fastapi_app
+    import app as flask_app
+
+    storage = fastapi_app.supabase
+    storage.table("medication").insert([{"id": f"med-{i}", "name": f"Medication {i}", "is_otc": True, "price": 100.0}
+                                        for i in range(50)]).execute()
+    storage.table("user").insert({"id": "user-1", "firebase_uid": "user-1", "pharmacy_id": "pharm-1"}).execute()
+
+    headers = {"Authorization": f"Bearer {firebase.token('user-1')}"}
+    results = {}
+
+    def run(label, get):
+        get()
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.process_time()
+            for _ in range(requests):
+                get()
+            best = min(best, time.process_time() - start)
+        results[label] = best / requests * 1e6
+
+    with TestClient(fastapi_app.app) as client:
+        run("fastapi cached read", lambda: client.get("/medications/med-1"))
+        run("fastapi read + 1 storage call", lambda: client.get("/auth/user", headers=headers))
+    client = flask_app.app.test_client()
+    run("flask cached read", lambda: client.get("/medications?limit=10"))
+    run("flask read + 1 storage call", lambda: client.get("/inventory?limit=10", headers=headers))
+    return results
+
+class _Query:
+    def select(self, *args, **kwargs):
+        return self
+
+    eq = limit = order = select
+
+    def execute(self):
+        return None
+
+class _Client:
+    def table(self, name):
+        return _Query()
+
+def primitives(requests=20000):
+    """Microseconds the metrics layer adds to one ASGI request that makes three storage calls."""
+    import asyncio
+    import metrics
+
+    async def handler(client, scope, receive, send):
+        with metrics.timer("auth"):
+            pass
+        for _ in range(3):
+            client.table("inventory").select("*").eq("pharmacy_id", "p").limit(10).execute()
+        with metrics.timer("encode"):
+            body = b"{}"
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def send(message):
+        pass
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def per_request(app):
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app({"type": "http", "method": "GET", "path": "/inventory", "headers": []}, receive, send)
+        return (time.perf_counter() - start) / requests * 1e6
+
+    bare_client, timed_client = _Client(), metrics.InstrumentedClient(_Client())
+    bare = lambda scope, receive, send: handler(bare_client, scope, receive, send)
+    timed = metrics.MetricsMiddleware(lambda scope, receive, send: handler(timed_client, scope, receive, send))
+    costs = [asyncio.run(per_request(app)) for app in (bare, timed, bare, timed)]
+    return min(costs[1], costs[3]) - min(costs[0], costs[2])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.requests, args.repeat)))
+        return
+
+    runs = {"0": {}, "1": {}}
+    # Alternate off / on runs and keep the best of each, to damp drift on shared machines.
+    for enabled in ("0", "1") * 2:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "--requests", str(args.requests),
+                                 "--repeat", str(args.repeat)],
+                                env={**os.environ, "METRICS_ENABLED": enabled}, capture_output=True, text=True,
+                                check=True).stdout
+        for label, cost in json.loads(output.strip().splitlines()[-1]).items():
+            runs[enabled][label] = min(cost, runs[enabled].get(label, cost))
+    print(f"metrics layer alone: {primitives():.1f} us per request (middleware, auth/encode timers, 3 storage calls)")
+    print(f"CPU us per request over {args.requests} requests")
+    for label in runs["0"]:
+        off, on = runs["0"][label], runs["1"][label]
+        print(f"  {label:<32} off {off:8.1f}  on {on:8.1f}  overhead {on - off:+7.1f} us ({on / off - 1:+.1%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Inventory sweeper: cost of one sweep and of GET /inventory/alerts against a per-request scan.
+
+Seeds a SQLite database (STORAGE_BACKEND=sqlmodel) with --pharmacies x
+--rows-per-pharmacy inventory rows, a few percent of them expired, expiring
+or low on stock, and runs the Flask app in-process. Prints the SQLite query
+plans of the sweeper's range queries, the time of one sweep, and the latency
+of GET /inventory/alerts next to loading and classifying the pharmacy's whole
+inventory on each request, which is what the endpoint would otherwise do.
+
+    python benchmarks/inventory_alerts.py --pharmacies 100 --rows-per-pharmacy 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import percentile
+from benchmarks.stub_firebase import StubFirebase
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pharmacies", type=int, default=100)
+    parser.add_argument("--rows-per-pharmacy", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    firebase = StubFirebase("bench").start()
+    database = os.path.join(tempfile.mkdtemp(prefix="inventory-alerts-"), "bench.db")
+    os.environ.update(STORAGE_BACKEND="sqlmodel", STORAGE_URL=f"sqlite:///{database}", VITE_FIREBASE_PROJECT_ID="bench",
+                      FIREBASE_CERTS_URL=firebase.certs_url, INVENTORY_SWEEP_INTERVAL="0")
+    import app as flask_app
+    from inventory_sweeper import ALERT_COLUMNS
+
+    rng = random.Random(3)
+    now = datetime.utcnow()
+    flask_app.supabase.table("user").insert({"id": "owner", "email": "owner@example.com", "pharmacy_id": "pharm-0000"}).execute()
+    for p in range(args.pharmacies):
+        rows = []
+        for i in range(args.rows_per_pharmacy):
+            roll = rng.random()
+            days = rng.uniform(-20, -1) if roll < 0.01 else rng.uniform(1, 25) if roll < 0.03 else rng.uniform(60, 700)
+            rows.append({
+                "pharmacy_id": f"pharm-{p:04d}", "medication_id": f"med-{i:05d}", "price": 100.0,
+                "quantity": rng.randint(0, 10) if rng.random() < 0.03 else rng.randint(11, 200),
+                "expiry_date": (now + timedelta(days=days)).isoformat(),
+            })
+        flask_app.supabase.table("inventory").insert(rows, returning="minimal").execute()
+    total = args.pharmacies * args.rows_per_pharmacy
+    print(f"{total} inventory rows over {args.pharmacies} pharmacies")
+
+    with flask_app.supabase.engine.connect() as conn:
+        for label, where in (("low stock", "quantity <= 10"), ("expiry window", "expiry_date >= '2000-01-01' AND expiry_date < '2100-01-01'")):
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN SELECT {ALERT_COLUMNS} FROM inventory WHERE {where}").fetchall()
+            print(f"plan ({label}): {'; '.join(row[-1] for row in plan)}")
+
+    sweeper = flask_app.inventory_sweeper
+    start = time.perf_counter()
+    flipped = sweeper.sweep()
+    print(f"first sweep: {(time.perf_counter() - start) * 1000:.0f} ms, {len(flipped)} rows marked out of stock, "
+          f"{sweeper.stats()['rows']} alert rows kept")
+    start = time.perf_counter()
+    sweeper.sweep()
+    print(f"steady sweep: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    client = flask_app.app.test_client()
+    headers = {"Authorization": f"Bearer {firebase.token('owner')}"}
+    client.get("/inventory/alerts", headers=headers)
+    served = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        response = client.get("/inventory/alerts", headers=headers)
+        served.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_json()
+    scanned = []
+    for _ in range(max(args.requests // 10, 5)):
+        start = time.perf_counter()
+        rows = flask_app.db.select_all(lambda: flask_app.supabase.table("inventory").select(ALERT_COLUMNS)
+                                       .eq("pharmacy_id", "pharm-0000"))
+        [row for row in rows if sweeper.alerting(row, now)]
+        scanned.append(time.perf_counter() - start)
+    print(f"GET /inventory/alerts from the sweeper: p50 {percentile(served, 50) * 1000:.2f} ms  "
+          f"p99 {percentile(served, 99) * 1000:.2f} ms")
+    print(f"scan of the pharmacy's {args.rows_per_pharmacy} rows per request: p50 {percentile(scanned, 50) * 1000:.2f} ms  "
+          f"p99 {percentile(scanned, 99) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Load benchmark for fastapi_app.py against a local stub PostgREST.
+
+Runs the same read mix twice: once with Supabase queries executed inline on the
+event loop (SUPABASE_EXECUTOR_WORKERS=0, the old behaviour) and once with the
+thread-pool offload, and prints requests/sec and latency percentiles.
+
+    python benchmarks/load.py --latency-ms 20 --concurrency 64 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_postgrest import StubPostgrest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def seed(database, medications=200, pharmacies=50):
+    database.seed("medication", [
+        {"id": f"med-{i}", "name": f"Medication {i}", "strength": "500mg",
+         "manufacturer": "Emzor Pharmaceuticals", "category": "Pain Relief",
+         "is_otc": True, "price": 100 + i}
+        for i in range(medications)
+    ])
+    database.seed("pharmacy", [
+        {"id": f"pharm-{i}", "name": f"Pharmacy {i}", "address": "Lagos",
+         "phone": "0800", "is_active": True}
+        for i in range(pharmacies)
+    ])
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def wait_until_up(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/health").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"server at {url} did not start")
+
+def boot_fastapi(stub_url, port, extra_env=None):
+    env = dict(os.environ)
+    env.update({
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_SERVICE_KEY": "stub.stub.stub",
+        "VITE_FIREBASE_PROJECT_ID": "bench-project",
+    })
+    env.update(extra_env or {})
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=SERVER_DIR, env=env,
+    )
+
+async def drive(base_url, paths, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker(n):
+            nonlocal errors
+            i = n
+            while time.perf_counter() < deadline:
+                path = paths[i % len(paths)]
+                i += concurrency
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+def run(label, stub_url, args, extra_env):
+    port = free_port()
+    server = boot_fastapi(stub_url, port, extra_env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_up(base_url)
+        paths = ["/medications"] + [f"/medications/med-{i}" for i in range(20)] + \
+                [f"/pharmacies/pharm-{i}" for i in range(10)]
+        result = asyncio.run(drive(base_url, paths, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"{label:<10} {result['rps']:>9.1f} req/s  p50 {result['p50_ms']:>7.1f} ms  "
+          f"p99 {result['p99_ms']:>7.1f} ms  errors {result['errors']}")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=32, help="executor size for the 'after' run")
+    args = parser.parse_args()
+
+    stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+    seed(stub.database)
+    try:
+        run("before", stub.url, args, {"SUPABASE_EXECUTOR_WORKERS": "0"})
+        run("after", stub.url, args, {"SUPABASE_EXECUTOR_WORKERS": str(args.workers)})
+    finally:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
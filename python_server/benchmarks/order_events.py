@@ -0,0 +1,153 @@
+"""GET /orders/{id}/events: memory per idle SSE subscriber and status fan-out latency.
+
+Boots fastapi_app.py on a SQLite database (STORAGE_BACKEND=sqlmodel) with
+--orders orders, opens --subscribers event streams spread over them and
+measures the server's resident memory before, at half and at all of them
+connected. Then it moves one order per round through confirmed, dispatched,
+delivered and completed with PATCH /orders/{id}/status and reports how long
+after each PATCH was sent its subscribers received the event. With
+--workers > 1 the workers share events through EVENTS_BACKEND=unix and the
+streams are spread over the workers by the kernel.
+
+    python benchmarks/order_events.py --subscribers 10000 --orders 100 --workers 1
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import SERVER_DIR, free_port, percentile, wait_until_up
+from benchmarks.stub_firebase import StubFirebase
+
+STATUSES = ("confirmed", "dispatched", "delivered", "completed")
+
+def rss_bytes(pid):
+    """Resident memory of the server and its worker processes."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except FileNotFoundError:
+        pass
+    total = 0
+    for p in pids:
+        with open(f"/proc/{p}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+    return total
+
+class Subscriber:
+    def __init__(self, order_id):
+        self.order_id = order_id
+        self.received = {}
+
+    async def connect(self, port, token):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 14)
+        self.writer.write((f"GET /orders/{self.order_id}/events?access_token={token} HTTP/1.1\r\n"
+                           f"Host: bench\r\nAccept: text/event-stream\r\n\r\n").encode())
+        await self.writer.drain()
+        status = await self.reader.readline()
+        if b" 200 " not in status:
+            raise RuntimeError(f"{self.order_id}: {status!r}")
+        while await self.reader.readline() not in (b"\r\n", b""):
+            pass
+        await self.read_event()
+
+    async def read_event(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return None
+            if b'"status":"' in line:
+                status = line.split(b'"status":"', 1)[1].split(b'"', 1)[0].decode()
+                self.received[status] = time.perf_counter()
+                return status
+
+    async def listen(self):
+        while await self.read_event() not in (None, "completed"):
+            pass
+        self.writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    firebase = StubFirebase("bench-project").start()
+    database = os.path.join(tempfile.mkdtemp(prefix="order-events-"), "bench.db")
+    os.environ.update(STORAGE_BACKEND="sqlmodel", STORAGE_URL=f"sqlite:///{database}")
+    import storage
+    client = storage.create_client()
+    client.table("user").insert([
+        {"firebase_uid": "customer", "email": "customer@example.com"},
+        {"firebase_uid": "owner", "email": "owner@example.com", "pharmacy_id": "pharm-0"},
+    ]).execute()
+    orders = [f"order-{i:05d}" for i in range(args.orders)]
+    client.table("order").insert([{"id": order_id, "user_id": "customer", "pharmacy_id": "pharm-0",
+                                   "status": "created", "delivery_address": "Lagos"} for order_id in orders]).execute()
+
+    port = free_port()
+    env = dict(os.environ, VITE_FIREBASE_PROJECT_ID="bench-project", FIREBASE_CERTS_URL=firebase.certs_url,
+               EVENTS_BACKEND="unix" if args.workers > 1 else "local",
+               EVENTS_SOCKET_DIR=tempfile.mkdtemp(prefix="order-events-sockets-"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--port", str(port), "--workers", str(args.workers),
+         "--log-level", "warning", "--no-access-log", "--backlog", "4096"],
+        cwd=SERVER_DIR, env=env,
+    )
+
+    async def run():
+        token = firebase.token("customer")
+        owner = {"Authorization": f"Bearer {firebase.token('owner')}"}
+        subscribers = [Subscriber(orders[i % len(orders)]) for i in range(args.subscribers)]
+        baseline = rss_bytes(server.pid)
+        connected = 0
+        for target in (len(subscribers) // 2, len(subscribers)):
+            while connected < target:
+                batch = subscribers[connected:min(connected + 200, target)]
+                await asyncio.gather(*(s.connect(port, token) for s in batch))
+                connected += len(batch)
+            await asyncio.sleep(1)
+            rss = rss_bytes(server.pid)
+            print(f"{connected:>6} subscribers: server RSS {rss / 2**20:7.1f} MiB, "
+                  f"{(rss - baseline) / connected / 1024:5.1f} KiB per subscriber")
+
+        listeners = [asyncio.ensure_future(s.listen()) for s in subscribers]
+        by_order = {}
+        for s in subscribers:
+            by_order.setdefault(s.order_id, []).append(s)
+        delays = {status: [] for status in STATUSES}
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) as http:
+            for order_id in orders:
+                for status in STATUSES:
+                    sent = time.perf_counter()
+                    response = await http.patch(f"/orders/{order_id}/status", headers=owner, json={"status": status})
+                    assert response.status_code == 200, response.text
+                    # Wait for this order's subscribers before the next change, so every event is observed.
+                    while not all(status in s.received for s in by_order[order_id]):
+                        await asyncio.sleep(0.0005)
+                    delays[status] += [s.received[status] - sent for s in by_order[order_id]]
+        await asyncio.wait_for(asyncio.gather(*listeners), 60)
+        everything = [d for values in delays.values() for d in values]
+        print(f"status changes reached {len(everything)} subscriptions: p50 {percentile(everything, 50) * 1000:.2f} ms  "
+              f"p99 {percentile(everything, 99) * 1000:.2f} ms  max {max(everything) * 1000:.2f} ms after the PATCH was sent")
+
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}")
+        asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Cart routing (POST /cart/quote) on synthetic geography.
+
+Pharmacies are scattered around a few city centres; each stocks a random
+share of the catalogue, with rare medications stocked by only a handful.
+Reports quote latency for both objectives, the cost of shortlisting candidate
+pharmacies, and the optimality gap of greedy set cover + local search against
+brute force on small instances.
+
+    python benchmarks/routing.py --pharmacies 5000 --cart 20
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import routing
+from availability import StockIndex
+from geo import PharmacyLocator
+from routing import CartRouter, greedy_cover, local_search, selection_cost
+from snapshot import SnapshotCache
+
+CITIES = [(6.5244, 3.3792), (6.4550, 3.3941), (6.6018, 3.3515), (7.3775, 3.9470), (9.0765, 7.3986)]
+
+def synthetic_world(pharmacies, medications, rng):
+    pharmacy_rows = []
+    for i in range(pharmacies):
+        lat, lng = rng.choice(CITIES)
+        pharmacy_rows.append({
+            "id": f"pharm-{i}", "name": f"Pharmacy {i}", "is_active": True,
+            "latitude": lat + rng.gauss(0, 0.08), "longitude": lng + rng.gauss(0, 0.08),
+            "delivery_fee": rng.choice([300, 500, 700, 1000, 1500]),
+        })
+    # Popularity falls off steeply: common medications are everywhere, rare ones almost nowhere.
+    popularity = [max(0.002, 0.6 / (1 + j / 40)) for j in range(medications)]
+    inventory = []
+    for row in pharmacy_rows:
+        for j in range(medications):
+            if rng.random() < popularity[j]:
+                inventory.append({
+                    "id": f"inv-{row['id']}-{j}", "pharmacy_id": row["id"], "medication_id": f"med-{j}",
+                    "price": round((500 + 20 * j) * rng.uniform(0.92, 1.08), 2),
+                    "quantity": rng.randint(0, 40), "in_stock": True,
+                })
+    return pharmacy_rows, inventory
+
+def brute_force(costs, fees, max_size=4):
+    best = np.inf
+    for size in range(1, max_size + 1):
+        for combo in itertools.combinations(range(len(fees)), size):
+            best = min(best, selection_cost(costs, fees, list(combo)))
+    return best
+
+def optimality_gap(rng, trials=200):
+    gaps = []
+    for _ in range(trials):
+        pharmacies, items = rng.randint(6, 14), rng.randint(3, 8)
+        costs = np.where(np.random.default_rng(rng.randrange(1 << 30)).random((pharmacies, items)) < 0.45,
+                         np.array([[rng.uniform(500, 3000) for _ in range(items)] for _ in range(pharmacies)]), np.inf)
+        costs = costs[:, np.isfinite(costs).any(axis=0)]
+        if not costs.shape[1]:
+            continue
+        fees = np.array([rng.choice([300, 500, 1000, 1500]) for _ in range(pharmacies)], dtype=float)
+        selected, cost = local_search(costs, fees, greedy_cover(costs, fees))
+        exact = brute_force(costs, fees, max_size=min(pharmacies, 5))
+        gaps.append(cost / exact - 1)
+    return gaps
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pharmacies", type=int, default=5000)
+    parser.add_argument("--medications", type=int, default=400)
+    parser.add_argument("--cart", type=int, default=20)
+    parser.add_argument("--quotes", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    start = time.perf_counter()
+    pharmacy_rows, inventory = synthetic_world(args.pharmacies, args.medications, rng)
+    directory = SnapshotCache(lambda: pharmacy_rows)
+    stock = StockIndex(lambda: inventory, PharmacyLocator(directory))
+    router = CartRouter(stock)
+    router.quote([{"medication_id": "med-0"}], *CITIES[0])
+    print(f"{args.pharmacies} pharmacies, {len(inventory)} inventory rows, "
+          f"setup {time.perf_counter() - start:.1f} s")
+
+    for objective in ("cheapest", "fastest"):
+        samples, stops, missing = [], [], 0
+        for _ in range(args.quotes):
+            lat, lng = rng.choice(CITIES)
+            cart = [{"medication_id": f"med-{j}", "quantity": rng.randint(1, 3)}
+                    for j in rng.sample(range(args.medications), args.cart)]
+            start = time.perf_counter()
+            quote = router.quote(cart, lat + rng.gauss(0, 0.05), lng + rng.gauss(0, 0.05), objective)
+            samples.append((time.perf_counter() - start) * 1000)
+            stops.append(len(quote["pharmacies"]))
+            missing += len(quote["unavailable"])
+        samples.sort()
+        pct = lambda p: samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+        print(f"  {objective:<9} p50 {pct(50):6.1f} ms  p95 {pct(95):6.1f} ms  p99 {pct(99):6.1f} ms  "
+              f"mean pharmacies/order {sum(stops) / len(stops):.2f}  unavailable items {missing}")
+
+    carts = [[{"medication_id": f"med-{j}", "quantity": 1} for j in rng.sample(range(args.medications), args.cart)]
+             for _ in range(30)]
+    shortlisted = [router.quote(cart, *CITIES[0])["total"] for cart in carts]
+    routing.SHORTLIST_BY_COVERAGE = args.pharmacies
+    full = [router.quote(cart, *CITIES[0])["total"] for cart in carts]
+    extra = [a / b - 1 for a, b in zip(shortlisted, full)]
+    print(f"shortlist vs searching every pharmacy: mean {100 * sum(extra) / len(extra):+.2f}%, "
+          f"worst {100 * max(extra):+.2f}%")
+
+    gaps = optimality_gap(rng)
+    print(f"optimality vs brute force ({len(gaps)} small instances): "
+          f"optimal in {sum(g < 1e-9 for g in gaps)}, mean gap {100 * sum(gaps) / len(gaps):.2f}%, "
+          f"worst {100 * max(gaps):.2f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Latency of /medications/search lookups on a synthetic catalog.
+
+    python benchmarks/search.py --skus 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex
+
+NAMES = [
+    "Paracetamol", "Ibuprofen", "Vitamin C", "Aspirin", "Loratadine", "Omeprazole", "Cetirizine",
+    "Multivitamin", "Diclofenac", "Naproxen", "Ranitidine", "Famotidine", "Chlorpheniramine",
+    "Guaifenesin", "Dextromethorphan", "Zinc", "Folic Acid", "Iron", "Calcium", "Magnesium",
+    "Loperamide", "Oral Rehydration Salts", "Hydrocortisone", "Clotrimazole", "Miconazole",
+]
+MANUFACTURERS = [
+    "Emzor Pharmaceuticals", "May & Baker", "HealthGuard", "Bayer", "GlaxoSmithKline", "AstraZeneca",
+    "UCB Pharma", "Centrum", "Fidson", "Swiss Pharma", "Neimeth", "Greenfield",
+]
+CATEGORIES = ["Pain Relief", "Supplements", "Antihistamine", "Gastrointestinal", "Cold & Flu", "Skin Care"]
+FORMS = ["Tablet", "Capsule", "Syrup", "Suspension", "Cream", "Sachet"]
+
+def synthetic_catalog(n, rng):
+    rows = []
+    for i in range(n):
+        base = rng.choice(NAMES)
+        rows.append({
+            "id": f"med-{i}",
+            "name": f"{base} {rng.choice(FORMS)} {rng.choice(['', 'Extra', 'Plus', 'Forte', 'Junior', 'Max'])} {i % 997}".replace("  ", " "),
+            "strength": f"{rng.choice([5, 10, 20, 200, 250, 400, 500, 1000])}mg",
+            "manufacturer": rng.choice(MANUFACTURERS),
+            "category": rng.choice(CATEGORIES),
+        })
+    return rows
+
+def typo(word, rng):
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=3000)
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    rows = synthetic_catalog(args.skus, rng)
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.build(rows)
+    print(f"build {args.skus} SKUs: {(time.perf_counter() - start) * 1000:.0f} ms, {len(index.vocabulary)} tokens")
+
+    queries = []
+    for _ in range(args.queries):
+        name = rng.choice(NAMES).lower()
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(name[:rng.randint(1, len(name))])
+        elif kind < 0.6:
+            queries.append(typo(name, rng))
+        elif kind < 0.8:
+            queries.append(f"{name.split()[0]} {rng.choice(['500', '4', 'tab', 'syr'])}")
+        else:
+            queries.append(f"{rng.choice(MANUFACTURERS).split()[0].lower()} {name[:3]}")
+
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, limit=10)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    pct = lambda p: samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+    print(f"search p50 {pct(50):.0f} us  p95 {pct(95):.0f} us  p99 {pct(99):.0f} us  max {samples[-1]:.0f} us")
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add({"id": f"new-{i}", "name": f"Newdrug {i}", "strength": "5mg", "manufacturer": "Fidson"})
+    print(f"incremental add: {(time.perf_counter() - start) / 1000 * 1e6:.0f} us/SKU")
+    print("examples:")
+    for query in ["para", "paracetmol", "ibuprofen 400", "emzor par", "vit"]:
+        print(f"  {query!r:<16} -> {[row['name'] for row in index.search(query, limit=3)]}")
+
+if __name__ == "__main__":
+    main()
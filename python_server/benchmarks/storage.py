@@ -0,0 +1,127 @@
+"""Per-query latency of the storage backends on the same data and query mix.
+
+"supabase" is the postgrest client against the stub PostgREST (add
+--latency-ms to model the network hop to the hosted project); "sqlmodel" is
+storage.SQLModelClient on a SQLite file, and on Postgres too when --postgres-url
+is given. Each operation runs --requests times spread over --threads threads.
+The cart rpc runs only on the SQLModel backends; the stub has no functions.sql.
+
+    python benchmarks/storage.py --latency-ms 20 --threads 8
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supabase import create_client as create_supabase_client
+
+from availability import INVENTORY_COLUMNS
+from benchmarks.load import percentile
+from benchmarks.stub_postgrest import StubPostgrest
+from storage import SQLModelClient
+
+def dataset(medications, pharmacies):
+    medication_rows = [{"id": f"med-{i:05d}", "name": f"Medication {i}", "strength": "500mg", "dosage": "1 tablet",
+                        "manufacturer": "Emzor Pharmaceuticals", "is_otc": True, "price": 100.0 + i}
+                       for i in range(medications)]
+    pharmacy_rows = [{"id": f"pharm-{i:04d}", "name": f"Pharmacy {i}", "address": "Lagos", "phone": "0800",
+                      "is_active": True, "latitude": 6.5, "longitude": 3.4}
+                     for i in range(pharmacies)]
+    inventory_rows = [{"id": f"inv-{p:04d}-{m:05d}", "pharmacy_id": f"pharm-{p:04d}", "medication_id": f"med-{m:05d}",
+                       "quantity": 50, "price": 120.0 + m, "in_stock": True}
+                      for p in range(pharmacies) for m in range(0, medications, 7)]
+    return {"medication": medication_rows, "pharmacy": pharmacy_rows, "inventory": inventory_rows}
+
+def load(client, data):
+    for table, rows in data.items():
+        for start in range(0, len(rows), 500):
+            client.table(table).insert(rows[start:start + 500]).execute()
+
+def operations(data, with_rpc):
+    medications = [row["id"] for row in data["medication"]]
+    pharmacies = [row["id"] for row in data["pharmacy"]]
+
+    def by_id(client, rng):
+        client.table("medication").select("*").eq("id", rng.choice(medications)).execute()
+
+    def page(client, rng):
+        client.table("medication").select("id,name,price").gt("id", rng.choice(medications)).order("id").limit(50).execute()
+
+    def stock(client, rng):
+        client.table("inventory").select(INVENTORY_COLUMNS).eq("medication_id", rng.choice(medications[::7])) \
+            .eq("in_stock", True).gt("quantity", 0).execute()
+
+    def write(client, rng):
+        row = client.table("inventory").insert({
+            "pharmacy_id": rng.choice(pharmacies), "medication_id": rng.choice(medications), "quantity": 5, "price": 99.0,
+        }).execute().data[0]
+        client.table("inventory").update({"quantity": 4}).eq("id", row["id"]).execute()
+        client.table("inventory").delete().eq("id", row["id"]).execute()
+
+    def cart(client, rng):
+        user_id = f"user-{rng.randrange(1000)}"
+        item = client.rpc("add_to_cart", {"p_user_id": user_id, "p_medication_id": rng.choice(medications),
+                                          "p_quantity": 1}).execute().data[0]
+        client.rpc("remove_cart_item", {"p_user_id": user_id, "p_item_id": item["id"]}).execute()
+
+    ops = [("get by id", by_id), ("page of 50", page), ("stock lookup", stock), ("insert/update/delete", write)]
+    if with_rpc:
+        ops.append(("add + remove cart rpc", cart))
+    return ops
+
+def measure(client, op, requests, threads):
+    def one(seed):
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        op(client, rng)
+        return time.perf_counter() - start
+
+    op(client, random.Random(0))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        samples = list(pool.map(one, range(requests)))
+    return samples, requests / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--medications", type=int, default=2000)
+    parser.add_argument("--pharmacies", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every stub PostgREST request")
+    parser.add_argument("--postgres-url", help="also benchmark SQLModelClient on this (empty) Postgres database")
+    args = parser.parse_args()
+
+    data = dataset(args.medications, args.pharmacies)
+    stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+    for table, rows in data.items():
+        stub.database.seed(table, rows)
+    backends = [(f"supabase (stub, +{args.latency_ms:g} ms)", create_supabase_client(stub.url, "stub.stub.stub"), False)]
+
+    sqlite = SQLModelClient(f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='storage-bench-'), 'bench.db')}")
+    load(sqlite, data)
+    backends.append(("sqlmodel (sqlite)", sqlite, True))
+    if args.postgres_url:
+        postgres = SQLModelClient(args.postgres_url)
+        load(postgres, data)
+        backends.append(("sqlmodel (postgres)", postgres, True))
+
+    print(f"{args.medications} medications, {len(data['inventory'])} inventory rows, "
+          f"{args.requests} requests per operation on {args.threads} threads")
+    try:
+        for label, client, with_rpc in backends:
+            print(label)
+            for name, op in operations(data, with_rpc):
+                samples, throughput = measure(client, op, args.requests, args.threads)
+                print(f"  {name:<22} p50 {percentile(samples, 50) * 1000:7.2f} ms  "
+                      f"p95 {percentile(samples, 95) * 1000:7.2f} ms  {throughput:8.0f} ops/s")
+    finally:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
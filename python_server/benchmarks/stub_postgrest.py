@@ -0,0 +1,332 @@
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+# A tiny in-memory stand-in for PostgREST, good enough for the query shapes
+# the backends issue. Every response is delayed by `latency` seconds to model
+# the network round trip to Supabase.
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+def _fmt(value):
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if value is None:
+        return "null"
+    return str(value)
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+def _compare(left, right):
+    try:
+        return (float(left) > float(right)) - (float(left) < float(right))
+    except (TypeError, ValueError):
+        left, right = _fmt(left), right
+        return (left > right) - (left < right)
+
+def _matches(row, column, expr):
+    negate = expr.startswith("not.")
+    if negate:
+        expr = expr[4:]
+    op, _, value = expr.partition(".")
+    current = row.get(column)
+    if isinstance(current, bool) or value in ("True", "False", "None"):
+        # postgrest-py sends Python literals (eq.True); Postgres accepts any case.
+        value = value.lower().replace("none", "null")
+    if op == "eq":
+        result = _fmt(current) == value
+    elif op == "neq":
+        result = _fmt(current) != value
+    elif op == "is":
+        result = _fmt(current) == value
+    elif op == "in":
+        values = {_unquote(v) for v in value.strip("()").split(",") if v}
+        result = _fmt(current) in values
+    elif op in ("gt", "gte", "lt", "lte"):
+        if current is None:
+            result = False
+        else:
+            cmp = _compare(current, value)
+            result = {"gt": cmp > 0, "gte": cmp >= 0, "lt": cmp < 0, "lte": cmp <= 0}[op]
+    elif op == "ilike":
+        needle = value.replace("*", "").replace("%", "").lower()
+        result = needle in _fmt(current).lower()
+    else:
+        raise ValueError(f"unsupported operator {op}")
+    return result != negate
+
+class StubDatabase:
+    def __init__(self):
+        self.tables = {}
+        self.rpcs = {}
+        self.calls = Counter()
+        # Requests being answered right now, and the most seen at once.
+        self.active = 0
+        self.peak_active = 0
+        self.lock = threading.Lock()
+
+    def rows(self, table):
+        return self.tables.setdefault(table, [])
+
+    def seed(self, table, rows):
+        with self.lock:
+            target = self.rows(table)
+            for row in rows:
+                row = dict(row)
+                row.setdefault("id", str(uuid.uuid4()))
+                target.append(row)
+        return target
+
+    def register_rpc(self, name, fn, locked=True):
+        # Unlocked functions run outside the stub's lock and bring their own
+        # concurrency control (e.g. a real database transaction).
+        self.rpcs[name] = (fn, locked)
+
+    def filter(self, table, params):
+        rows = self.rows(table)
+        for column, expr in params:
+            if column in RESERVED_PARAMS:
+                continue
+            if expr.startswith("eq.") and expr[3:] not in ("True", "False", "None"):
+                # Plain equality is most lookups; comparing formatted values keeps big tables cheap to scan.
+                value = expr[3:]
+                rows = [row for row in rows if _fmt(row.get(column)) == value]
+            else:
+                rows = [row for row in rows if _matches(row, column, expr)]
+        return rows
+
+    def select(self, table, params):
+        rows = self.filter(table, params)
+        options = dict(params)
+        if "order" in options:
+            for clause in reversed(options["order"].split(",")):
+                column, _, direction = clause.partition(".")
+                rows = sorted(rows, key=lambda r: (r.get(column) is None, _fmt(r.get(column))),
+                              reverse=direction.startswith("desc"))
+        offset = int(options.get("offset", 0))
+        if "limit" in options:
+            rows = rows[offset:offset + int(options["limit"])]
+        elif offset:
+            rows = rows[offset:]
+        return [self.project(row, options.get("select", "*")) for row in rows]
+
+    def project(self, row, select):
+        if select in ("*", ""):
+            return dict(row)
+        return {column: row.get(column) for column in select.split(",")}
+
+    def insert(self, table, payload, params, prefer):
+        options = dict(params)
+        records = payload if isinstance(payload, list) else [payload]
+        conflict = options.get("on_conflict")
+        keys = conflict.split(",") if conflict else ["id"]
+        upsert = "resolution=" in prefer
+        result = []
+        rows = self.rows(table)
+        # One pass over the table per request, not per record, so bulk upserts stay linear;
+        # only rows whose key is in the payload are indexed.
+        index = {}
+        if upsert:
+            wanted = {tuple(_fmt(record.get(k)) for k in keys) for record in records}
+            for r in rows:
+                key = tuple(_fmt(r.get(k)) for k in keys)
+                if key in wanted and key not in index:
+                    index[key] = r
+        for record in records:
+            record = dict(record)
+            existing = None
+            if upsert and all(k in record for k in keys):
+                existing = index.get(tuple(_fmt(record[k]) for k in keys))
+            if existing is not None:
+                if "merge-duplicates" in prefer:
+                    existing.update(record)
+                    result.append(dict(existing))
+                continue
+            record.setdefault("id", str(uuid.uuid4()))
+            rows.append(record)
+            if upsert:
+                index.setdefault(tuple(_fmt(record.get(k)) for k in keys), record)
+            result.append(dict(record))
+        return result
+
+    def update(self, table, payload, params):
+        result = []
+        for row in self.filter(table, params):
+            row.update(payload)
+            result.append(dict(row))
+        return result
+
+    def delete(self, table, params):
+        doomed = self.filter(table, params)
+        ids = {id(row) for row in doomed}
+        self.tables[table] = [row for row in self.rows(table) if id(row) not in ids]
+        return [dict(row) for row in doomed]
+
+    def handle(self, method, path, params, payload, prefer):
+        name = path.rsplit("/", 1)[-1]
+        if "/rpc/" in path:
+            with self.lock:
+                self.calls[f"rpc:{name}"] += 1
+            if name not in self.rpcs:
+                return 404, {"code": "PGRST202", "message": f"function {name} not found", "details": None, "hint": None}
+            fn, locked = self.rpcs[name]
+            if not locked:
+                return 200, fn(self, payload or {})
+            with self.lock:
+                return 200, fn(self, payload or {})
+        with self.lock:
+            self.calls[f"{method}:{name}"] += 1
+            if method == "GET":
+                return 200, self.select(name, params)
+            if method == "POST":
+                return 201, self.insert(name, payload, params, prefer)
+            if method == "PATCH":
+                return 200, self.update(name, payload, params)
+            if method == "DELETE":
+                return 200, self.delete(name, params)
+        return 405, {"code": "PGRST000", "message": "method not allowed", "details": None, "hint": None}
+
+# In-memory versions of the cart functions in functions.sql, registered with
+# install_cart_functions(). They run under the stub's lock, like one transaction.
+
+def _user_cart(database, user_id, create=False):
+    cart = next((c for c in database.rows("cart") if c.get("user_id") == user_id), None)
+    if cart is None and create:
+        cart = {"id": str(uuid.uuid4()), "user_id": user_id}
+        database.rows("cart").append(cart)
+    return cart
+
+def _owned_item(database, payload):
+    cart = _user_cart(database, payload["p_user_id"])
+    if cart is None:
+        return None
+    return next((i for i in database.rows("cart_item")
+                 if i["id"] == payload["p_item_id"] and i["cart_id"] == cart["id"]), None)
+
+def stub_add_to_cart(database, payload):
+    med = next((m for m in database.rows("medication") if m["id"] == payload["p_medication_id"]), None)
+    if med is None:
+        return []
+    cart = _user_cart(database, payload["p_user_id"], create=True)
+    quantity = int(payload["p_quantity"])
+    price = float(med.get("price") or 0)
+    item = next((i for i in database.rows("cart_item")
+                 if i["cart_id"] == cart["id"] and i["medication_id"] == med["id"]), None)
+    if item is None:
+        item = {"id": str(uuid.uuid4()), "cart_id": cart["id"], "medication_id": med["id"],
+                "medication_name": med["name"], "dosage": med.get("dosage"), "quantity": 0}
+        database.rows("cart_item").append(item)
+    item["quantity"] += quantity
+    item["unit_price"] = price
+    item["total_price"] = item["quantity"] * price
+    return [dict(item)]
+
+def stub_update_cart_item(database, payload):
+    item = _owned_item(database, payload)
+    if item is None:
+        return []
+    item["quantity"] = int(payload["p_quantity"])
+    item["total_price"] = item["quantity"] * item["unit_price"]
+    return [dict(item)]
+
+def stub_remove_cart_item(database, payload):
+    item = _owned_item(database, payload)
+    if item is None:
+        return []
+    database.tables["cart_item"] = [i for i in database.rows("cart_item") if i is not item]
+    return [dict(item)]
+
+def install_cart_functions(database):
+    database.register_rpc("add_to_cart", stub_add_to_cart)
+    database.register_rpc("update_cart_item", stub_update_cart_item)
+    database.register_rpc("remove_cart_item", stub_remove_cart_item)
+    return database
+
+def make_handler(database, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _dispatch(self, method):
+            parts = urlsplit(self.path)
+            if parts.path == "/__stats":
+                return self._send(200, dict(database.calls))
+            if parts.path == "/__reset":
+                database.calls.clear()
+                return self._send(200, {})
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length)) if length else None
+            with database.lock:
+                database.active += 1
+                database.peak_active = max(database.peak_active, database.active)
+            try:
+                if latency:
+                    time.sleep(latency)
+                status, body = database.handle(
+                    method, parts.path, parse_qsl(parts.query, keep_blank_values=True),
+                    payload, self.headers.get("Prefer", ""),
+                )
+            except Exception as e:
+                # Same shape as PostgREST errors; postgrest-py needs every key.
+                status, body = 400, {"code": "P0001", "message": str(e), "details": None, "hint": None}
+            finally:
+                with database.lock:
+                    database.active -= 1
+            self._send(status, body)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PATCH(self):
+            self._dispatch("PATCH")
+
+        def do_DELETE(self):
+            self._dispatch("DELETE")
+
+    return Handler
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+class StubPostgrest:
+    def __init__(self, database=None, latency=0.0, host="127.0.0.1", port=0):
+        self.database = database or StubDatabase()
+        self.server = _Server((host, port), make_handler(self.database, latency))
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,102 @@
+"""Login storm on POST /auth/sync-user: 10k concurrent syncs against the stub PostgREST.
+
+Boots fastapi_app.py with --latency-ms per Supabase round trip and runs three
+waves of --users syncs from --concurrency clients:
+
+  signup    every user is new and is synced --duplicates times at once, as
+            when a flaky network retries; exactly one row per user may exist.
+  relaunch  the same users again, answered from the known-user cache.
+  cold      the same users on a worker with the cache disabled
+            (KNOWN_USERS_TTL=0), as after a restart.
+
+Prints wall time, p50/p99 and Supabase calls per sync for each wave, and
+exits non-zero on any error or duplicate user row.
+
+    python benchmarks/sync_user.py --users 10000 --concurrency 32 --latency-ms 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import boot_fastapi, free_port, percentile, wait_until_up
+from benchmarks.stub_postgrest import StubPostgrest
+
+async def storm(base_url, uids, concurrency):
+    latencies = []
+    errors = Counter()
+    queue = iter(uids)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def worker():
+            for uid in queue:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/auth/sync-user", json={
+                        "firebase_uid": uid, "email": f"{uid}@example.com", "name": "Ada", "surname": "Obi",
+                    })
+                    if response.status_code != 200:
+                        errors[response.status_code] += 1
+                except httpx.HTTPError as e:
+                    errors[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies, errors
+
+def wave(label, stub, port, uids, concurrency):
+    before = sum(stub.database.calls.values())
+    elapsed, latencies, errors = asyncio.run(storm(f"http://127.0.0.1:{port}", uids, concurrency))
+    calls = sum(stub.database.calls.values()) - before
+    print(f"{label:<9} {len(uids):>6} syncs in {elapsed:6.2f} s ({len(uids) / elapsed:>7.0f}/s)  "
+          f"p50 {percentile(latencies, 50) * 1000:7.1f} ms  p99 {percentile(latencies, 99) * 1000:7.1f} ms  "
+          f"{calls / len(uids):.2f} calls/sync  errors {dict(errors) or 0}")
+    return not errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--duplicates", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+    users = [f"storm-{i:06d}" for i in range(args.users)]
+    servers = []
+    ok = True
+    try:
+        port = free_port()
+        # The waves must not outlast the cache on a slow host.
+        servers.append(boot_fastapi(stub.url, port, {"KNOWN_USERS_TTL": "3600"}))
+        wait_until_up(f"http://127.0.0.1:{port}")
+        # Duplicates are adjacent so they are in flight together.
+        ok &= wave("signup", stub, port, [uid for uid in users for _ in range(args.duplicates)], args.concurrency)
+        ok &= wave("relaunch", stub, port, users, args.concurrency)
+
+        cold_port = free_port()
+        servers.append(boot_fastapi(stub.url, cold_port, {"KNOWN_USERS_TTL": "0"}))
+        wait_until_up(f"http://127.0.0.1:{cold_port}")
+        ok &= wave("cold", stub, cold_port, users, args.concurrency)
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        stub.stop()
+
+    rows = Counter(row.get("firebase_uid") for row in stub.database.rows("user"))
+    duplicated = sum(1 for count in rows.values() if count > 1)
+    print(f"user rows {sum(rows.values())} for {len(rows)} users, {duplicated} duplicated")
+    if duplicated or len(rows) != args.users or not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
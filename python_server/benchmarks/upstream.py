@@ -0,0 +1,92 @@
+"""Request bursts against the upstream guard: merged reads, capped concurrency and load shedding.
+
+Boots fastapi_app.py against the stub PostgREST (--latency-ms per round trip)
+and fires --burst simultaneous GET /medications/{id} for ids missing from the
+catalog snapshot, so every request needs a storage read:
+
+  identical  all requests ask for the same id; with merging on they share
+             one upstream call, unguarded (UPSTREAM_COALESCE=0,
+             UPSTREAM_MAX_CONCURRENCY=0) each makes its own.
+  distinct   every request asks for another id; with the limit off every
+             read reaches the stub at once, with UPSTREAM_MAX_CONCURRENCY=8
+             and UPSTREAM_MAX_QUEUE=64 at most 8 do and the overflow is
+             answered 503 with Retry-After.
+
+Prints status counts, latency, upstream calls and the stub's peak number of
+concurrent requests per run, then the guard's /metrics lines.
+
+    python benchmarks/upstream.py --burst 500 --latency-ms 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import boot_fastapi, free_port, percentile, seed, wait_until_up
+from benchmarks.stub_postgrest import StubPostgrest
+
+async def burst(base_url, paths):
+    limits = httpx.Limits(max_connections=len(paths), max_keepalive_connections=len(paths))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def one(path):
+            start = time.perf_counter()
+            response = await client.get(path)
+            retry_after = response.headers.get("retry-after")
+            return response.status_code, retry_after, time.perf_counter() - start
+
+        return await asyncio.gather(*(one(path) for path in paths))
+
+def run(label, stub, paths, extra_env, show_metrics=False):
+    port = free_port()
+    server = boot_fastapi(stub.url, port, {"SUPABASE_EXECUTOR_WORKERS": "32", **extra_env})
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}")
+        httpx.get(f"http://127.0.0.1:{port}/medications?limit=1")
+        before = stub.database.calls["GET:medication"]
+        stub.database.peak_active = 0
+        results = asyncio.run(burst(f"http://127.0.0.1:{port}", paths))
+        calls = stub.database.calls["GET:medication"] - before
+        statuses = Counter(status for status, _, _ in results)
+        served = [elapsed for status, _, elapsed in results if status != 503]
+        shed = [(retry, elapsed) for status, retry, elapsed in results if status == 503]
+        print(f"{label:<22} {dict(sorted(statuses.items()))}  upstream calls {calls:>4}  "
+              f"peak concurrent {stub.database.peak_active:>3}  "
+              f"served p50 {percentile(served, 50) * 1000:5.0f} ms p99 {percentile(served, 99) * 1000:5.0f} ms")
+        if shed:
+            print(f"{'':<22} shed p50 {percentile([e for _, e in shed], 50) * 1000:5.0f} ms, Retry-After {shed[0][0]}")
+        if show_metrics:
+            text = httpx.get(f"http://127.0.0.1:{port}/metrics").text
+            for line in text.splitlines():
+                if line.startswith("upstream_") and "_bucket" not in line:
+                    print(f"    {line}")
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--burst", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+    seed(stub.database)
+    try:
+        identical = ["/medications/not-in-catalog"] * args.burst
+        run("identical, merged", stub, identical, {}, show_metrics=True)
+        run("identical, unguarded", stub, identical, {"UPSTREAM_COALESCE": "0", "UPSTREAM_MAX_CONCURRENCY": "0"})
+        distinct = [f"/medications/missing-{i}" for i in range(args.burst)]
+        run("distinct, unguarded", stub, distinct, {"UPSTREAM_COALESCE": "0", "UPSTREAM_MAX_CONCURRENCY": "0"})
+        run("distinct, limit 8", stub, distinct,
+            {"UPSTREAM_MAX_CONCURRENCY": "8", "UPSTREAM_MAX_QUEUE": "64"}, show_metrics=True)
+    finally:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
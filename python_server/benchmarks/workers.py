@@ -0,0 +1,108 @@
+"""Throughput of the production server (gunicorn.conf.py) from 1 to N pre-forked workers.
+
+Boots each app with WEB_CONCURRENCY=1, 2, ... --max-workers against the stub
+PostgREST and stub Firebase, waits until /ready, then drives the catalog read
+mix (served from the in-memory snapshots, so the work is Python CPU time)
+from --concurrency keep-alive clients. Prints requests/sec, the speed-up over
+one worker, latency percentiles and how many distinct worker pids answered.
+
+Scaling needs cores to scale onto: by default --max-workers is the number of
+cores this process may run on, and the load generator shares them.
+
+    python benchmarks/workers.py --app both --max-workers 4 --concurrency 64 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load import SERVER_DIR, drive, free_port, seed
+from benchmarks.stub_firebase import StubFirebase
+from benchmarks.stub_postgrest import StubPostgrest
+
+PROJECT_ID = "bench-project"
+# Routes both apps serve.
+PATHS = (["/medications?limit=50", "/pharmacies", "/pharmacies?lat=6.5244&lng=3.3792",
+          "/pharmacies/nearby?lat=6.5244&lng=3.3792"] + [f"/medications/search?q=Medication+{i}" for i in range(10)])
+
+def boot(app, port, workers, env):
+    env = {
+        **os.environ, **env,
+        "SERVER_APP": app, "WEB_CONCURRENCY": str(workers), "HOST": "127.0.0.1", "PORT": str(port),
+        "GUNICORN_LOG_LEVEL": "warning", "GUNICORN_PIDFILE": "",
+    }
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], cwd=SERVER_DIR, env=env)
+
+def wait_until_ready(url, workers, timeout=60):
+    """Until /ready answers 200 from `workers` distinct pids (or the timeout passes)."""
+    ready = set()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            # A fresh connection per probe, so the probes spread over the workers.
+            response = httpx.get(f"{url}/ready")
+            if response.status_code == 200:
+                ready.add(response.json()["pid"])
+                if len(ready) >= workers:
+                    return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    if not ready:
+        raise RuntimeError(f"server at {url} did not become ready")
+
+def worker_pids(url, probes=50):
+    return {httpx.get(f"{url}/health").json()["worker"]["pid"] for _ in range(probes)}
+
+def run(app, workers, args, env):
+    port = free_port()
+    server = boot(app, port, workers, env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        wait_until_ready(base_url, workers)
+        asyncio.run(drive(base_url, PATHS, args.concurrency, args.warmup))
+        result = asyncio.run(drive(base_url, PATHS, args.concurrency, args.duration))
+        result["pids"] = len(worker_pids(base_url))
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", choices=["flask", "fastapi", "both"], default="both")
+    parser.add_argument("--max-workers", type=int, default=len(os.sched_getaffinity(0)))
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    cores = len(os.sched_getaffinity(0))
+    print(f"{cores} core(s) available, client and server share them")
+    stub = StubPostgrest(latency=args.latency_ms / 1000).start()
+    seed(stub.database)
+    firebase = StubFirebase(PROJECT_ID).start()
+    env = {"SUPABASE_URL": stub.url, "SUPABASE_SERVICE_KEY": "stub.stub.stub", "STORAGE_BACKEND": "supabase",
+           "VITE_FIREBASE_PROJECT_ID": PROJECT_ID, "FIREBASE_CERTS_URL": firebase.certs_url}
+    try:
+        for app in (["flask", "fastapi"] if args.app == "both" else [args.app]):
+            baseline = None
+            for workers in range(1, args.max_workers + 1):
+                result = run(app, workers, args, env)
+                baseline = baseline or result["rps"]
+                print(f"{app:<8} {workers:>2} worker(s) {result['rps']:>9.1f} req/s  x{result['rps'] / baseline:4.2f}  "
+                      f"p50 {result['p50_ms']:>7.1f} ms  p99 {result['p99_ms']:>7.1f} ms  "
+                      f"errors {result['errors']}  pids {result['pids']}")
+    finally:
+        firebase.stop()
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 -- BoK Pharm Database Schema for Supabase
 
 -- User table (singular)
-CREATE TABLE IF NOT EXISTS user (
+CREATE TABLE IF NOT EXISTS "user" (
   id VARCHAR PRIMARY KEY DEFAULT gen_random_uuid()::text,
   email VARCHAR UNIQUE,
   first_name VARCHAR,
@@ -59,8 +59,12 @@ CREATE TABLE IF NOT EXISTS inventory (
   FOREIGN KEY (medication_id) REFERENCES medication(id)
 );
 
+-- Range scans of the inventory sweeper (inventory_sweeper.py): low stock and expiring batches.
+CREATE INDEX IF NOT EXISTS idx_inventory_quantity ON inventory(quantity);
+CREATE INDEX IF NOT EXISTS idx_inventory_expiry_date ON inventory(expiry_date);
+
 -- Order table (singular)
-CREATE TABLE IF NOT EXISTS order (
+CREATE TABLE IF NOT EXISTS "order" (
   id VARCHAR PRIMARY KEY DEFAULT gen_random_uuid()::text,
   user_id VARCHAR NOT NULL,
   pharmacy_id VARCHAR NOT NULL,
@@ -69,7 +73,7 @@ CREATE TABLE IF NOT EXISTS order (
   delivery_address TEXT NOT NULL,
   payment_method TEXT,
   created_at TIMESTAMP NOT NULL DEFAULT now(),
-  FOREIGN KEY (user_id) REFERENCES user(id),
+  FOREIGN KEY (user_id) REFERENCES "user"(id),
   FOREIGN KEY (pharmacy_id) REFERENCES pharmacy(id)
 );
 
@@ -81,11 +85,25 @@ CREATE TABLE IF NOT EXISTS order_item (
   quantity INTEGER NOT NULL,
   unit_price DECIMAL(10, 2) NOT NULL,
   subtotal DECIMAL(10, 2) NOT NULL,
-  FOREIGN KEY (order_id) REFERENCES order(id),
+  FOREIGN KEY (order_id) REFERENCES "order"(id),
   FOREIGN KEY (medication_id) REFERENCES medication(id)
 );
 
+-- Idempotency keys (optional, IDEMPOTENCY_STORE=table): stored responses
+-- replayed for retried POSTs; status is NULL while the first request runs.
+CREATE TABLE IF NOT EXISTS idempotency_key (
+  key VARCHAR PRIMARY KEY,
+  fingerprint TEXT NOT NULL,
+  status INTEGER,
+  headers TEXT,
+  body TEXT,
+  created_at TIMESTAMP NOT NULL DEFAULT now(),
+  expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_key_expires_at ON idempotency_key(expires_at);
+
 -- Add foreign key for user.pharmacy_id (after pharmacy table is created)
-ALTER TABLE user
+ALTER TABLE "user"
 ADD CONSTRAINT fk_user_pharmacy
 FOREIGN KEY (pharmacy_id) REFERENCES pharmacy(id);
@@ -0,0 +1,63 @@
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import profiler
+
+# Supabase's query builders are synchronous. Async handlers hand the blocking
+# round trip to this bounded pool so the event loop keeps serving other
+# requests; the underlying httpx client keeps its pooled keep-alive connections.
+# SUPABASE_EXECUTOR_WORKERS=0 runs queries inline (the old blocking behaviour).
+SUPABASE_EXECUTOR_WORKERS = int(os.getenv("SUPABASE_EXECUTOR_WORKERS", "32"))
+
+_executor = None
+
+def get_executor() -> Optional[ThreadPoolExecutor]:
+    global _executor
+    if _executor is None and SUPABASE_EXECUTOR_WORKERS > 0:
+        _executor = ThreadPoolExecutor(
+            max_workers=SUPABASE_EXECUTOR_WORKERS,
+            thread_name_prefix="supabase",
+        )
+    return _executor
+
+async def execute(query):
+    # Guarded queries (upstream.py) queue and merge on the event loop before taking an executor thread.
+    aexecute = getattr(query, "aexecute", None)
+    if aexecute is not None:
+        return await aexecute()
+    if SUPABASE_EXECUTOR_WORKERS <= 0:
+        return query.execute()
+    loop = asyncio.get_running_loop()
+    # copy_context carries the request's metrics timings into the worker thread;
+    # profiler.call tags the thread with the request while a profile is running.
+    return await loop.run_in_executor(get_executor(), contextvars.copy_context().run, profiler.call, query.execute)
+
+async def run_sync(fn, *args):
+    if SUPABASE_EXECUTOR_WORKERS <= 0:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), contextvars.copy_context().run, profiler.call, fn, *args)
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def select_all(build, page_size=1000):
+    # PostgREST caps each response (1000 rows on Supabase by default), so full
+    # table loads walk the table in id order one page at a time.
+    rows = []
+    last_id = None
+    while True:
+        query = build().order("id").limit(page_size)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.execute().data
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        last_id = page[-1]["id"]
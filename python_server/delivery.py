@@ -0,0 +1,158 @@
+import os
+import math
+import threading
+
+import numpy as np
+
+import db
+from geo import coordinates, haversine_km
+
+# Live delivery quotes for a customer location. Distances are great-circle;
+# trips are timed (and, with tiers, priced) on distance * DELIVERY_ROAD_FACTOR
+# to allow for roads. By default the fee quoted is the pharmacy's own
+# delivery_fee. Distance pricing is opt-in: DELIVERY_FEE_TIERS is a
+# comma-separated list of "max_km:fee" or "max_km:fee+per_km" tiers in
+# ascending order, e.g. "3:500,7:800,15:1200,inf:1200+100"; per_km is charged
+# for each km past the previous tier's limit, a trip past the last tier is not
+# delivered (end with "inf:..." to deliver anywhere), and a pharmacy's own
+# delivery_fee becomes its minimum fee.
+DELIVERY_FEE_TIERS = os.getenv("DELIVERY_FEE_TIERS", "")
+DELIVERY_ROAD_FACTOR = float(os.getenv("DELIVERY_ROAD_FACTOR", "1.3"))
+DELIVERY_BASE_MINUTES = float(os.getenv("DELIVERY_BASE_MINUTES", os.getenv("ROUTING_BASE_MINUTES", "15")))
+DELIVERY_SPEED_KMH = float(os.getenv("DELIVERY_SPEED_KMH", os.getenv("ROUTING_SPEED_KMH", "25")))
+ETA_WINDOW_MINUTES = 5
+
+class FeeTiers:
+    def __init__(self, spec):
+        limits, fees, per_km = [], [], []
+        for tier in filter(None, (t.strip() for t in spec.split(","))):
+            try:
+                limit, price = tier.split(":")
+                fee, _, rate = price.partition("+")
+                limits.append(float(limit))
+                fees.append(float(fee))
+                per_km.append(float(rate) if rate else 0.0)
+            except ValueError:
+                raise ValueError(f"DELIVERY_FEE_TIERS: {tier!r} is not max_km:fee or max_km:fee+per_km")
+        if not limits or any(b <= a for a, b in zip(limits, limits[1:])):
+            raise ValueError("DELIVERY_FEE_TIERS needs at least one tier, in ascending max_km order")
+        self.limits = np.array(limits)
+        self.starts = np.concatenate(([0.0], self.limits[:-1]))
+        self.fees = np.array(fees)
+        self.per_km = np.array(per_km)
+
+    def __call__(self, road_km):
+        """Fee per trip length in km; NaN past the last tier."""
+        # Counting the limits below each trip beats searchsorted for a handful of tiers.
+        tier = np.zeros(np.shape(road_km), dtype=np.intp)
+        for limit in self.limits[:-1]:
+            tier += road_km > limit
+        fee = self.fees.take(tier)
+        if self.per_km.any():
+            fee += self.per_km.take(tier) * np.maximum(road_km - self.starts.take(tier), 0.0)
+        fee[road_km > self.limits[-1]] = np.nan
+        return fee
+
+fee_tiers = FeeTiers(DELIVERY_FEE_TIERS) if DELIVERY_FEE_TIERS.strip() else None
+
+def quote(distance_km, stored_fees=None, tiers=None):
+    """(fee, eta_minutes) arrays for great-circle distances in km; fee is NaN where there is no delivery.
+
+    Without tiers the fee is `stored_fees` (the pharmacies' delivery_fee); with
+    tiers it is the tier price, but never below `stored_fees`.
+    """
+    tiers = tiers or fee_tiers
+    road_km = distance_km * DELIVERY_ROAD_FACTOR
+    if tiers is None:
+        fee = np.zeros(np.shape(road_km)) if stored_fees is None else np.array(stored_fees, dtype=float)
+    else:
+        fee = tiers(road_km)
+        if stored_fees is not None:
+            np.maximum(fee, stored_fees, out=fee)
+    np.round(fee, 2, out=fee)
+    return fee, DELIVERY_BASE_MINUTES + road_km * (60 / DELIVERY_SPEED_KMH)
+
+def stored_fee(row):
+    try:
+        return float(row.get("delivery_fee") or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def eta_window(minutes):
+    low = max(ETA_WINDOW_MINUTES, int(minutes // ETA_WINDOW_MINUTES) * ETA_WINDOW_MINUTES)
+    return f"{low}-{low + ETA_WINDOW_MINUTES} min"
+
+class DeliveryQuoter:
+    """Distance, fee and ETA from one location to every pharmacy of a SnapshotCache, in one NumPy pass."""
+
+    def __init__(self, directory, tiers=None):
+        self.directory = directory
+        self.tiers = tiers
+        # (positions by pharmacy id, latitudes and longitudes in radians, cos(latitude), stored fees)
+        self.arrays = ({}, np.empty(0), np.empty(0), np.empty(0), np.empty(0))
+        self.version = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        if self.version == self.directory.version:
+            return
+        if not self._lock.acquire(blocking=self.version is None):
+            return
+        try:
+            version = self.directory.version
+            if self.version != version:
+                positions, lats, lngs, stored_fees = {}, [], [], []
+                for row in self.directory.rows:
+                    point = coordinates(row)
+                    if point is not None:
+                        positions[row["id"]] = len(lats)
+                        lats.append(point[0])
+                        lngs.append(point[1])
+                        stored_fees.append(stored_fee(row))
+                # Readers take the arrays as a tuple, so they never mix two versions.
+                lats = np.radians(lats)
+                self.arrays = (positions, lats, np.radians(lngs), np.cos(lats), np.array(stored_fees, dtype=float))
+                self.version = version
+        finally:
+            self._lock.release()
+
+    def quote_all(self, lat, lng, positions=None):
+        """(distance_km, fee, eta_minutes) arrays for `positions`, or for every located pharmacy."""
+        _, lats, lngs, cos_lats, stored_fees = self.arrays
+        if positions is not None:
+            lats, lngs, cos_lats, stored_fees = lats[positions], lngs[positions], cos_lats[positions], stored_fees[positions]
+        distance = haversine_km(lat, lng, lats, lngs, cos_lats)
+        fee, eta = quote(distance, stored_fees, self.tiers)
+        return distance, fee, eta
+
+    def _annotate(self, rows, lat, lng):
+        index = self.arrays[0]
+        located = [i for i, row in enumerate(rows) if row.get("id") in index]
+        if not located:
+            return rows
+        distance, fee, eta = self.quote_all(lat, lng, np.array([index[rows[i]["id"]] for i in located]))
+        rows = list(rows)
+        for i, d, f, minutes in zip(located, distance.tolist(), fee.tolist(), eta.tolist()):
+            deliverable = not math.isnan(f)
+            rows[i] = {
+                **rows[i],
+                "distance": f"{d:.1f} km",
+                "distance_km": round(d, 3),
+                "delivery_fee": f if deliverable else None,
+                "delivery_time": eta_window(minutes) if deliverable else None,
+                "eta_minutes": round(minutes) if deliverable else None,
+                "deliverable": deliverable,
+            }
+        return rows
+
+    def annotate(self, rows, lat, lng):
+        """Copies of `rows` with live distance, delivery_fee and delivery_time from (lat, lng)."""
+        self.directory.get()
+        self.sync()
+        return self._annotate(rows, lat, lng)
+
+    async def aannotate(self, rows, lat, lng):
+        await self.directory.aget()
+        if self.version != self.directory.version:
+            await db.run_sync(self.sync)
+        return self._annotate(rows, lat, lng)
@@ -0,0 +1,205 @@
+import asyncio
+import glob
+import json
+import os
+import socket
+import tempfile
+from typing import Optional
+
+# Topic pub/sub for server-sent events. Subscriptions live on the worker's
+# event loop and keep only the newest event of their topic: a client that is
+# idle or slow costs the same few hundred bytes however many events it misses,
+# and it always catches up to the current state. Publishing goes through a
+# backend that reaches every worker: "local" delivers in this process only,
+# "unix" fans out to all workers on the host through datagram sockets in
+# EVENTS_SOCKET_DIR (one per worker, no broker process); gunicorn.conf.py
+# picks "unix" whenever it runs more than one worker. Another transport
+# (Redis, Postgres LISTEN/NOTIFY) only needs start / publish / stop.
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "local")
+EVENTS_SOCKET_DIR = os.getenv("EVENTS_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "bok-pharm-events"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+MAX_DATAGRAM = 65536
+
+class Subscription:
+    __slots__ = ("topic", "pending", "waiter")
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.pending = None
+        self.waiter = None
+
+    def push(self, event):
+        self.pending = event
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def next(self, timeout):
+        """The newest event not yet returned, or None if none arrives within `timeout` seconds."""
+        if self.pending is None:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.waiter = None
+        event, self.pending = self.pending, None
+        return event
+
+class LocalBackend:
+    def start(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, topic, event):
+        self.deliver(topic, event)
+
+    def stop(self):
+        pass
+
+class UnixSocketBackend:
+    """Sends each event to every worker socket in `directory`; sockets of dead workers are removed on the way."""
+
+    def __init__(self, directory=EVENTS_SOCKET_DIR):
+        self.directory = directory
+        self.path = None
+        self.sock = None
+        self.dropped = 0
+
+    def start(self, deliver):
+        self.deliver = deliver
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.sock.fileno(), self._receive)
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM)
+            except BlockingIOError:
+                return
+            try:
+                topic, event = json.loads(data)
+            except (ValueError, TypeError):
+                # Not an event another worker sent; raising here would kill the reader.
+                self.dropped += 1
+                continue
+            self.deliver(topic, event)
+
+    def publish(self, topic, event):
+        self.deliver(topic, event)
+        data = json.dumps([topic, event]).encode()
+        for path in glob.glob(os.path.join(self.directory, "*.sock")):
+            if path == self.path:
+                continue
+            try:
+                self.sock.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                # The worker's receive buffer is full; its clients see the next event instead.
+                self.dropped += 1
+            except OSError:
+                # Too large for a datagram (EMSGSIZE) or otherwise undeliverable. The write
+                # this event reports has committed, so drop it rather than fail the request;
+                # that worker's clients see the next event or their next full read.
+                self.dropped += 1
+
+    def stop(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+def create_backend(name=EVENTS_BACKEND):
+    if name == "local":
+        return LocalBackend()
+    if name == "unix":
+        return UnixSocketBackend()
+    raise ValueError(f"EVENTS_BACKEND must be local or unix, not {name!r}")
+
+class Broker:
+    """Fans published events out to this worker's subscriptions. start() and publish() run on the event loop."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self.topics = {}
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.backend.start(self.deliver)
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            self.backend.stop()
+            self.started = False
+
+    def subscribe(self, topic) -> Subscription:
+        subscription = Subscription(topic)
+        self.topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self.topics.get(subscription.topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.topics[subscription.topic]
+
+    def publish(self, topic, event):
+        self.backend.publish(topic, event)
+
+    def deliver(self, topic, event):
+        for subscription in self.topics.get(topic, ()):
+            subscription.push(event)
+
+    def stats(self):
+        return {"topics": len(self.topics), "subscriptions": sum(len(s) for s in self.topics.values())}
+
+def sse(event, name=None) -> bytes:
+    lines = []
+    if name:
+        lines.append(f"event: {name}")
+    lines.append(f"data: {json.dumps(event, separators=(',', ':'))}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+HEARTBEAT = b": ping\n\n"
+
+async def stream(broker, subscription, first_event, name, is_final, version, heartbeat: Optional[float] = None):
+    """SSE body: `first_event`, then each newer event of the topic until one satisfies is_final().
+
+    Subscribe before reading `first_event`; events whose version() is not
+    above the last one sent (published while it was being read) are skipped.
+    """
+    heartbeat = EVENTS_HEARTBEAT_SECONDS if heartbeat is None else heartbeat
+    try:
+        yield sse(first_event, name)
+        if is_final(first_event):
+            return
+        sent = version(first_event)
+        while True:
+            event = await subscription.next(heartbeat)
+            if event is None:
+                yield HEARTBEAT
+            elif version(event) > sent:
+                yield sse(event, name)
+                if is_final(event):
+                    return
+                sent = version(event)
+    finally:
+        broker.unsubscribe(subscription)
@@ -1,22 +1,64 @@
 import os
-from fastapi import FastAPI, HTTPException, Depends, Header
+import asyncio
+import hmac
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
+from fastapi.responses import JSONResponse, StreamingResponse
+from postgrest.exceptions import APIError
 from dotenv import load_dotenv
-from typing import Optional, List, Dict, Any
-import firebase_admin
-from firebase_admin import auth as firebase_auth
+from typing import Optional, List, Dict, Any, Literal
+from firebase_tokens import TokenVerifier
 from models import (
     User, Pharmacy, Medication, Order, OrderItem, 
     Cart, CartItem, OrderStatus
 )
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from contextlib import asynccontextmanager
+import db
+import storage
+from db import execute
+from snapshot import SnapshotCache
+from geo import PharmacyLocator
+from delivery import DeliveryQuoter
+from search_index import MedicationSearch
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, MEDICATION_FIELDS, PHARMACY_FIELDS,
+    PageRequestError, decode_cursor, parse_fields, paginate_rows, project
+)
+from availability import StockIndex, INVENTORY_COLUMNS
+from routing import CartRouter
+from known_users import KnownUsers
+import responses
+import metrics
+import profiler
+import idempotency
+import events
+import upstream
+import lifecycle
 
 load_dotenv()
 load_dotenv("../.env")
 
-app = FastAPI(title="BoK Pharm API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db.get_executor()
+    # Usually already done by gunicorn's post_worker_init; covers plain uvicorn.
+    await db.run_sync(lifecycle.worker.start)
+    profiler.start_continuous()
+    order_events.start()
+    yield
+    order_events.stop()
+    profiler.stop_continuous()
+    db.shutdown()
+
+app = FastAPI(title="BoK Pharm API", version="1.0.0", lifespan=lifespan)
+
+idempotency_store = idempotency.IdempotencyStore()
+# Innermost, so replayed responses still get CORS headers, compression and metrics.
+app.add_middleware(idempotency.IdempotencyMiddleware, store=idempotency_store)
+# Turns the 500 of a request whose storage call was refused into 503 with Retry-After.
+app.add_middleware(upstream.SheddingMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,23 +66,83 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", idempotency.REPLAYED_HEADER],
 )
+app.add_middleware(responses.CompressionMiddleware)
+app.add_middleware(profiler.ProfilerMiddleware)
+# Outermost, so Server-Timing also covers compression.
+app.add_middleware(metrics.MetricsMiddleware)
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "")
+class FastJSONResponse(JSONResponse):
+    """Encodes with orjson. Returning it from a handler also skips response_model validation."""
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
+    def render(self, content: Any) -> bytes:
+        with metrics.timer("encode"):
+            return responses.dumps(content)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+def catalog_etag(request: Request, snapshot_etag: str) -> str:
+    # Gzip, br and identity bodies differ byte for byte, so each gets its own validator.
+    return responses.make_etag(snapshot_etag, request.url.path, sorted(request.query_params.multi_items()),
+                               encoding=responses.etag_encoding(request.headers.get("accept-encoding")))
+
+def catalog_headers(etag: str, next_cursor: Optional[str] = None) -> Dict[str, str]:
+    # Vary on every catalog response, 304s included, so caches keep one copy per coding.
+    headers = {"ETag": etag, "Cache-Control": responses.CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    return headers
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    if responses.not_modified(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=catalog_headers(etag))
+    return None
+
+GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "")
+
+# Supabase by default; STORAGE_BACKEND=sqlmodel serves the same calls from a local database.
+# Identical reads in flight together are merged and upstream concurrency is capped.
+supabase = upstream.guard(metrics.instrument_client(storage.create_client()))
+idempotency_store.attach(supabase)
 
 FIREBASE_PROJECT_ID = os.getenv("VITE_FIREBASE_PROJECT_ID")
 if not FIREBASE_PROJECT_ID:
     raise ValueError("VITE_FIREBASE_PROJECT_ID environment variable is required")
 
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(options={'projectId': FIREBASE_PROJECT_ID})
+token_verifier = TokenVerifier(FIREBASE_PROJECT_ID)
+lifecycle.worker.on_start(token_verifier.start)
+idempotency_store.identify_with(token_verifier)
+
+# Unset disables the /admin endpoints (they answer 404).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def load_medications():
+    return db.select_all(lambda: supabase.table("medication").select("*"))
+
+medication_catalog = SnapshotCache(load_medications)
+medication_search = MedicationSearch(medication_catalog)
+
+def load_pharmacies():
+    return db.select_all(lambda: supabase.table("pharmacy").select("*"))
+
+pharmacy_directory = SnapshotCache(load_pharmacies)
+pharmacy_locator = PharmacyLocator(pharmacy_directory)
+delivery_quoter = DeliveryQuoter(pharmacy_directory)
+
+def load_stock():
+    return db.select_all(lambda: supabase.table("inventory").select(INVENTORY_COLUMNS).eq("in_stock", True).gt("quantity", 0))
+
+stock_index = StockIndex(load_stock, pharmacy_locator)
+cart_router = CartRouter(stock_index)
+known_users = KnownUsers()
+# Order status changes, keyed by order id; EVENTS_BACKEND=unix shares them between workers.
+order_events = events.Broker()
+
+def warm_caches():
+    medication_catalog.get()
+    pharmacy_directory.get()
+
+lifecycle.worker.on_start(warm_caches, background=True)
+lifecycle.worker.ready_when("caches", lambda: medication_catalog.loads > 0 and pharmacy_directory.loads > 0)
 
 async def get_current_user(authorization: Optional[str] = Header(None)) -> str:
     if not authorization or not authorization.startswith('Bearer '):
@@ -48,50 +150,190 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> str:
     
     try:
         id_token = authorization.split('Bearer ')[1]
-        decoded_token = firebase_auth.verify_id_token(id_token)
+        with metrics.timer("auth"):
+            decoded_token = token_verifier.lookup(id_token)
+            if decoded_token is None:
+                # Signature checks and key refetches stay off the event loop.
+                decoded_token = await db.run_sync(token_verifier.verify_uncached, id_token)
         return decoded_token['uid']
     except Exception as e:
         print(f"Token verification error: {str(e)}")
         raise HTTPException(status_code=401, detail="Invalid authentication token")
 
+async def get_stream_user(authorization: Optional[str] = Header(None), access_token: Optional[str] = None) -> str:
+    """get_current_user, also accepting ?access_token= because browsers' EventSource cannot send headers."""
+    if not authorization and access_token:
+        authorization = f"Bearer {access_token}"
+    return await get_current_user(authorization)
+
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "message": "BoK Pharm FastAPI Backend Running"}
+    tokens = token_verifier.stats()
+    return {
+        "status": "ok",
+        "message": "BoK Pharm FastAPI Backend Running",
+        "worker": lifecycle.worker.health(),
+        "signing_keys": tokens["keys"],
+        "token_cache": tokens["tokens"],
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    ready, body = lifecycle.worker.readiness()
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_worker(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(5.0, ge=1, le=1000),
+    idle: bool = False,
+):
+    """Samples every thread of this worker for `seconds` and returns collapsed stacks (flamegraph.pl / speedscope)."""
+    try:
+        sampler = profiler.begin(interval_ms / 1000, idle=idle)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        await asyncio.sleep(min(seconds, profiler.PROFILE_MAX_SECONDS))
+    finally:
+        stacks, samples = await db.run_sync(profiler.end, sampler)
+    return Response(stacks, media_type="text/plain", headers={"X-Profile-Samples": str(samples)})
+
+@app.get("/admin/profile/continuous", dependencies=[Depends(require_admin)])
+async def continuous_profile(reset: bool = False):
+    sampler = profiler.continuous()
+    if sampler is None:
+        raise HTTPException(status_code=404, detail="Continuous profiling is off (set PROFILE_SAMPLE_RATE)")
+    stacks, samples = sampler.collapsed(reset=reset)
+    return Response(stacks, media_type="text/plain", headers={"X-Profile-Samples": str(samples)})
 
 @app.get("/medications", response_model=List[Dict[str, Any]])
-async def get_medications():
+async def get_medications(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
     try:
-        response = supabase.table("medication").select("*").execute()
-        return response.data
+        after = decode_cursor(cursor)
+        columns = parse_fields(fields, MEDICATION_FIELDS)
+        await medication_catalog.aget()
+        etag = catalog_etag(request, await medication_catalog.aetag())
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+        ids, rows = medication_catalog.ordered()
+        page, next_cursor = paginate_rows(ids, rows, after, limit, columns)
+        return FastJSONResponse(page, headers=catalog_headers(etag, next_cursor))
+    except PageRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/medications/search", response_model=List[Dict[str, Any]])
+async def search_medications(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)):
+    try:
+        return FastJSONResponse(await medication_search.asearch(q, limit))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/medications/{medication_id}", response_model=Dict[str, Any])
-async def get_medication(medication_id: str):
+async def get_medication(medication_id: str, request: Request):
     try:
-        response = supabase.table("medication").select("*").eq("id", medication_id).execute()
+        medication = await medication_catalog.aget_by_id(medication_id)
+        if medication is not None:
+            etag = catalog_etag(request, await medication_catalog.aetag())
+            return not_modified(request, etag) or FastJSONResponse(medication, headers=catalog_headers(etag))
+        # Not in this worker's snapshot yet (e.g. created through another
+        # worker); fall back to the database and remember the row.
+        response = await execute(supabase.table("medication").select("*").eq("id", medication_id))
         if not response.data:
             raise HTTPException(status_code=404, detail="Medication not found")
+        medication_search.add(response.data[0])
         return response.data[0]
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/medications/{medication_id}/availability", response_model=List[Dict[str, Any]])
+async def get_medication_availability(
+    medication_id: str,
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: Optional[float] = Query(None, gt=0, description="Search radius in km"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    try:
+        return FastJSONResponse(await stock_index.anearest(medication_id, lat, lng, radius, limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/pharmacies", response_model=List[Dict[str, Any]])
-async def get_pharmacies():
+async def get_pharmacies(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="Customer location for live delivery quotes"),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+):
+    if (lat is None) != (lng is None):
+        raise HTTPException(status_code=400, detail="lat and lng go together")
     try:
-        response = supabase.table("pharmacy").select("*").eq("is_active", True).execute()
-        return response.data
+        after = decode_cursor(cursor)
+        columns = parse_fields(fields, PHARMACY_FIELDS)
+        await pharmacy_directory.aget()
+        etag = catalog_etag(request, await pharmacy_directory.aetag())
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+        ids, rows = pharmacy_directory.ordered()
+        if lat is None:
+            page, next_cursor = paginate_rows(ids, rows, after, limit, columns, where=lambda p: p.get("is_active"))
+        else:
+            page, next_cursor = paginate_rows(ids, rows, after, limit, where=lambda p: p.get("is_active"))
+            page = project(await delivery_quoter.aannotate(page, lat, lng), columns)
+        return FastJSONResponse(page, headers=catalog_headers(etag, next_cursor))
+    except PageRequestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/pharmacies/nearby", response_model=List[Dict[str, Any]])
+async def get_nearby_pharmacies(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: Optional[float] = Query(None, gt=0, description="Search radius in km"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    try:
+        pharmacies = await pharmacy_locator.anearby(lat, lng, radius, limit)
+        return FastJSONResponse(await delivery_quoter.aannotate(pharmacies, lat, lng))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/pharmacies/{pharmacy_id}", response_model=Dict[str, Any])
-async def get_pharmacy(pharmacy_id: str):
+async def get_pharmacy(pharmacy_id: str, request: Request):
     try:
-        response = supabase.table("pharmacy").select("*").eq("id", pharmacy_id).execute()
+        pharmacy = await pharmacy_directory.aget_by_id(pharmacy_id)
+        if pharmacy is not None:
+            etag = catalog_etag(request, await pharmacy_directory.aetag())
+            return not_modified(request, etag) or FastJSONResponse(pharmacy, headers=catalog_headers(etag))
+        response = await execute(supabase.table("pharmacy").select("*").eq("id", pharmacy_id))
         if not response.data:
             raise HTTPException(status_code=404, detail="Pharmacy not found")
+        pharmacy_locator.add(response.data[0])
         return response.data[0]
     except HTTPException:
         raise
@@ -105,7 +347,7 @@ class AddToCartRequest(BaseModel):
 @app.get("/cart")
 async def get_cart(user_id: str = Depends(get_current_user)):
     try:
-        cart_response = supabase.table("cart").select("*").eq("user_id", user_id).execute()
+        cart_response = await execute(supabase.table("cart").select("*").eq("user_id", user_id))
         
         if not cart_response.data:
             new_cart = {
@@ -113,11 +355,11 @@ async def get_cart(user_id: str = Depends(get_current_user)):
                 "created_at": datetime.utcnow().isoformat(),
                 "updated_at": datetime.utcnow().isoformat()
             }
-            cart_response = supabase.table("cart").insert(new_cart).execute()
+            cart_response = await execute(supabase.table("cart").insert(new_cart))
         
         cart = cart_response.data[0]
         
-        items_response = supabase.table("cart_item").select("*").eq("cart_id", cart["id"]).execute()
+        items_response = await execute(supabase.table("cart_item").select("*").eq("cart_id", cart["id"]))
         
         return {
             "cart": cart,
@@ -130,50 +372,16 @@ async def get_cart(user_id: str = Depends(get_current_user)):
 @app.post("/cart/add")
 async def add_to_cart(request: AddToCartRequest, user_id: str = Depends(get_current_user)):
     try:
-        cart_response = supabase.table("cart").select("*").eq("user_id", user_id).execute()
-        
-        if not cart_response.data:
-            new_cart = {
-                "user_id": user_id,
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
-            }
-            cart_response = supabase.table("cart").insert(new_cart).execute()
-        
-        cart = cart_response.data[0]
-        
-        med_response = supabase.table("medication").select("*").eq("id", request.medication_id).execute()
-        if not med_response.data:
+        # One round trip: the add_to_cart function (functions.sql) creates the
+        # cart if needed and upserts the item, incrementing quantity atomically.
+        result = await execute(supabase.rpc("add_to_cart", {
+            "p_user_id": user_id,
+            "p_medication_id": request.medication_id,
+            "p_quantity": request.quantity
+        }))
+        if not result.data:
             raise HTTPException(status_code=404, detail="Medication not found")
-        
-        medication = med_response.data[0]
-        
-        existing_item = supabase.table("cart_item").select("*").eq("cart_id", cart["id"]).eq("medication_id", request.medication_id).execute()
-        
-        if existing_item.data:
-            item = existing_item.data[0]
-            new_quantity = item["quantity"] + request.quantity
-            new_total = new_quantity * medication.get("price", 0)
-            
-            updated = supabase.table("cart_item").update({
-                "quantity": new_quantity,
-                "total_price": new_total
-            }).eq("id", item["id"]).execute()
-            
-            return updated.data[0]
-        else:
-            new_item = {
-                "cart_id": cart["id"],
-                "medication_id": medication["id"],
-                "medication_name": medication["name"],
-                "dosage": medication.get("dosage"),
-                "quantity": request.quantity,
-                "unit_price": medication.get("price", 0),
-                "total_price": request.quantity * medication.get("price", 0)
-            }
-            
-            result = supabase.table("cart_item").insert(new_item).execute()
-            return result.data[0]
+        return result.data[0]
     except HTTPException:
         raise
     except Exception as e:
@@ -182,17 +390,12 @@ async def add_to_cart(request: AddToCartRequest, user_id: str = Depends(get_curr
 @app.delete("/cart/items/{item_id}")
 async def remove_from_cart(item_id: str, user_id: str = Depends(get_current_user)):
     try:
-        item_response = supabase.table("cart_item").select("cart_id").eq("id", item_id).execute()
-        if not item_response.data:
+        result = await execute(supabase.rpc("remove_cart_item", {
+            "p_user_id": user_id,
+            "p_item_id": item_id
+        }))
+        if not result.data:
             raise HTTPException(status_code=404, detail="Cart item not found")
-        
-        cart_id = item_response.data[0]["cart_id"]
-        cart_response = supabase.table("cart").select("user_id").eq("id", cart_id).execute()
-        
-        if not cart_response.data or cart_response.data[0]["user_id"] != user_id:
-            raise HTTPException(status_code=403, detail="Unauthorized")
-        
-        supabase.table("cart_item").delete().eq("id", item_id).execute()
         return {"success": True}
     except HTTPException:
         raise
@@ -205,30 +408,162 @@ class UpdateCartItemRequest(BaseModel):
 @app.patch("/cart/items/{item_id}")
 async def update_cart_item(item_id: str, request: UpdateCartItemRequest, user_id: str = Depends(get_current_user)):
     try:
-        item_response = supabase.table("cart_item").select("*").eq("id", item_id).execute()
-        if not item_response.data:
+        updated = await execute(supabase.rpc("update_cart_item", {
+            "p_user_id": user_id,
+            "p_item_id": item_id,
+            "p_quantity": request.quantity
+        }))
+        if not updated.data:
             raise HTTPException(status_code=404, detail="Cart item not found")
-        
-        item = item_response.data[0]
-        cart_id = item["cart_id"]
-        
-        cart_response = supabase.table("cart").select("user_id").eq("id", cart_id).execute()
-        if not cart_response.data or cart_response.data[0]["user_id"] != user_id:
-            raise HTTPException(status_code=403, detail="Unauthorized")
-        
-        new_total = request.quantity * item["unit_price"]
-        
-        updated = supabase.table("cart_item").update({
-            "quantity": request.quantity,
-            "total_price": new_total
-        }).eq("id", item_id).execute()
-        
         return updated.data[0]
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class QuoteRequest(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+    objective: Literal["cheapest", "fastest"] = "cheapest"
+    radius_km: Optional[float] = Field(None, gt=0)
+
+@app.post("/cart/quote")
+async def quote_cart(request: QuoteRequest, user_id: str = Depends(get_current_user)):
+    try:
+        cart_response = await execute(supabase.table("cart").select("id").eq("user_id", user_id))
+        items = []
+        if cart_response.data:
+            items_response = await execute(
+                supabase.table("cart_item").select("medication_id,quantity").eq("cart_id", cart_response.data[0]["id"])
+            )
+            items = items_response.data
+        if not items:
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        # The quote's "routes" can be passed straight to POST /checkout.
+        return FastJSONResponse(await cart_router.aquote(items, request.lat, request.lng, request.objective, request.radius_km))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+class CheckoutRequest(BaseModel):
+    pharmacy_id: Optional[str] = None
+    routes: Dict[str, str] = {}
+    delivery_address: str
+    delivery_city: Optional[str] = None
+    delivery_state: Optional[str] = None
+    delivery_latitude: Optional[float] = None
+    delivery_longitude: Optional[float] = None
+
+CHECKOUT_ERRORS = {
+    "empty_cart": (400, "Cart is empty"),
+    "unrouted_item": (400, "Every cart item needs a pharmacy: set pharmacy_id or a route for it"),
+    "insufficient_stock": (409, "Not enough stock to fulfil the cart"),
+}
+
+@app.post("/checkout", status_code=201)
+async def checkout(request: CheckoutRequest, user_id: str = Depends(get_current_user)):
+    try:
+        # One round trip: the checkout function (functions.sql) reserves stock,
+        # writes the orders and their items and clears the cart in one transaction.
+        result = await execute(supabase.rpc("checkout", {
+            "p_user_id": user_id,
+            "p_pharmacy_id": request.pharmacy_id,
+            "p_routes": request.routes,
+            "p_delivery": request.model_dump(exclude={"pharmacy_id", "routes"})
+        }))
+    except APIError as e:
+        if e.message in CHECKOUT_ERRORS:
+            status_code, detail = CHECKOUT_ERRORS[e.message]
+            raise HTTPException(status_code=status_code, detail=detail)
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    for row in result.data.get("inventory") or []:
+        stock_index.apply(row)
+    return {"orders": result.data["orders"]}
+
+ORDER_COLUMNS = "id,user_id,pharmacy_id,status,updated_at"
+ORDER_TRANSITIONS = {
+    OrderStatus.created: {OrderStatus.pending, OrderStatus.confirmed, OrderStatus.cancelled},
+    OrderStatus.pending: {OrderStatus.confirmed, OrderStatus.cancelled},
+    OrderStatus.confirmed: {OrderStatus.dispatched, OrderStatus.cancelled},
+    OrderStatus.dispatched: {OrderStatus.delivered},
+    OrderStatus.delivered: {OrderStatus.completed},
+}
+# Customers may only cancel, and only before the pharmacy confirms.
+CUSTOMER_TRANSITIONS = {OrderStatus.created: {OrderStatus.cancelled}, OrderStatus.pending: {OrderStatus.cancelled}}
+
+def order_event(order):
+    return {"order_id": order["id"], "status": order["status"], "updated_at": order["updated_at"]}
+
+def order_is_final(event):
+    return event["status"] not in ORDER_TRANSITIONS
+
+async def load_order(order_id: str, user_id: str):
+    """The order and whether the caller is its pharmacy; 404 unless the caller is its customer or pharmacy."""
+    response = await execute(supabase.table("order").select(ORDER_COLUMNS).eq("id", order_id))
+    if response.data:
+        order = response.data[0]
+        if order["user_id"] == user_id:
+            return order, False
+        user = await execute(supabase.table("user").select("pharmacy_id").eq("firebase_uid", user_id))
+        if user.data and user.data[0].get("pharmacy_id") == order["pharmacy_id"]:
+            return order, True
+    raise HTTPException(status_code=404, detail="Order not found")
+
+@app.get("/orders/{order_id}/events")
+async def order_status_events(order_id: str, user_id: str = Depends(get_stream_user)):
+    """Server-sent events: the order's current status, then every change until it is cancelled or completed."""
+    subscription = order_events.subscribe(order_id)
+    try:
+        order, _ = await load_order(order_id, user_id)
+    except HTTPException:
+        order_events.unsubscribe(subscription)
+        raise
+    except Exception as e:
+        order_events.unsubscribe(subscription)
+        raise HTTPException(status_code=500, detail=str(e))
+    body = events.stream(order_events, subscription, order_event(order), "status", order_is_final,
+                         lambda event: event["updated_at"])
+    return StreamingResponse(body, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+class OrderStatusRequest(BaseModel):
+    status: OrderStatus
+
+@app.patch("/orders/{order_id}/status")
+async def update_order_status(order_id: str, request: OrderStatusRequest, user_id: str = Depends(get_current_user)):
+    try:
+        order, is_pharmacy = await load_order(order_id, user_id)
+        current = OrderStatus(order["status"])
+        if request.status not in ORDER_TRANSITIONS.get(current, set()):
+            raise HTTPException(status_code=409, detail=f"Cannot change order from {current.value} to {request.status.value}")
+        if not is_pharmacy and request.status not in CUSTOMER_TRANSITIONS.get(current, set()):
+            raise HTTPException(status_code=403, detail="Only the pharmacy can make this change")
+        # Conditional on the status just read, so concurrent changes cannot both apply.
+        if request.status == OrderStatus.cancelled:
+            # cancel_order (functions.sql) puts the order's stock back in the same transaction.
+            response = await execute(supabase.rpc("cancel_order", {"p_order_id": order_id, "p_from_status": current.value}))
+            updated = response.data["order"] if response.data else None
+            for row in (response.data or {}).get("inventory") or []:
+                stock_index.apply(row)
+        else:
+            response = await execute(
+                supabase.table("order").update({"status": request.status.value, "updated_at": datetime.utcnow().isoformat()})
+                .eq("id", order_id).eq("status", current.value)
+            )
+            updated = response.data[0] if response.data else None
+        if updated is None:
+            raise HTTPException(status_code=409, detail="Order status changed concurrently; reload and retry")
+        order_events.publish(order_id, order_event(updated))
+        return updated
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/google-maps-api-key")
 async def get_google_maps_key():
     return {"apiKey": GOOGLE_MAPS_API_KEY}
@@ -244,33 +579,31 @@ class SyncUserRequest(BaseModel):
 @app.post("/auth/sync-user")
 async def sync_user(request: SyncUserRequest):
     try:
-        existing = supabase.table("user").select("*").eq("firebase_uid", request.firebase_uid).execute()
-        
-        if existing.data:
-            return existing.data[0]
-        else:
-            dob = datetime.fromisoformat(request.date_of_birth) if request.date_of_birth else datetime.utcnow()
-            
-            new_user = {
-                "firebase_uid": request.firebase_uid,
-                "email": request.email,
-                "name": request.name,
-                "surname": request.surname,
-                "mobile_number": request.mobile_number,
-                "date_of_birth": dob.isoformat(),
-                "role": "customer",
-                "created_at": datetime.utcnow().isoformat()
-            }
-            
-            response = supabase.table("user").insert(new_user).execute()
-            return response.data[0]
+        user = known_users.get(request.firebase_uid)
+        if user is not None:
+            return user
+
+        dob = datetime.fromisoformat(request.date_of_birth) if request.date_of_birth else datetime.utcnow()
+        # One round trip: sync_user (functions.sql) inserts the user or, when the
+        # firebase_uid exists, returns the stored row without touching its profile.
+        response = await execute(supabase.rpc("sync_user", {"p_user": {
+            "firebase_uid": request.firebase_uid,
+            "email": request.email,
+            "name": request.name,
+            "surname": request.surname,
+            "mobile_number": request.mobile_number,
+            "date_of_birth": dob.isoformat(),
+        }}))
+        user = response.data["user"]
+        known_users.set(request.firebase_uid, user)
+        return user
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/auth/user")
 async def get_user(user_id: str = Depends(get_current_user)):
     try:
-        response = supabase.table("user").select("*").eq("firebase_uid", user_id).execute()
+        response = await execute(supabase.table("user").select("*").eq("firebase_uid", user_id))
         if not response.data:
             raise HTTPException(status_code=404, detail="User not found")
         return response.data[0]
@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from typing import Optional
+
+import httpx
+import jwt
+from cryptography import x509
+
+from cache import LRUCache
+
+FIREBASE_CERTS_URL = os.getenv(
+    "FIREBASE_CERTS_URL",
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com",
+)
+FIREBASE_TOKEN_CACHE_SIZE = int(os.getenv("FIREBASE_TOKEN_CACHE_SIZE", "10000"))
+CLOCK_SKEW_SECONDS = 60
+
+class PublicKeyCache:
+    """Google's securetoken signing keys, refreshed in the background before they expire."""
+
+    def __init__(self, url=FIREBASE_CERTS_URL, min_ttl=300, refresh_margin=600):
+        self.url = url
+        self.min_ttl = min_ttl
+        self.refresh_margin = refresh_margin
+        self.keys = {}
+        self.expires_at = 0.0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_forced = 0.0
+
+    def load(self, certs, max_age):
+        keys = {
+            kid: x509.load_pem_x509_certificate(pem.encode()).public_key()
+            for kid, pem in certs.items()
+        }
+        with self._lock:
+            self.keys = keys
+            self.expires_at = time.time() + max(max_age, self.min_ttl)
+            self.refreshes += 1
+
+    def refresh(self):
+        response = httpx.get(self.url, timeout=10)
+        response.raise_for_status()
+        match = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+        self.load(response.json(), int(match.group(1)) if match else self.min_ttl)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"Firebase public key prefetch failed: {str(e)}")
+        self._thread = threading.Thread(target=self._refresh_loop, name="firebase-keys", daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            delay = self.expires_at - self.refresh_margin - time.time()
+            time.sleep(max(delay, 30))
+            try:
+                self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"Firebase public key refresh failed: {str(e)}")
+
+    def get(self, kid):
+        key = self.keys.get(kid)
+        if key is not None and self.expires_at > time.time():
+            return key
+        # Unknown kid or expired set: Google may have rotated keys, refetch once
+        # but never more than once a minute.
+        now = time.time()
+        if now - self._last_forced > 60:
+            self._last_forced = now
+            try:
+                self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"Firebase public key refresh failed: {str(e)}")
+        return self.keys.get(kid)
+
+class TokenVerifier:
+    """Verifies Firebase ID tokens, remembering verified claims until each token's exp."""
+
+    def __init__(self, project_id, keys=None, maxsize=FIREBASE_TOKEN_CACHE_SIZE):
+        self.project_id = project_id
+        self.issuer = f"https://securetoken.google.com/{project_id}"
+        self.keys = keys or PublicKeyCache()
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def start(self):
+        self.keys.start()
+
+    def lookup(self, id_token: str) -> Optional[dict]:
+        return self.cache.get(hashlib.sha256(id_token.encode()).digest())
+
+    def verify(self, id_token: str) -> dict:
+        claims = self.lookup(id_token)
+        if claims is None:
+            claims = self.verify_uncached(id_token)
+        return claims
+
+    def verify_uncached(self, id_token: str) -> dict:
+        claims = self._decode(id_token)
+        self.cache.set(hashlib.sha256(id_token.encode()).digest(), claims, expires_at=claims["exp"])
+        return claims
+
+    def _decode(self, id_token):
+        header = jwt.get_unverified_header(id_token)
+        key = self.keys.get(header.get("kid"))
+        if key is None:
+            raise jwt.InvalidTokenError("Token signed with an unknown key")
+        claims = jwt.decode(
+            id_token,
+            key,
+            algorithms=["RS256"],
+            audience=self.project_id,
+            issuer=self.issuer,
+            leeway=CLOCK_SKEW_SECONDS,
+            options={"require": ["exp", "iat", "sub", "auth_time"]},
+        )
+        # The checks firebase_admin makes beyond the standard claims.
+        if not isinstance(claims["auth_time"], (int, float)) or claims["auth_time"] > time.time() + CLOCK_SKEW_SECONDS:
+            raise jwt.InvalidTokenError("Token has an invalid auth_time")
+        if not isinstance(claims["sub"], str) or not claims["sub"] or len(claims["sub"]) > 128:
+            raise jwt.InvalidTokenError("Token has an invalid subject")
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def stats(self):
+        return {
+            "tokens": self.cache.stats(),
+            "keys": {
+                "count": len(self.keys.keys),
+                "refreshes": self.keys.refreshes,
+                "refresh_errors": self.keys.refresh_errors,
+                "expires_in": max(0.0, self.keys.expires_at - time.time()),
+            },
+        }
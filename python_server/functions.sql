@@ -0,0 +1,246 @@
+-- Server-side functions for BoK Pharm
+-- Run after create_tables.sql, add_cart_tables.sql, add_order_columns.sql and
+-- add_user_columns.sql. The Python backends call these through supabase.rpc()
+-- so that each mutation is one round trip and runs in a single transaction.
+
+-- Cart mutations ------------------------------------------------------------
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user_id_unique ON cart(user_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_item_cart_medication ON cart_item(cart_id, medication_id);
+
+-- Creates the user's cart if needed and adds the medication, incrementing the
+-- quantity atomically when it is already in the cart. Returns no row when the
+-- medication does not exist.
+CREATE OR REPLACE FUNCTION add_to_cart(p_user_id TEXT, p_medication_id TEXT, p_quantity INTEGER)
+RETURNS SETOF cart_item
+LANGUAGE sql
+AS $$
+  WITH med AS (
+    SELECT m.id,
+           m.name,
+           to_jsonb(m) ->> 'dosage' AS dosage,
+           COALESCE((to_jsonb(m) ->> 'price')::DECIMAL(10, 2), 0) AS price
+    FROM medication m
+    WHERE m.id = p_medication_id
+  ), user_cart AS (
+    INSERT INTO cart (user_id)
+    SELECT p_user_id FROM med
+    ON CONFLICT (user_id) DO UPDATE SET updated_at = now()
+    RETURNING id
+  )
+  INSERT INTO cart_item AS ci (cart_id, medication_id, medication_name, dosage, quantity, unit_price, total_price)
+  SELECT user_cart.id, med.id, med.name, med.dosage, p_quantity, med.price, p_quantity * med.price
+  FROM user_cart, med
+  ON CONFLICT (cart_id, medication_id) DO UPDATE
+    SET quantity = ci.quantity + EXCLUDED.quantity,
+        unit_price = EXCLUDED.unit_price,
+        total_price = (ci.quantity + EXCLUDED.quantity) * EXCLUDED.unit_price
+  RETURNING ci.*;
+$$;
+
+-- Ownership is part of the WHERE clause: a row comes back only when the item
+-- exists and belongs to one of the user's carts.
+CREATE OR REPLACE FUNCTION update_cart_item(p_user_id TEXT, p_item_id TEXT, p_quantity INTEGER)
+RETURNS SETOF cart_item
+LANGUAGE sql
+AS $$
+  UPDATE cart_item ci
+  SET quantity = p_quantity,
+      total_price = p_quantity * ci.unit_price
+  FROM cart c
+  WHERE ci.id = p_item_id AND c.id = ci.cart_id AND c.user_id = p_user_id
+  RETURNING ci.*;
+$$;
+
+CREATE OR REPLACE FUNCTION remove_cart_item(p_user_id TEXT, p_item_id TEXT)
+RETURNS SETOF cart_item
+LANGUAGE sql
+AS $$
+  DELETE FROM cart_item ci
+  USING cart c
+  WHERE ci.id = p_item_id AND c.id = ci.cart_id AND c.user_id = p_user_id
+  RETURNING ci.*;
+$$;
+
+-- Checkout ------------------------------------------------------------------
+
+-- Turns the user's cart into one order per fulfilling pharmacy in a single
+-- transaction. Each item goes to p_routes ->> medication_id, or p_pharmacy_id
+-- when it has no route, and is priced from that pharmacy's inventory row.
+-- The cart and the inventory rows are locked up front (inventory in id order,
+-- so concurrent checkouts of the same SKU queue rather than deadlock) and the
+-- decrement is guarded by quantity >= wanted, so stock can never go negative.
+-- Any shortfall raises and rolls the whole checkout back.
+-- Returns {"orders": [order + "items"], "inventory": [updated inventory rows]}.
+CREATE OR REPLACE FUNCTION checkout(p_user_id TEXT, p_pharmacy_id TEXT, p_routes JSONB, p_delivery JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_lines INTEGER;
+  v_unrouted INTEGER;
+  v_reserved INTEGER;
+  v_result JSONB;
+BEGIN
+  PERFORM 1 FROM cart WHERE user_id = p_user_id FOR UPDATE;
+
+  SELECT count(*),
+         count(*) FILTER (WHERE COALESCE(p_routes ->> ci.medication_id, p_pharmacy_id) IS NULL)
+  INTO v_lines, v_unrouted
+  FROM cart_item ci
+  JOIN cart c ON c.id = ci.cart_id
+  WHERE c.user_id = p_user_id;
+
+  IF v_lines = 0 THEN
+    RAISE EXCEPTION 'empty_cart';
+  END IF;
+  IF v_unrouted > 0 THEN
+    RAISE EXCEPTION 'unrouted_item';
+  END IF;
+
+  PERFORM 1
+  FROM inventory i
+  JOIN cart_item ci ON ci.medication_id = i.medication_id
+  JOIN cart c ON c.id = ci.cart_id
+  WHERE c.user_id = p_user_id
+    AND i.pharmacy_id = COALESCE(p_routes ->> ci.medication_id, p_pharmacy_id)
+  ORDER BY i.id
+  FOR UPDATE OF i;
+
+  WITH line AS (
+    SELECT ci.id AS cart_item_id, ci.medication_id, ci.medication_name, ci.dosage, ci.quantity,
+           COALESCE(p_routes ->> ci.medication_id, p_pharmacy_id) AS pharmacy_id
+    FROM cart_item ci
+    JOIN cart c ON c.id = ci.cart_id
+    WHERE c.user_id = p_user_id
+  ), pick AS (
+    SELECT DISTINCT ON (l.cart_item_id) l.cart_item_id, i.id AS inventory_id
+    FROM line l
+    JOIN inventory i ON i.pharmacy_id = l.pharmacy_id AND i.medication_id = l.medication_id
+    WHERE i.in_stock AND i.quantity >= l.quantity
+    ORDER BY l.cart_item_id, i.expiry_date NULLS LAST, i.id
+  ), reserved AS (
+    UPDATE inventory i
+    SET quantity = i.quantity - l.quantity,
+        in_stock = i.quantity > l.quantity,
+        last_updated = now()
+    FROM pick p
+    JOIN line l ON l.cart_item_id = p.cart_item_id
+    WHERE i.id = p.inventory_id AND i.quantity >= l.quantity
+    RETURNING i.*, p.cart_item_id
+  ), new_order AS (
+    INSERT INTO "order" (user_id, pharmacy_id, status, total, delivery_address, delivery_city,
+                         delivery_state, delivery_latitude, delivery_longitude)
+    SELECT p_user_id, l.pharmacy_id, 'created', SUM(l.quantity * r.price),
+           p_delivery ->> 'delivery_address', p_delivery ->> 'delivery_city', p_delivery ->> 'delivery_state',
+           (p_delivery ->> 'delivery_latitude')::DECIMAL, (p_delivery ->> 'delivery_longitude')::DECIMAL
+    FROM line l
+    JOIN reserved r ON r.cart_item_id = l.cart_item_id
+    GROUP BY l.pharmacy_id
+    RETURNING *
+  ), new_item AS (
+    INSERT INTO order_item (order_id, medication_id, medication_name, dosage, quantity, unit_price, subtotal,
+                            inventory_id)
+    SELECT o.id, l.medication_id, l.medication_name, l.dosage, l.quantity, r.price, l.quantity * r.price, r.id
+    FROM line l
+    JOIN reserved r ON r.cart_item_id = l.cart_item_id
+    JOIN new_order o ON o.pharmacy_id = l.pharmacy_id
+    RETURNING *
+  ), cleared AS (
+    DELETE FROM cart_item WHERE id IN (SELECT cart_item_id FROM reserved)
+  )
+  SELECT (SELECT count(*) FROM reserved),
+         jsonb_build_object(
+           'orders', (SELECT jsonb_agg(to_jsonb(o) || jsonb_build_object(
+                        'items', (SELECT jsonb_agg(to_jsonb(it)) FROM new_item it WHERE it.order_id = o.id)))
+                      FROM new_order o),
+           'inventory', (SELECT jsonb_agg(to_jsonb(r) - 'cart_item_id') FROM reserved r))
+  INTO v_reserved, v_result;
+
+  IF v_reserved < v_lines THEN
+    RAISE EXCEPTION 'insufficient_stock';
+  END IF;
+  RETURN v_result;
+END;
+$$;
+
+-- Cancels an order that is still in p_from_status and puts its stock back in
+-- the same transaction: each item's quantity returns to the inventory row
+-- checkout took it from (items recorded before inventory_id existed go to the
+-- pharmacy's latest batch of the medication). Inventory rows are locked in id
+-- order, as checkout locks them. Returns {"order": order, "inventory":
+-- [restocked inventory rows]}, or NULL when the order is not in p_from_status.
+CREATE OR REPLACE FUNCTION cancel_order(p_order_id TEXT, p_from_status TEXT)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_order JSONB;
+  v_inventory_ids TEXT[];
+  v_quantities INTEGER[];
+  v_inventory JSONB;
+BEGIN
+  UPDATE "order" o
+  SET status = 'cancelled',
+      updated_at = now()
+  WHERE o.id = p_order_id AND o.status = p_from_status
+  RETURNING to_jsonb(o) INTO v_order;
+
+  IF v_order IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT array_agg(r.inventory_id ORDER BY r.inventory_id), array_agg(r.quantity ORDER BY r.inventory_id)
+  INTO v_inventory_ids, v_quantities
+  FROM (
+    SELECT COALESCE(oi.inventory_id, (
+             SELECT i.id FROM inventory i
+             WHERE i.pharmacy_id = v_order ->> 'pharmacy_id' AND i.medication_id = oi.medication_id
+             ORDER BY i.expiry_date DESC NULLS FIRST, i.id
+             LIMIT 1)) AS inventory_id,
+           SUM(oi.quantity)::INTEGER AS quantity
+    FROM order_item oi
+    WHERE oi.order_id = p_order_id
+    GROUP BY 1
+  ) r
+  WHERE r.inventory_id IS NOT NULL;
+
+  PERFORM 1 FROM inventory WHERE id = ANY(v_inventory_ids) ORDER BY id FOR UPDATE;
+
+  WITH returned AS (
+    SELECT * FROM unnest(v_inventory_ids, v_quantities) AS r(inventory_id, quantity)
+  ), restocked AS (
+    UPDATE inventory i
+    SET quantity = i.quantity + r.quantity,
+        -- A batch that expired meanwhile takes its units back but stays off sale.
+        in_stock = (i.expiry_date IS NULL OR i.expiry_date > (now() AT TIME ZONE 'UTC')),
+        last_updated = now()
+    FROM returned r
+    WHERE i.id = r.inventory_id
+    RETURNING i.*
+  )
+  SELECT jsonb_agg(to_jsonb(r)) INTO v_inventory FROM restocked r;
+
+  RETURN jsonb_build_object('order', v_order, 'inventory', COALESCE(v_inventory, '[]'::jsonb));
+END;
+$$;
+
+-- Users --------------------------------------------------------------------
+
+-- Returns the user with p_user->>'firebase_uid', creating it from p_user on
+-- first sign-in, in one statement. The conflict update only rewrites
+-- firebase_uid with itself, so an existing profile is left as it is but
+-- RETURNING still yields the row. Returns {"user": row, "created": bool}.
+CREATE OR REPLACE FUNCTION sync_user(p_user JSONB)
+RETURNS JSONB
+LANGUAGE sql
+AS $$
+  INSERT INTO "user" AS u (id, firebase_uid, email, name, surname, mobile_number, date_of_birth,
+                           first_name, last_name, profile_image_url, role, created_at, updated_at)
+  VALUES (COALESCE(p_user ->> 'id', gen_random_uuid()::text), p_user ->> 'firebase_uid', p_user ->> 'email',
+          p_user ->> 'name', p_user ->> 'surname', p_user ->> 'mobile_number', (p_user ->> 'date_of_birth')::timestamp,
+          p_user ->> 'first_name', p_user ->> 'last_name', p_user ->> 'profile_image_url', 'customer', now(), now())
+  ON CONFLICT (firebase_uid) DO UPDATE SET firebase_uid = EXCLUDED.firebase_uid
+  -- xmax is 0 only on a row version this statement inserted.
+  RETURNING jsonb_build_object('user', to_jsonb(u), 'created', u.xmax = 0);
+$$;
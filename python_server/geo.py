@@ -0,0 +1,270 @@
+import os
+import math
+import threading
+
+import numpy as np
+
+import db
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+GEO_CELL_DEGREES = float(os.getenv("GEO_CELL_DEGREES", "0.02"))
+# Rings walked by nearest-k queries without a radius before ranking every point instead.
+MAX_RING = 16
+
+def haversine_km(lat, lng, lats, lngs, cos_lats=None):
+    """Distances in km from one point (degrees) to arrays of points (radians).
+
+    Pass cos_lats = np.cos(lats) when querying the same points repeatedly.
+    """
+    lat = math.radians(lat)
+    lng = math.radians(lng)
+    a = np.sin((lats - lat) * 0.5)
+    a *= a
+    b = np.sin((lngs - lng) * 0.5)
+    b *= b
+    b *= np.cos(lats) if cos_lats is None else cos_lats
+    b *= math.cos(lat)
+    a += b
+    np.minimum(a, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2 * EARTH_RADIUS_KM
+    return a
+
+def coordinates(row):
+    try:
+        lat = float(row["latitude"])
+        lng = float(row["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+class GridIndex:
+    """Uniform lat/lng grid over NumPy coordinate arrays.
+
+    Points are bucketed into cells of `cell_degrees`; queries walk rings of
+    cells outward from the query point and compute exact haversine distances
+    for the candidates only. Longitude columns wrap at the antimeridian (the
+    cell size is rounded down to divide 360), so a query near ±180° sees the
+    points just across it. add(), remove() and query() hold `lock`, so a
+    query never sees the arrays and buckets half updated.
+    """
+
+    def __init__(self, cell_degrees=GEO_CELL_DEGREES):
+        self.columns = math.ceil(360 / cell_degrees - 1e-9)
+        self.cell_degrees = 360 / self.columns
+        self.lock = threading.Lock()
+        self.ids = []
+        self.positions = {}
+        self.lats = np.empty(0)
+        self.lngs = np.empty(0)
+        self.alive = np.empty(0, dtype=bool)
+        self.cells = {}
+        self.size = 0
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor((lng + 180) / self.cell_degrees)) % self.columns
+
+    def build(self, points):
+        """Replace the index with `points`, an iterable of (id, lat, lng)."""
+        points = list(points)
+        with self.lock:
+            self._build(points)
+
+    def _build(self, points):
+        self.ids = [p[0] for p in points]
+        self.positions = {pid: i for i, pid in enumerate(self.ids)}
+        lat_deg = np.array([p[1] for p in points], dtype=float)
+        lng_deg = np.array([p[2] for p in points], dtype=float)
+        self.lats = np.radians(lat_deg)
+        self.lngs = np.radians(lng_deg)
+        self.alive = np.ones(len(points), dtype=bool)
+        self.size = len(points)
+
+        self.cells = {}
+        if not points:
+            return
+        ci = np.floor(lat_deg / self.cell_degrees).astype(np.int64)
+        cj = np.floor((lng_deg + 180) / self.cell_degrees).astype(np.int64) % self.columns
+        order = np.lexsort((cj, ci))
+        ci, cj = ci[order], cj[order]
+        boundaries = np.flatnonzero((np.diff(ci) != 0) | (np.diff(cj) != 0)) + 1
+        starts = np.concatenate(([0], boundaries))
+        for start, chunk in zip(starts, np.split(order, boundaries)):
+            self.cells[(int(ci[start]), int(cj[start]))] = chunk
+
+    def add(self, pid, lat, lng):
+        with self.lock:
+            self._remove(pid)
+            self._add(pid, lat, lng)
+
+    def _add(self, pid, lat, lng):
+        index = len(self.ids)
+        self.ids.append(pid)
+        self.positions[pid] = index
+        self.lats = np.append(self.lats, math.radians(lat))
+        self.lngs = np.append(self.lngs, math.radians(lng))
+        self.alive = np.append(self.alive, True)
+        cell = self._cell(lat, lng)
+        bucket = self.cells.get(cell)
+        self.cells[cell] = np.array([index]) if bucket is None else np.append(bucket, index)
+        self.size += 1
+
+    def remove(self, pid):
+        with self.lock:
+            self._remove(pid)
+
+    def _remove(self, pid):
+        index = self.positions.pop(pid, None)
+        if index is not None:
+            self.alive[index] = False
+            self.size -= 1
+
+    def _ring(self, ci, cj, r):
+        if r == 0:
+            bucket = self.cells.get((ci, cj))
+            return [] if bucket is None else [bucket]
+        found = []
+        for dj in range(-r, r + 1):
+            for di in (-r, r):
+                bucket = self.cells.get((ci + di, (cj + dj) % self.columns))
+                if bucket is not None:
+                    found.append(bucket)
+        for di in range(-r + 1, r):
+            for dj in (-r, r):
+                bucket = self.cells.get((ci + di, (cj + dj) % self.columns))
+                if bucket is not None:
+                    found.append(bucket)
+        return found
+
+    def _ring_clearance_km(self, lat, r):
+        # Any point outside rings 0..r is at least this far from the query.
+        lat_km = r * self.cell_degrees * KM_PER_DEGREE
+        widest = min(90.0, abs(lat) + (r + 1) * self.cell_degrees)
+        return min(lat_km, lat_km * math.cos(math.radians(widest)))
+
+    def _rings_within(self, lat, radius_km):
+        """Rings to walk until every point within radius_km has been seen, or None if the rings would wrap first."""
+        r = math.ceil(radius_km / (self.cell_degrees * KM_PER_DEGREE))
+        while self._ring_clearance_km(lat, r) < radius_km:
+            # Rings reaching a pole clear nothing east or west of the query.
+            if abs(lat) + (r + 1) * self.cell_degrees >= 90:
+                return None
+            r += 1
+        return r if r <= (self.columns - 1) // 2 else None
+
+    def _rank(self, lat, lng, candidates, radius_km, limit):
+        if not len(candidates):
+            return []
+        candidates = candidates[self.alive[candidates]]
+        distances = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+        if radius_km is not None:
+            within = distances <= radius_km
+            candidates, distances = candidates[within], distances[within]
+        if limit < len(candidates):
+            top = np.argpartition(distances, limit)[:limit]
+            candidates, distances = candidates[top], distances[top]
+        order = np.argsort(distances, kind="stable")
+        return [(self.ids[i], float(d)) for i, d in zip(candidates[order], distances[order])]
+
+    def query(self, lat, lng, radius_km=None, limit=20):
+        """Up to `limit` (id, distance_km) pairs nearest to (lat, lng), optionally within radius_km."""
+        with self.lock:
+            return self._query(lat, lng, radius_km, limit)
+
+    def _query(self, lat, lng, radius_km, limit):
+        if self.size == 0 or limit <= 0:
+            return []
+        ci, cj = self._cell(lat, lng)
+        buckets = []
+        found = 0
+        # Upper bound on the distance to the limit-th nearest point, known once
+        # enough candidates have been seen.
+        kth_bound = None
+        # A radius bounds the walk by itself; past (columns - 1) // 2 the rings
+        # would wrap onto columns already walked.
+        rings = min(MAX_RING, (self.columns - 1) // 2) if radius_km is None else self._rings_within(lat, radius_km)
+        if rings is None:
+            return self._rank(lat, lng, np.arange(len(self.ids)), radius_km, limit)
+        for r in range(rings + 1):
+            for bucket in self._ring(ci, cj, r):
+                buckets.append(bucket)
+                found += len(bucket)
+            if kth_bound is None and found >= limit:
+                ranked = self._rank(lat, lng, np.concatenate(buckets), radius_km, limit)
+                if len(ranked) >= limit:
+                    kth_bound = ranked[-1][1]
+            bounds = [d for d in (radius_km, kth_bound) if d is not None]
+            if bounds and self._ring_clearance_km(lat, r) >= min(bounds):
+                candidates = np.concatenate(buckets) if buckets else np.empty(0, dtype=np.int64)
+                return self._rank(lat, lng, candidates, radius_km, limit)
+        # Sparse neighbourhood and no radius: rank every point.
+        return self._rank(lat, lng, np.arange(len(self.ids)), radius_km, limit)
+
+class PharmacyLocator:
+    """Nearest-pharmacy search over a SnapshotCache of pharmacy rows."""
+
+    def __init__(self, directory, cell_degrees=GEO_CELL_DEGREES):
+        self.directory = directory
+        self.index = GridIndex(cell_degrees)
+        self.index_version = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _points(rows):
+        for row in rows:
+            point = coordinates(row)
+            if point is not None and row.get("is_active", True):
+                yield row["id"], point[0], point[1]
+
+    def sync(self):
+        if self.index_version == self.directory.version:
+            return
+        # While another thread rebuilds, keep answering from the previous grid.
+        if not self._lock.acquire(blocking=self.index_version is None):
+            return
+        try:
+            if self.index_version != self.directory.version:
+                version = self.directory.version
+                # Build aside and swap so concurrent readers never see a half-built grid.
+                index = GridIndex(self.index.cell_degrees)
+                index.build(self._points(self.directory.rows))
+                self.index = index
+                self.index_version = version
+        finally:
+            self._lock.release()
+
+    def add(self, row):
+        """Record a created or updated pharmacy without rebuilding the index."""
+        with self._lock:
+            in_sync = self.index_version == self.directory.version
+            self.directory.put(row)
+            point = coordinates(row)
+            if point is not None and row.get("is_active", True):
+                self.index.add(row["id"], point[0], point[1])
+            else:
+                self.index.remove(row["id"])
+            if in_sync:
+                self.index_version = self.directory.version
+
+    def _results(self, lat, lng, radius_km, limit):
+        self.sync()
+        results = []
+        for pid, distance in self.index.query(lat, lng, radius_km, limit):
+            row = self.directory.by_id.get(pid)
+            if row is not None:
+                results.append({**row, "distance_km": round(distance, 3)})
+        return results
+
+    def nearby(self, lat, lng, radius_km=None, limit=20):
+        self.directory.get()
+        return self._results(lat, lng, radius_km, limit)
+
+    async def anearby(self, lat, lng, radius_km=None, limit=20):
+        await self.directory.aget()
+        if self.index_version != self.directory.version:
+            await db.run_sync(self.sync)
+        return self._results(lat, lng, radius_km, limit)
@@ -0,0 +1,60 @@
+import os
+import sys
+
+# Production server settings for both apps (see serve.sh). SERVER_APP picks
+# the app: "flask" (app.py on threaded gthread workers) or "fastapi"
+# (fastapi_app.py on uvicorn workers). WEB_CONCURRENCY pre-forks that many
+# workers, by default one per core this process may run on; each Flask
+# worker serves GUNICORN_THREADS requests at a time. Keep-alive connections
+# idle for GUNICORN_KEEPALIVE seconds, longer than the usual 60 s idle
+# timeout of load balancers, so the balancer rather than the worker closes
+# them and never reuses a connection the worker is closing. SIGHUP reloads
+# gracefully: new workers start on the current code (unless
+# GUNICORN_PRELOAD=1 loaded it once in the master) and old ones finish their
+# requests for up to GUNICORN_GRACEFUL_TIMEOUT seconds.
+SERVER_APP = os.getenv("SERVER_APP", "flask")
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+if SERVER_APP == "fastapi":
+    wsgi_app = "fastapi_app:app"
+    try:
+        import uvicorn_worker  # noqa: F401
+        worker_class = "uvicorn_worker.UvicornWorker"
+    except ImportError:
+        worker_class = "uvicorn.workers.UvicornWorker"
+elif SERVER_APP == "flask":
+    wsgi_app = "app:app"
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "8"))
+else:
+    raise ValueError(f"Unknown SERVER_APP {SERVER_APP!r}; expected 'flask' or 'fastapi'")
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or available_cores()
+# Order events published in one worker must reach SSE clients of the others;
+# workers inherit this environment, so they all pick the same backend.
+os.environ.setdefault("EVENTS_BACKEND", "unix" if workers > 1 else "local")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+backlog = int(os.getenv("GUNICORN_BACKLOG", "2048"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "65"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+# Recycling workers bounds slow leaks; the jitter keeps them from restarting together.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+pidfile = os.getenv("GUNICORN_PIDFILE") or None
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+
+def post_worker_init(worker):
+    # The app is loaded by now; start its threads and warm-ups in this worker, not the master.
+    lifecycle = sys.modules.get("lifecycle")
+    if lifecycle is not None:
+        lifecycle.worker.start()
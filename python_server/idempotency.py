@@ -0,0 +1,396 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
+from typing import Optional
+
+from cache import LRUCache
+import db
+
+# Idempotency-Key support for mutating requests, shared by both apps. The
+# first request with a key runs; its response (below 500) is stored and later
+# requests with the same key, method, path and caller get it back without
+# running the handler. The caller is the uid of the verified Firebase token,
+# so a retry sent after a token refresh still replays; requests without a
+# valid token (such as /auth/sync-user) have no caller to scope a key to and
+# are passed through untouched. A duplicate that arrives while the first is still
+# running waits for it. Keys live in a bounded in-memory LRU for
+# IDEMPOTENCY_TTL; IDEMPOTENCY_STORE=table also writes them to the
+# idempotency_key table so replays survive restarts and reach other workers
+# (a duplicate running on another worker gets 409 instead of waiting). A row
+# claimed for a running request holds the key for IDEMPOTENCY_LEASE_SECONDS
+# only, so a worker that died mid-request does not lock its key for the whole
+# TTL; once the lease runs out the next request with the key takes it over.
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory")
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(1 << 20)))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", str(4 * IDEMPOTENCY_WAIT_SECONDS)))
+
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = "Idempotent-Replayed"
+# Recomputed or per-response; never replayed.
+UNSTORED_HEADERS = {"content-length", "date", "server", "server-timing", "set-cookie", "transfer-encoding"}
+
+RUN, REPLAY, WAIT, MISMATCH, BUSY = "run", "replay", "wait", "mismatch", "busy"
+ERRORS = {
+    MISMATCH: (422, "Idempotency-Key was already used with a different request"),
+    BUSY: (409, "A request with this Idempotency-Key is still in progress"),
+}
+
+class StoredResponse:
+    __slots__ = ("fingerprint", "status", "headers", "body")
+
+    def __init__(self, fingerprint, status, headers, body):
+        self.fingerprint = fingerprint
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+def fingerprint(method, path, query, body):
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query.encode() if isinstance(query, str) else query, body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+def scoped_key(method, path, uid, key):
+    """Keys are per caller (verified uid) and endpoint."""
+    return hashlib.sha256("\n".join((method, path, uid, key)).encode()).hexdigest()
+
+def bearer_token(authorization):
+    if authorization and authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):]
+    return None
+
+def stored_headers(headers):
+    return [(name, value) for name, value in headers if name.lower() not in UNSTORED_HEADERS]
+
+class IdempotencyStore:
+    def __init__(self, maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL, lease=IDEMPOTENCY_LEASE_SECONDS):
+        self.ttl = ttl
+        self.lease = lease
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.inflight = {}
+        # created_at of the rows this worker claimed, so a claim taken over after
+        # its lease ran out cannot overwrite or release the new owner's row.
+        self.claims = {}
+        self.table = None
+        self.verifier = None
+        self.replays = 0
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        """Persists keys through the storage client when IDEMPOTENCY_STORE=table."""
+        if IDEMPOTENCY_STORE == "table":
+            self.table = client
+
+    def identify_with(self, verifier):
+        """Resolves callers through the app's firebase_tokens.TokenVerifier."""
+        self.verifier = verifier
+
+    def caller(self, authorization):
+        """The verified uid behind an Authorization header, or None."""
+        token = bearer_token(authorization)
+        if token is None or self.verifier is None:
+            return None
+        try:
+            return self.verifier.verify(token)["uid"]
+        except Exception:
+            # The handler rejects the token itself.
+            return None
+
+    def begin(self, key, request_fingerprint):
+        """(state, value): RUN, REPLAY / MISMATCH with the stored response, WAIT with a Future, or BUSY."""
+        with self._lock:
+            stored = self.cache.get(key)
+            if stored is not None:
+                return self.outcome(stored, request_fingerprint)
+            future = self.inflight.get(key)
+            if future is not None:
+                return WAIT, future
+            self.inflight[key] = Future()
+        if self.table is None:
+            return RUN, None
+        try:
+            return self._claim(key, request_fingerprint)
+        except Exception:
+            self.finish(key, None, persist=False)
+            raise
+
+    def outcome(self, stored, request_fingerprint):
+        if stored.fingerprint != request_fingerprint:
+            return MISMATCH, stored
+        self.replays += 1
+        return REPLAY, stored
+
+    def _claim(self, key, request_fingerprint):
+        table = self.table.table("idempotency_key")
+        rows = table.select("*").eq("key", key).execute().data
+        now = datetime.utcnow()
+        if rows and datetime.fromisoformat(rows[0]["expires_at"]) > now:
+            row = rows[0]
+            if row.get("status") is None:
+                self.finish(key, None, persist=False)
+                return BUSY, None
+            stored = StoredResponse(row["fingerprint"], row["status"], [tuple(pair) for pair in json.loads(row["headers"])],
+                                    base64.b64decode(row["body"]))
+            self.finish(key, stored, persist=False)
+            return self.outcome(stored, request_fingerprint)
+        if rows:
+            # Expired, or a claim whose lease ran out. Only a row that is still expired is
+            # removed: another worker taking it over at the same time wins the upsert below.
+            self.table.table("idempotency_key").delete().eq("key", key).lte("expires_at", now.isoformat()).execute()
+        claimed = self.table.table("idempotency_key").upsert({
+            "key": key,
+            "fingerprint": request_fingerprint,
+            "created_at": now.isoformat(),
+            "expires_at": (now + timedelta(seconds=self.lease)).isoformat(),
+        }, ignore_duplicates=True).execute().data
+        if not claimed:
+            self.finish(key, None, persist=False)
+            return BUSY, None
+        with self._lock:
+            self.claims[key] = now.isoformat()
+        return RUN, None
+
+    def finish(self, key, stored: Optional[StoredResponse], persist=True):
+        """Stores the response (None: the request failed and the key is released) and wakes waiters."""
+        with self._lock:
+            claimed_at = self.claims.pop(key, None)
+        if persist and claimed_at is not None:
+            table = self.table.table("idempotency_key")
+            if stored is None:
+                table.delete().eq("key", key).eq("created_at", claimed_at).execute()
+            else:
+                # The lease becomes the full TTL once there is a response to replay.
+                table.update({
+                    "status": stored.status,
+                    "headers": json.dumps(stored.headers),
+                    "body": base64.b64encode(stored.body).decode(),
+                    "expires_at": (datetime.utcnow() + timedelta(seconds=self.ttl)).isoformat(),
+                }).eq("key", key).eq("created_at", claimed_at).execute()
+        with self._lock:
+            if stored is not None:
+                self.cache.set(key, stored)
+            future = self.inflight.pop(key, None)
+        if future is not None:
+            future.set_result(stored)
+
+    def stats(self):
+        return {**self.cache.stats(), "inflight": len(self.inflight), "replays": self.replays}
+
+def _bounded(content_length, transfer_encoding):
+    # Bodies are read up front to fingerprint them, so large or chunked uploads are left alone.
+    if content_length is None:
+        return transfer_encoding is None
+    return content_length.isdigit() and int(content_length) <= IDEMPOTENCY_MAX_BODY
+
+def _header(headers, name):
+    for key, value in headers:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+class IdempotencyMiddleware:
+    """ASGI middleware; add it innermost so CORS, compression and metrics still wrap replays."""
+
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+
+    async def begin(self, key, request_fingerprint):
+        if self.store.table is None:
+            return self.store.begin(key, request_fingerprint)
+        return await db.run_sync(self.store.begin, key, request_fingerprint)
+
+    async def finish(self, key, stored):
+        if self.store.table is None:
+            return self.store.finish(key, stored)
+        return await db.run_sync(self.store.finish, key, stored)
+
+    async def caller(self, authorization):
+        token = bearer_token(authorization)
+        verifier = self.store.verifier
+        if token is None or verifier is None:
+            return None
+        # Verified tokens are cached, so the handler's own check is a lookup.
+        claims = verifier.lookup(token)
+        if claims is not None:
+            return claims["uid"]
+        return await db.run_sync(self.store.caller, authorization)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            return await self.app(scope, receive, send)
+        headers = scope["headers"]
+        key = _header(headers, b"idempotency-key")
+        if key is None or not _bounded(_header(headers, b"content-length"), _header(headers, b"transfer-encoding")):
+            return await self.app(scope, receive, send)
+        if len(key) > MAX_KEY_LENGTH:
+            return await self.error(send, 400, f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+        uid = await self.caller(_header(headers, b"authorization"))
+        if uid is None:
+            return await self.app(scope, receive, send)
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        request_fingerprint = fingerprint(scope["method"], scope["path"], scope.get("query_string", b""), body)
+        key = scoped_key(scope["method"], scope["path"], uid, key)
+
+        state, value = RUN, None
+        for _ in range(3):
+            state, value = await self.begin(key, request_fingerprint)
+            if state != WAIT:
+                break
+            try:
+                stored = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(value)), IDEMPOTENCY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                state = BUSY
+                break
+            if stored is not None:
+                state, value = self.store.outcome(stored, request_fingerprint)
+                break
+        else:
+            state = BUSY
+        if state == REPLAY:
+            return await self.replay(send, value)
+        if state != RUN:
+            return await self.error(send, *ERRORS[state])
+
+        delivered = False
+
+        async def receive_body():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start = None
+        response_chunks = []
+        size = 0
+
+        async def send_captured(message):
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body" and size <= IDEMPOTENCY_MAX_BODY:
+                response_chunks.append(message.get("body", b""))
+                size += len(response_chunks[-1])
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, receive_body, send_captured)
+            if start is not None and start["status"] < 500 and size <= IDEMPOTENCY_MAX_BODY:
+                response_headers = [(name.decode("latin-1"), value.decode("latin-1"))
+                                    for name, value in start.get("headers", [])]
+                stored = StoredResponse(request_fingerprint, start["status"], stored_headers(response_headers),
+                                        b"".join(response_chunks))
+        finally:
+            await self.finish(key, stored)
+
+    async def replay(self, send, stored):
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in stored.headers]
+        headers += [(b"content-length", str(len(stored.body)).encode()), (REPLAYED_HEADER.lower().encode(), b"true")]
+        await send({"type": "http.response.start", "status": stored.status, "headers": headers})
+        await send({"type": "http.response.body", "body": stored.body})
+
+    async def error(self, send, status, detail):
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+def install_flask(app, store):
+    """Registers the Flask hooks. Call after other after_request hooks so the stored body is uncompressed."""
+    from flask import Response, g, jsonify, request
+
+    wsgi_app = app.wsgi_app
+
+    def read_body(environ, start_response):
+        # Runs before Flask: buffers small bodies so they can be fingerprinted and still read by the view.
+        if (environ.get("HTTP_IDEMPOTENCY_KEY") and environ["REQUEST_METHOD"] in MUTATING_METHODS
+                and _bounded(environ.get("CONTENT_LENGTH") or None, environ.get("HTTP_TRANSFER_ENCODING"))):
+            body = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["idempotency.fingerprint"] = fingerprint(
+                environ["REQUEST_METHOD"], environ.get("PATH_INFO", ""), environ.get("QUERY_STRING", ""), body)
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = read_body
+
+    @app.before_request
+    def replay_idempotent_request():
+        request_fingerprint = request.environ.get("idempotency.fingerprint")
+        if request_fingerprint is None:
+            return None
+        key = request.headers["Idempotency-Key"]
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters"}), 400
+        uid = store.caller(request.headers.get("Authorization"))
+        if uid is None:
+            return None
+        key = scoped_key(request.method, request.path, uid, key)
+
+        state, value = BUSY, None
+        for _ in range(3):
+            state, value = store.begin(key, request_fingerprint)
+            if state != WAIT:
+                break
+            try:
+                stored = value.result(timeout=IDEMPOTENCY_WAIT_SECONDS)
+            except FutureTimeout:
+                state = BUSY
+                break
+            if stored is not None:
+                state, value = store.outcome(stored, request_fingerprint)
+                break
+        else:
+            state = BUSY
+        if state == REPLAY:
+            response = Response(value.body, status=value.status, headers=value.headers)
+            response.headers[REPLAYED_HEADER] = "true"
+            return response
+        if state != RUN:
+            status, message = ERRORS[state]
+            return jsonify({"error": message}), status
+        g.idempotency_key = key
+        g.idempotency_fingerprint = request_fingerprint
+        return None
+
+    @app.after_request
+    def store_idempotent_response(response):
+        key = g.pop("idempotency_key", None)
+        if key is None:
+            return response
+        stored = None
+        if response.status_code < 500 and not response.is_streamed and not response.direct_passthrough:
+            body = response.get_data()
+            if len(body) <= IDEMPOTENCY_MAX_BODY:
+                stored = StoredResponse(g.idempotency_fingerprint, response.status_code,
+                                        stored_headers(response.headers.items()), body)
+        store.finish(key, stored)
+        return response
+
+    @app.teardown_request
+    def release_idempotency_key(exc):
+        key = g.pop("idempotency_key", None)
+        if key is not None:
+            store.finish(key, None)
@@ -0,0 +1,244 @@
+import csv
+import io
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+import db
+
+# Bulk inventory import for POST /inventory/bulk. The upload is parsed as it
+# is read, validated row by row against insertInventorySchema
+# (shared/schema.ts) and upserted in batches, so memory stays flat however
+# large the file is. An uploaded row updates the pharmacy's existing row for
+# the same medication and batch number; other rows are inserted.
+INVENTORY_BULK_BATCH_SIZE = int(os.getenv("INVENTORY_BULK_BATCH_SIZE", "500"))
+INVENTORY_BULK_MAX_BATCH_SIZE = 5000
+INVENTORY_BULK_MAX_ERRORS = int(os.getenv("INVENTORY_BULK_MAX_ERRORS", "1000"))
+
+# New rows get an id derived from their SKU, so a SKU repeated later in the
+# same upload (or sent by a concurrent import) upserts the same row without
+# the import having to remember the ids it created.
+SKU_NAMESPACE = uuid.UUID("5b8f8b7e-3c4d-4e0a-9a57-6d1c2f0b9e21")
+
+CSV_TYPES = {"text/csv", "application/csv"}
+JSONL_TYPES = {"application/x-ndjson", "application/jsonl", "application/x-jsonlines", "application/json-lines"}
+
+# insertInventorySchema fields, snake_case as stored, with their camelCase names.
+FIELDS = {
+    "pharmacy_id": "pharmacyId",
+    "medication_id": "medicationId",
+    "quantity": "quantity",
+    "price": "price",
+    "original_price": "originalPrice",
+    "in_stock": "inStock",
+    "expiry_date": "expiryDate",
+    "batch_number": "batchNumber",
+}
+ALIASES = {camel: name for name, camel in FIELDS.items()}
+TRUE = {"true", "t", "1", "yes", "y"}
+FALSE = {"false", "f", "0", "no", "n"}
+
+class ImportFormatError(Exception):
+    pass
+
+def upload_format(requested, content_type):
+    """"csv" or "jsonl", from ?format= or the Content-Type."""
+    if requested:
+        if requested not in ("csv", "jsonl"):
+            raise ImportFormatError("format must be csv or jsonl")
+        return requested
+    if content_type in CSV_TYPES:
+        return "csv"
+    if content_type in JSONL_TYPES:
+        return "jsonl"
+    raise ImportFormatError("Send text/csv or application/x-ndjson, or pass ?format=csv|jsonl")
+
+def read_records(stream, fmt):
+    """Yields (row_number, record) from a binary stream; a record that cannot be parsed is an Exception."""
+    reader = stream if isinstance(stream, io.BufferedIOBase) else io.BufferedReader(stream)
+    if fmt == "csv":
+        rows = csv.DictReader(io.TextIOWrapper(reader, encoding="utf-8-sig", newline=""))
+        for number, record in enumerate(rows, 1):
+            if None in record:
+                yield number, ValueError("more values than header columns")
+            else:
+                yield number, record
+        return
+    number = 0
+    for line in reader:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"invalid JSON: {e}")
+            continue
+        yield number, record if isinstance(record, dict) else ValueError("each line must be a JSON object")
+
+def _number(value, name, errors, integer=False):
+    if isinstance(value, bool):
+        errors.append(f"{name} must be a number")
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        errors.append(f"{name} must be a number")
+        return None
+    if number != number or number < 0:
+        errors.append(f"{name} must be a non-negative number")
+        return None
+    if integer:
+        if not number.is_integer():
+            errors.append(f"{name} must be a whole number")
+            return None
+        return int(number)
+    return number
+
+def _bool(value, name, errors):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE:
+        return True
+    if text in FALSE:
+        return False
+    errors.append(f"{name} must be true or false")
+    return None
+
+def validate(record, pharmacy_id, medication_exists):
+    """(row, errors): a complete inventory row for the pharmacy, or the reasons the record is invalid."""
+    values = {}
+    for key, value in record.items():
+        name = ALIASES.get(key, key)
+        if name in FIELDS and value is not None and value != "":
+            values[name] = value
+    errors = []
+
+    medication_id = values.get("medication_id")
+    if medication_id is None:
+        errors.append("medication_id is required")
+    else:
+        medication_id = str(medication_id).strip()
+        if not medication_exists(medication_id):
+            errors.append(f"unknown medication_id {medication_id}")
+    if "pharmacy_id" in values and str(values["pharmacy_id"]) != pharmacy_id:
+        errors.append("pharmacy_id must be your pharmacy")
+    if "price" not in values:
+        errors.append("price is required")
+    price = _number(values["price"], "price", errors) if "price" in values else None
+    original_price = _number(values["original_price"], "original_price", errors) if "original_price" in values else None
+    quantity = _number(values.get("quantity", 0), "quantity", errors, integer=True)
+    in_stock = _bool(values.get("in_stock", True), "in_stock", errors)
+
+    expiry_date = values.get("expiry_date")
+    if expiry_date is not None:
+        try:
+            expiry_date = datetime.fromisoformat(str(expiry_date).strip().replace("Z", "+00:00"))
+            # expiry_date is a TIMESTAMP (naive UTC); Postgres would drop an offset rather than apply it.
+            if expiry_date.tzinfo is not None:
+                expiry_date = expiry_date.astimezone(timezone.utc).replace(tzinfo=None)
+            expiry_date = expiry_date.isoformat()
+        except ValueError:
+            errors.append("expiry_date must be an ISO 8601 date")
+    batch_number = values.get("batch_number")
+
+    if errors:
+        return None, errors
+    return {
+        "pharmacy_id": pharmacy_id,
+        "medication_id": medication_id,
+        "quantity": quantity,
+        "price": price,
+        "original_price": original_price,
+        "in_stock": in_stock,
+        "expiry_date": expiry_date,
+        "batch_number": str(batch_number).strip() if batch_number is not None else None,
+    }, []
+
+class InventoryImport:
+    """Upserts validated rows for one pharmacy in batches and keeps the per-row error report."""
+
+    def __init__(self, client, pharmacy_id, batch_size=INVENTORY_BULK_BATCH_SIZE, on_rows=None,
+                 max_errors=INVENTORY_BULK_MAX_ERRORS):
+        self.client = client
+        self.pharmacy_id = pharmacy_id
+        self.batch_size = batch_size
+        self.on_rows = on_rows
+        self.max_errors = max_errors
+        self.received = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.batches = 0
+        # (medication_id, batch_number) -> id of the pharmacy's rows that existed
+        # before the import; bounded by the pharmacy's SKUs, not the upload.
+        self.existing = {}
+
+    def sku_id(self, key):
+        medication_id, batch_number = key
+        return str(uuid.uuid5(SKU_NAMESPACE, f"{self.pharmacy_id}/{medication_id}/{batch_number or ''}"))
+
+    def error(self, number, messages):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": number, "errors": messages})
+
+    def load_existing(self):
+        rows = db.select_all(lambda: self.client.table("inventory").select("id,medication_id,batch_number")
+                             .eq("pharmacy_id", self.pharmacy_id))
+        for row in rows:
+            self.existing.setdefault((row["medication_id"], row.get("batch_number")), row["id"])
+
+    def run(self, records, medication_exists):
+        self.load_existing()
+        now = datetime.utcnow().isoformat()
+        batch = {}
+        for number, record in records:
+            self.received += 1
+            if isinstance(record, Exception):
+                self.error(number, [str(record)])
+                continue
+            row, messages = validate(record, self.pharmacy_id, medication_exists)
+            if messages:
+                self.error(number, messages)
+                continue
+            key = (row["medication_id"], row["batch_number"])
+            # A later row for the same SKU replaces an earlier one in the batch;
+            # one statement cannot update a row twice.
+            numbers, previous = batch.get(key, ((), None))
+            row["id"] = previous["id"] if previous else self.existing.get(key) or self.sku_id(key)
+            row["last_updated"] = now
+            batch[key] = (numbers + (number,), row)
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = {}
+        if batch:
+            self.flush(batch)
+        return self.report()
+
+    def flush(self, batch):
+        rows = [row for _, row in batch.values()]
+        self.batches += 1
+        try:
+            self.client.table("inventory").upsert(rows, returning="minimal").execute()
+        except Exception as e:
+            for numbers, _ in batch.values():
+                for number in numbers:
+                    self.error(number, [f"batch failed: {e}"])
+            return
+        for numbers, _ in batch.values():
+            self.imported += len(numbers)
+        if self.on_rows is not None:
+            self.on_rows(rows)
+
+    def report(self):
+        return {
+            "received": self.received,
+            "imported": self.imported,
+            "failed": self.failed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import db
+import metrics
+
+# Background upkeep of the inventory table. Every INVENTORY_SWEEP_INTERVAL
+# seconds a daemon thread marks expired and zero-quantity rows out of stock
+# with two bulk updates, then reloads the rows worth an alert (low stock,
+# expiring soon, recently expired) with range queries on the indexed quantity
+# and expiry_date columns. Those rows are kept per pharmacy, so
+# GET /inventory/alerts reads a pharmacy's alerts without scanning its
+# inventory. Write paths call apply() / discard() to keep them current
+# between sweeps. INVENTORY_SWEEP_INTERVAL=0 turns the sweeper off.
+INVENTORY_SWEEP_INTERVAL = float(os.getenv("INVENTORY_SWEEP_INTERVAL", "300"))
+INVENTORY_LOW_STOCK_THRESHOLD = int(os.getenv("INVENTORY_LOW_STOCK_THRESHOLD", "10"))
+INVENTORY_EXPIRY_WARNING_DAYS = float(os.getenv("INVENTORY_EXPIRY_WARNING_DAYS", "30"))
+INVENTORY_EXPIRED_LOOKBACK_DAYS = float(os.getenv("INVENTORY_EXPIRED_LOOKBACK_DAYS", "30"))
+INVENTORY_ALERTS_MAX_ITEMS = int(os.getenv("INVENTORY_ALERTS_MAX_ITEMS", "100"))
+
+ALERT_COLUMNS = "id,pharmacy_id,medication_id,quantity,in_stock,expiry_date,batch_number"
+ALERT_KEYS = ALERT_COLUMNS.split(",")
+
+logger = logging.getLogger(__name__)
+
+def expiry(row):
+    """The row's expiry_date as a naive UTC datetime, or None."""
+    value = row.get("expiry_date")
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def utc_iso(value):
+    """ISO 8601 text of a naive UTC datetime, with its +00:00 offset spelled out."""
+    return value.replace(tzinfo=timezone.utc).isoformat()
+
+class InventorySweeper:
+    def __init__(self, client, on_rows=None, interval=INVENTORY_SWEEP_INTERVAL,
+                 threshold=INVENTORY_LOW_STOCK_THRESHOLD, warning_days=INVENTORY_EXPIRY_WARNING_DAYS,
+                 lookback_days=INVENTORY_EXPIRED_LOOKBACK_DAYS):
+        self.client = client
+        self.on_rows = on_rows
+        self.interval = interval
+        self.threshold = threshold
+        self.warning = timedelta(days=warning_days)
+        self.lookback = timedelta(days=lookback_days)
+        # pharmacy_id -> {inventory_id: row}, only rows worth an alert.
+        self.rows = {}
+        self.pharmacy_of = {}
+        self.swept_at = None
+        self.sweeps = 0
+        self.flipped = 0
+        self.errors = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._sweep_loop, name="inventory-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                self.errors += 1
+                metrics.BACKGROUND_ERRORS.inc("inventory_sweep")
+                logger.exception("Inventory sweep failed")
+            if self._stopped.wait(self.interval):
+                return
+
+    def sweep(self, now=None):
+        now = now or datetime.utcnow()
+        # An explicit offset, so the bounds are read as UTC whatever offset the stored values carried.
+        stamp = utc_iso(now)
+        flipped = []
+        for out_of_stock in (lambda query: query.lt("expiry_date", stamp), lambda query: query.lte("quantity", 0)):
+            query = self.client.table("inventory").update({"in_stock": False, "last_updated": stamp}).eq("in_stock", True)
+            flipped += out_of_stock(query).execute().data
+        if flipped and self.on_rows is not None:
+            self.on_rows(flipped)
+
+        with self._lock:
+            self._pending = []
+        try:
+            rows = db.select_all(lambda: self.client.table("inventory").select(ALERT_COLUMNS)
+                                 .lte("quantity", self.threshold))
+            rows += db.select_all(lambda: self.client.table("inventory").select(ALERT_COLUMNS)
+                                  .gte("expiry_date", utc_iso(now - self.lookback))
+                                  .lt("expiry_date", utc_iso(now + self.warning)))
+            by_pharmacy = {}
+            for row in rows:
+                by_pharmacy.setdefault(row["pharmacy_id"], {})[row["id"]] = row
+            with self._lock:
+                self.rows = by_pharmacy
+                self.pharmacy_of = {row["id"]: row["pharmacy_id"] for row in rows}
+                # Writes that landed while the sweep was reading are applied on top.
+                for change in self._pending:
+                    if isinstance(change, dict):
+                        self._apply(change, now)
+                    else:
+                        self._discard(change)
+                self.swept_at = now
+                self.sweeps += 1
+                self.flipped += len(flipped)
+        finally:
+            with self._lock:
+                self._pending = None
+        return flipped
+
+    def alerting(self, row, now):
+        if (row.get("quantity") or 0) <= self.threshold:
+            return True
+        expires = expiry(row)
+        return expires is not None and now - self.lookback <= expires < now + self.warning
+
+    def apply(self, row):
+        """Record an inserted or updated inventory row."""
+        row = {key: row.get(key) for key in ALERT_KEYS}
+        with self._lock:
+            self._apply(row, datetime.utcnow())
+            if self._pending is not None:
+                self._pending.append(row)
+
+    def discard(self, inventory_id):
+        with self._lock:
+            self._discard(inventory_id)
+            if self._pending is not None:
+                self._pending.append(inventory_id)
+
+    def _apply(self, row, now):
+        self._discard(row["id"])
+        if self.alerting(row, now):
+            self.rows.setdefault(row["pharmacy_id"], {})[row["id"]] = row
+            self.pharmacy_of[row["id"]] = row["pharmacy_id"]
+
+    def _discard(self, inventory_id):
+        pharmacy_id = self.pharmacy_of.pop(inventory_id, None)
+        if pharmacy_id is not None:
+            self.rows.get(pharmacy_id, {}).pop(inventory_id, None)
+
+    def alerts(self, pharmacy_id, now=None):
+        """Low-stock, expiring and expired rows of one pharmacy, or None before the first sweep."""
+        if self.swept_at is None:
+            return None
+        now = now or datetime.utcnow()
+        with self._lock:
+            rows = list(self.rows.get(pharmacy_id, {}).values())
+        low_stock, expiring, expired = [], [], []
+        for row in rows:
+            if (row.get("quantity") or 0) <= self.threshold:
+                low_stock.append(row)
+            expires = expiry(row)
+            if expires is not None and now - self.lookback <= expires < now + self.warning:
+                (expired if expires < now else expiring).append(row)
+        low_stock.sort(key=lambda row: (row.get("quantity") or 0, row["id"]))
+        expiring.sort(key=expiry)
+        expired.sort(key=expiry, reverse=True)
+        return {
+            "low_stock": {"count": len(low_stock), "items": low_stock[:INVENTORY_ALERTS_MAX_ITEMS]},
+            "expiring": {"count": len(expiring), "items": expiring[:INVENTORY_ALERTS_MAX_ITEMS]},
+            "expired": {"count": len(expired), "items": expired[:INVENTORY_ALERTS_MAX_ITEMS]},
+            "low_stock_threshold": self.threshold,
+            "expiry_warning_days": self.warning.days,
+            "swept_at": self.swept_at.isoformat(),
+        }
+
+    def stats(self):
+        return {
+            "pharmacies": len(self.rows),
+            "rows": len(self.pharmacy_of),
+            "sweeps": self.sweeps,
+            "flipped": self.flipped,
+            "errors": self.errors,
+        }
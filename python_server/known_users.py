@@ -0,0 +1,23 @@
+import os
+
+from cache import LRUCache
+
+KNOWN_USERS_SIZE = int(os.getenv("KNOWN_USERS_SIZE", "50000"))
+# Clients sync on every app launch; repeat syncs inside this window are
+# answered from memory. Writes to a user row made here go through changed().
+KNOWN_USERS_TTL = float(os.getenv("KNOWN_USERS_TTL", "300"))
+
+class KnownUsers:
+    """firebase_uid -> the user row /auth/sync-user last returned, in a bounded LRU."""
+
+    def __init__(self, maxsize=KNOWN_USERS_SIZE, ttl=KNOWN_USERS_TTL):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, firebase_uid):
+        return self.cache.get(firebase_uid)
+
+    def set(self, firebase_uid, user):
+        self.cache.set(firebase_uid, user)
+
+    def changed(self, firebase_uid):
+        self.cache.pop(firebase_uid)
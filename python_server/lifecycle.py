@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import traceback
+
+# Per-process start-up for both apps. Under the pre-forking server
+# (serve.sh / gunicorn.conf.py) an app module may be imported in the master
+# and then forked, and threads, thread pools and open connections do not
+# survive a fork. Background threads, key prefetches and cache warm-ups are
+# therefore registered with on_start and run in the process that serves
+# requests: from gunicorn's post_worker_init hook, the FastAPI lifespan or
+# Flask's first request, whichever comes first. Background hooks run in a
+# thread of their own and are retried every LIFECYCLE_RETRY_SECONDS until
+# they succeed; /ready answers 503 until every ready_when check passes.
+LIFECYCLE_RETRY_SECONDS = float(os.getenv("LIFECYCLE_RETRY_SECONDS", "5"))
+
+class Worker:
+    """Start-up hooks and readiness checks of the current worker process."""
+
+    def __init__(self, retry_seconds=LIFECYCLE_RETRY_SECONDS):
+        self.retry_seconds = retry_seconds
+        self.hooks = []
+        self.checks = []
+        self.failures = {}
+        self.pid = None
+        self.started_at = None
+        self._lock = threading.Lock()
+
+    def on_start(self, fn, background=False):
+        self.hooks.append((fn, background))
+        return fn
+
+    def ready_when(self, name, check):
+        self.checks.append((name, check))
+
+    @property
+    def started(self):
+        return self.pid == os.getpid()
+
+    def start(self):
+        """Runs the hooks once per process; cheap to call on every request."""
+        if self.started:
+            return
+        with self._lock:
+            if self.started:
+                return
+            self.failures = {}
+            for fn, background in self.hooks:
+                if background:
+                    threading.Thread(target=self._retry, args=(fn,), name=f"start-{fn.__name__}", daemon=True).start()
+                else:
+                    self._run(fn)
+            self.started_at = time.time()
+            self.pid = os.getpid()
+
+    def _run(self, fn):
+        try:
+            fn()
+        except Exception as e:
+            self.failures[fn.__name__] = str(e)
+            print(f"Worker {os.getpid()} start-up hook {fn.__name__} failed: {str(e)}")
+            traceback.print_exc()
+            return False
+        self.failures.pop(fn.__name__, None)
+        return True
+
+    def _retry(self, fn):
+        while not self._run(fn):
+            time.sleep(self.retry_seconds)
+
+    def readiness(self):
+        """(ready, body) for /ready: whether this worker has started and every check passes."""
+        results = {"started": self.started}
+        for name, check in self.checks:
+            try:
+                results[name] = bool(check())
+            except Exception:
+                results[name] = False
+        ready = all(results.values())
+        return ready, {"status": "ready" if ready else "starting", "pid": os.getpid(), "checks": results}
+
+    def health(self):
+        return {
+            "pid": os.getpid(),
+            "ppid": os.getppid(),
+            "started": self.started,
+            "uptime_seconds": round(time.time() - self.started_at, 1) if self.started else None,
+            "threads": sorted(t.name for t in threading.enumerate()),
+            "failures": dict(self.failures),
+        }
+
+worker = Worker()
@@ -0,0 +1,323 @@
+import os
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+# Per-request timings for both apps. A RequestTimings object rides in a
+# ContextVar for the duration of a request (db.execute / db.run_sync carry it
+# into the executor threads), so storage calls, token verification, encoding
+# and compression can add their time to it wherever they run. Every
+# observation also feeds process-wide histograms rendered at /metrics in the
+# Prometheus text format; each request gets a Server-Timing header.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+STORAGE_OPERATIONS = {"select", "insert", "upsert", "update", "delete"}
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in items]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self.series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Gauge:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self.lock:
+            items = sorted(self.values.items())
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in items]
+        return lines
+
+REQUESTS = Counter("http_requests_total", "Requests handled, by route and status.", ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time until the response starts, by route.",
+                            ("method", "route"))
+STORAGE_SECONDS = Histogram("storage_call_duration_seconds", "Supabase / storage round trips, by table and operation.",
+                            ("table", "operation"))
+STORAGE_CALLS_PER_REQUEST = Histogram("storage_calls_per_request", "Storage round trips made by one request.",
+                                      ("route",), buckets=COUNT_BUCKETS)
+PHASE_SECONDS = Histogram("request_phase_duration_seconds", "Time in auth, encode and compress, per request.",
+                          ("phase",))
+UPSTREAM_COALESCED = Counter("upstream_coalesced_total", "Storage reads answered by an identical read already in flight.",
+                             ("table",))
+UPSTREAM_SHED = Counter("upstream_shed_total", "Storage calls refused because the upstream queue was full or timed out.",
+                        ("reason",))
+UPSTREAM_IN_FLIGHT = Gauge("upstream_in_flight", "Storage calls holding an upstream slot.")
+UPSTREAM_QUEUE_DEPTH = Gauge("upstream_queue_depth", "Storage calls waiting for an upstream slot.")
+UPSTREAM_QUEUE_SECONDS = Histogram("upstream_queue_wait_seconds", "Time storage calls waited for an upstream slot.")
+BACKGROUND_ERRORS = Counter("background_task_errors_total", "Failed runs of background tasks, by task.", ("task",))
+REGISTRY = [REQUESTS, REQUEST_SECONDS, STORAGE_SECONDS, STORAGE_CALLS_PER_REQUEST, PHASE_SECONDS,
+            UPSTREAM_COALESCED, UPSTREAM_SHED, UPSTREAM_IN_FLIGHT, UPSTREAM_QUEUE_DEPTH, UPSTREAM_QUEUE_SECONDS,
+            BACKGROUND_ERRORS]
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+class RequestTimings:
+    __slots__ = ("seconds", "counts")
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+
+    def add(self, phase, seconds):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def server_timing(self, total):
+        parts = []
+        for phase, seconds in self.seconds.items():
+            part = f"{phase};dur={seconds * 1000:.2f}"
+            if phase == "db":
+                part += f';desc="{self.counts[phase]} calls"'
+            parts.append(part)
+        parts.append(f"app;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+def record(phase, seconds):
+    PHASE_SECONDS.observe(seconds, phase)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+class timer:
+    """Times a block as a request phase: `with metrics.timer("auth"): ...`."""
+
+    __slots__ = ("phase", "start")
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if METRICS_ENABLED:
+            record(self.phase, perf_counter() - self.start)
+        return False
+
+def record_storage(table, operation, seconds):
+    STORAGE_SECONDS.observe(seconds, table, operation)
+    timings = _current.get()
+    if timings is not None:
+        timings.add("db", seconds)
+
+def begin_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings), perf_counter()
+
+def end_request(token):
+    _current.reset(token)
+
+def finish_request(method, route, status, timings, elapsed):
+    REQUESTS.inc(method, route, str(status))
+    REQUEST_SECONDS.observe(elapsed, method, route)
+    STORAGE_CALLS_PER_REQUEST.observe(timings.counts.get("db", 0), route)
+
+class _TimedQuery:
+    """Wraps a postgrest-style builder; execute() is timed and labelled with its table and operation.
+
+    Builder methods replace the wrapped query and return the wrapper, as the
+    postgrest filter methods do, so chains allocate nothing per call.
+    """
+
+    __slots__ = ("_query", "_table", "_operation")
+
+    def __init__(self, query, table, operation):
+        self._query = query
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def execute(self):
+        start = perf_counter()
+        try:
+            return self._query.execute()
+        finally:
+            record_storage(self._table, self._operation or "select", perf_counter() - start)
+
+def _chained(name):
+    def method(self, *args, **kwargs):
+        self._query = getattr(self._query, name)(*args, **kwargs)
+        if self._operation is None and name in STORAGE_OPERATIONS:
+            self._operation = name
+        return self
+    method.__name__ = name
+    return method
+
+QUERY_METHODS = (*STORAGE_OPERATIONS, "eq", "neq", "gt", "gte", "lt", "lte", "in_", "is_", "like", "ilike", "match",
+                 "not_", "or_", "filter", "contains", "order", "limit", "offset", "range", "single", "maybe_single")
+for _name in QUERY_METHODS:
+    setattr(_TimedQuery, _name, _chained(_name))
+
+class InstrumentedClient:
+    def __init__(self, client):
+        self.client = client
+
+    def table(self, name):
+        return _TimedQuery(self.client.table(name), name, None)
+
+    from_ = table
+
+    def rpc(self, name, *args, **kwargs):
+        return _TimedQuery(self.client.rpc(name, *args, **kwargs), name, "rpc")
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+def instrument_client(client):
+    return InstrumentedClient(client) if METRICS_ENABLED else client
+
+_route_paths = {}
+
+def route_template(scope):
+    """The path template of the route that handled an ASGI request, e.g. "/orders/{order_id}"."""
+    endpoint = scope.get("endpoint")
+    router = scope.get("router")
+    if endpoint is None or router is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        for route in router.routes:
+            if getattr(route, "endpoint", None) is endpoint:
+                path = _route_paths[endpoint] = route.path
+                break
+    return path or "unmatched"
+
+class MetricsMiddleware:
+    """ASGI middleware: request counts and latency per route, plus the Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        timings, token, start = begin_request()
+        status = 500
+        elapsed = None
+
+        async def send_timed(message):
+            nonlocal status, elapsed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed = perf_counter() - start
+                if SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timings.server_timing(elapsed).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            end_request(token)
+            finish_request(scope["method"], route_template(scope), status, timings,
+                           perf_counter() - start if elapsed is None else elapsed)
+
+def install_flask(app):
+    """Registers the Flask hooks. Call before other after_request hooks so this one runs last."""
+    from flask import g, request
+
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_timing():
+        g.request_timings, g.request_timings_token, g.request_started = begin_request()
+
+    @app.after_request
+    def finish_request_timing(response):
+        timings = g.get("request_timings")
+        if timings is None:
+            return response
+        elapsed = perf_counter() - g.request_started
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = timings.server_timing(elapsed)
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        finish_request(request.method, route, response.status_code, timings, elapsed)
+        return response
+
+    @app.teardown_request
+    def reset_request_timing(exc):
+        token = g.pop("request_timings_token", None)
+        if token is not None:
+            end_request(token)
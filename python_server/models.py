@@ -1,4 +1,4 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, UniqueConstraint
 from datetime import datetime
 from typing import Optional
 import uuid
@@ -20,14 +20,20 @@ class User(SQLModel, table=True):
     __tablename__ = "user"
     
     id: str = Field(default_factory=gen_uuid, primary_key=True)
-    firebase_uid: str
-    name: str
-    surname: str
-    email: str
-    mobile_number: str
-    date_of_birth: datetime
+    firebase_uid: Optional[str] = Field(default=None, unique=True, index=True)
+    name: Optional[str] = None
+    surname: Optional[str] = None
+    email: Optional[str] = None
+    mobile_number: Optional[str] = None
+    date_of_birth: Optional[datetime] = None
+    # Columns from create_tables.sql, written by the Flask backend.
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    profile_image_url: Optional[str] = None
+    pharmacy_id: Optional[str] = None
     role: str = Field(default="customer")
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Pharmacy(SQLModel, table=True):
     __tablename__ = "pharmacy"
@@ -40,14 +46,21 @@ class Pharmacy(SQLModel, table=True):
     country: Optional[str] = None
     latitude: Optional[float] = None
     longitude: Optional[float] = None
-    email: str
+    email: Optional[str] = None
     phone: str
     is_active: bool = True
     opening_hours: Optional[str] = None
     logo_url: Optional[str] = None
-    license_number: str
+    license_number: Optional[str] = None
     is_verified: bool = False
-    created_at: datetime = Field(default=datetime.utcnow)
+    hours: str = "24/7"
+    is_open_24_hours: bool = True
+    rating: Optional[float] = 4.5
+    delivery_time: Optional[str] = "15-20 min"
+    distance: Optional[str] = None
+    delivery_fee: Optional[float] = 0.0
+    onboarding_status: str = "pending"
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Medication(SQLModel, table=True):
     __tablename__ = "medication"
@@ -56,13 +69,30 @@ class Medication(SQLModel, table=True):
     name: str
     description: Optional[str] = None
     dosage: Optional[str] = None
+    strength: Optional[str] = None
+    form_factor: Optional[str] = None
     manufacturer: Optional[str] = None
     category: Optional[str] = None
+    requires_prescription: bool = False
     is_otc: bool = True
     price: float = 0.0
     image_url: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class Inventory(SQLModel, table=True):
+    __tablename__ = "inventory"
+
+    id: str = Field(default_factory=gen_uuid, primary_key=True)
+    pharmacy_id: str = Field(index=True)
+    medication_id: str = Field(index=True)
+    quantity: int = Field(default=0, index=True)
+    price: float
+    original_price: Optional[float] = None
+    in_stock: bool = True
+    expiry_date: Optional[datetime] = Field(default=None, index=True)
+    batch_number: Optional[str] = None
+    last_updated: datetime = Field(default_factory=datetime.utcnow)
+
 class Order(SQLModel, table=True):
     __tablename__ = "order"
     
@@ -70,8 +100,9 @@ class Order(SQLModel, table=True):
     user_id: str = Field(index=True)
     pharmacy_id: str = Field(index=True)
     status: OrderStatus = Field(default=OrderStatus.created)
-    total_amount: float = 0.0
+    total: float = 0.0
     delivery_address: str
+    payment_method: Optional[str] = None
     delivery_city: Optional[str] = None
     delivery_state: Optional[str] = None
     delivery_latitude: Optional[float] = None
@@ -89,18 +120,20 @@ class OrderItem(SQLModel, table=True):
     dosage: Optional[str] = None
     quantity: int = 1
     unit_price: float = 0.0
-    total_price: float = 0.0
+    subtotal: float = 0.0
+    inventory_id: Optional[str] = None
 
 class Cart(SQLModel, table=True):
     __tablename__ = "cart"
     
     id: str = Field(default_factory=gen_uuid, primary_key=True)
-    user_id: str = Field(index=True)
+    user_id: str = Field(index=True, unique=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class CartItem(SQLModel, table=True):
     __tablename__ = "cart_item"
+    __table_args__ = (UniqueConstraint("cart_id", "medication_id"),)
     
     id: str = Field(default_factory=gen_uuid, primary_key=True)
     cart_id: str = Field(index=True)
@@ -110,3 +143,14 @@ class CartItem(SQLModel, table=True):
     quantity: int = 1
     unit_price: float = 0.0
     total_price: float = 0.0
+
+class IdempotencyKey(SQLModel, table=True):
+    __tablename__ = "idempotency_key"
+
+    key: str = Field(primary_key=True)
+    fingerprint: str
+    status: Optional[int] = None
+    headers: Optional[str] = None
+    body: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
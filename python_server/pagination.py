@@ -0,0 +1,99 @@
+import os
+import json
+import base64
+import bisect
+import itertools
+from typing import Optional, List
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+MEDICATION_FIELDS = {
+    "id", "name", "strength", "dosage", "manufacturer", "category", "description",
+    "form_factor", "requires_prescription", "is_otc", "price", "image_url", "created_at",
+}
+PHARMACY_FIELDS = {
+    "id", "name", "address", "city", "state", "country", "phone", "email", "hours", "rating",
+    "is_open_24_hours", "delivery_time", "distance", "latitude", "longitude", "delivery_fee",
+    "onboarding_status", "is_active", "opening_hours", "logo_url", "license_number",
+    "is_verified", "created_at",
+    # Filled in per request when the caller passes lat / lng.
+    "distance_km", "eta_minutes", "deliverable",
+}
+INVENTORY_FIELDS = {
+    "id", "pharmacy_id", "medication_id", "quantity", "price", "original_price", "in_stock",
+    "expiry_date", "batch_number", "last_updated",
+}
+
+class PageRequestError(ValueError):
+    pass
+
+def encode_cursor(last_id) -> str:
+    raw = json.dumps({"after": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        after = json.loads(raw)["after"]
+    except (ValueError, KeyError, TypeError):
+        raise PageRequestError("Invalid cursor")
+    # Ids are strings; anything else cannot be compared with them.
+    if not isinstance(after, str):
+        raise PageRequestError("Invalid cursor")
+    return after
+
+def parse_limit(value) -> int:
+    if value is None or value == "":
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise PageRequestError("limit must be a number")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise PageRequestError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+def parse_fields(value: Optional[str], allowed) -> Optional[List[str]]:
+    if not value:
+        return None
+    fields = [f.strip() for f in value.split(",") if f.strip()]
+    unknown = sorted(set(fields) - allowed)
+    if unknown:
+        raise PageRequestError(f"Unknown fields: {', '.join(unknown)}")
+    # The cursor is built from the id, so it is always selected.
+    return ["id"] + [f for f in dict.fromkeys(fields) if f != "id"]
+
+def select_columns(fields: Optional[List[str]]) -> str:
+    return ",".join(fields) if fields else "*"
+
+def page_query(query, after, limit):
+    # One extra row tells us whether another page follows without a count query.
+    query = query.order("id").limit(limit + 1)
+    if after is not None:
+        query = query.gt("id", after)
+    return query
+
+def finish_page(rows, limit):
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1]["id"])
+    return rows, None
+
+def paginate_rows(ids, rows, after, limit, fields=None, where=None):
+    """Keyset page over `rows` already sorted by id (`ids` is the matching key list)."""
+    start = bisect.bisect_right(ids, after) if after is not None else 0
+    if where is None:
+        candidates = rows[start:start + limit + 1]
+    else:
+        candidates = list(itertools.islice(filter(where, itertools.islice(rows, start, None)), limit + 1))
+    page, next_cursor = finish_page(candidates, limit)
+    return project(page, fields), next_cursor
+
+def project(rows, fields=None):
+    if not fields:
+        return rows
+    return [{f: row.get(f) for f in fields} for row in rows]
@@ -0,0 +1,39 @@
+import os
+
+from cache import LRUCache
+
+PHARMACY_CONTEXT_SIZE = int(os.getenv("PHARMACY_CONTEXT_SIZE", "10000"))
+# Bounds how long a change made outside this process (another worker, the
+# dashboard) can go unseen; changes made here go through changed().
+PHARMACY_CONTEXT_TTL = float(os.getenv("PHARMACY_CONTEXT_TTL", "60"))
+
+_MISSING = object()
+
+class PharmacyContext:
+    """uid -> pharmacy_id of the pharmacy the user runs, cached in a bounded LRU.
+
+    Only users with a pharmacy are cached, so finishing setup_pharmacy is
+    seen on the next request even without the refresh it does here.
+    """
+
+    def __init__(self, loader, maxsize=PHARMACY_CONTEXT_SIZE, ttl=PHARMACY_CONTEXT_TTL):
+        self.loader = loader
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, uid):
+        pharmacy_id = self.cache.get(uid, _MISSING)
+        if pharmacy_id is _MISSING:
+            pharmacy_id = self.loader(uid)
+            if pharmacy_id:
+                self.cache.set(uid, pharmacy_id)
+        return pharmacy_id
+
+    def set(self, uid, pharmacy_id):
+        if pharmacy_id:
+            self.cache.set(uid, pharmacy_id)
+        else:
+            self.cache.pop(uid)
+
+    def changed(self, uid):
+        """Change hook for writes to a user row: drops the entry so the next get() reloads it."""
+        self.cache.pop(uid)
@@ -0,0 +1,177 @@
+import os
+import random
+import sys
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+import metrics
+
+# Wall-clock sampling profiler for a live worker. A daemon thread wakes every
+# interval, reads every other thread's stack through sys._current_frames() and
+# counts it as one collapsed stack ("outer;inner;leaf"), the input format of
+# flamegraph.pl and speedscope. Nothing is hooked into the interpreter, so the
+# cost is paid by the sampler thread only, once per interval.
+#
+# Stacks are tagged with the route of the request they belong to. On the event
+# loop thread the request's ProfilerMiddleware frame is part of the running
+# stack; in executor threads db.execute / db.run_sync go through call(), which
+# records the route for the thread while the work runs.
+#
+# PROFILE_SAMPLE_RATE > 0 turns on the continuous mode: that fraction of
+# requests is tagged, only their stacks are counted, and the totals are read
+# back from /admin/profile/continuous.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Leaf frames of threads parked waiting for work; left out unless idle stacks are asked for.
+IDLE_FRAMES = {("selectors.py", "select"), ("thread.py", "_worker"), ("threading.py", "wait"), ("queue.py", "get"),
+               ("firebase_tokens.py", "_refresh_loop")}
+UNTAGGED = "untagged"
+
+_request_frames = {}
+_thread_scopes = {}
+_scope: ContextVar[Optional[dict]] = ContextVar("profiled_request", default=None)
+_labels = {}
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+def _route(scope):
+    return f"{scope['method']} {metrics.route_template(scope)}"
+
+class Sampler(threading.Thread):
+    """Counts collapsed stacks of all other threads every `interval` seconds until stopped."""
+
+    def __init__(self, interval, tagged_only=False, idle=False):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.tagged_only = tagged_only
+        self.idle = idle
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.tagged_only and not (_request_frames or _thread_scopes):
+                continue
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def sample(self):
+        own = threading.get_ident()
+        request_frames = _request_frames
+        collected = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if not self.idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            scope = _thread_scopes.get(ident)
+            codes = []
+            while frame is not None:
+                if scope is None and request_frames:
+                    scope = request_frames.get(id(frame))
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            if scope is None and self.tagged_only:
+                continue
+            collected.append((_route(scope) if scope is not None else UNTAGGED, tuple(codes)))
+        with self.lock:
+            self.samples += 1
+            self.stacks.update(collected)
+
+    def collapsed(self, reset=False):
+        with self.lock:
+            stacks = self.stacks
+            samples = self.samples
+            if reset:
+                self.stacks = Counter()
+                self.samples = 0
+        # Stacks are counted as code objects, leaf first, and only formatted here.
+        lines = [f"{route};{';'.join(_label(code) for code in reversed(codes))} {count}\n"
+                 for (route, codes), count in stacks.most_common()]
+        return "".join(lines), samples
+
+_session: Optional[Sampler] = None
+_session_lock = threading.Lock()
+_continuous: Optional[Sampler] = None
+
+class ProfilerBusy(Exception):
+    pass
+
+def begin(interval, idle=False):
+    """Starts an on-demand profile of every thread; only one runs per worker at a time."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            raise ProfilerBusy("A profile is already running on this worker")
+        _session = Sampler(interval, idle=idle)
+        _session.start()
+        return _session
+
+def end(sampler):
+    global _session
+    sampler.stop()
+    with _session_lock:
+        if _session is sampler:
+            _session = None
+    return sampler.collapsed()
+
+def start_continuous():
+    global _continuous
+    if PROFILE_SAMPLE_RATE > 0 and _continuous is None:
+        _continuous = Sampler(PROFILE_INTERVAL_MS / 1000, tagged_only=True)
+        _continuous.start()
+    return _continuous
+
+def stop_continuous():
+    global _continuous
+    if _continuous is not None:
+        _continuous.stop()
+        _continuous = None
+
+def continuous():
+    return _continuous
+
+def call(fn, *args):
+    """Runs fn, tagging this thread with the current request while it does (used by db's executor offload)."""
+    scope = _scope.get()
+    if scope is None:
+        return fn(*args)
+    ident = threading.get_ident()
+    _thread_scopes[ident] = scope
+    try:
+        return fn(*args)
+    finally:
+        _thread_scopes.pop(ident, None)
+
+class ProfilerMiddleware:
+    """ASGI middleware that tags requests for the sampler: all of them during a profile, else PROFILE_SAMPLE_RATE."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        sampled = _session is not None or (_continuous is not None and random.random() < PROFILE_SAMPLE_RATE)
+        if scope["type"] != "http" or not sampled:
+            return await self.app(scope, receive, send)
+        key = id(sys._getframe())
+        _request_frames[key] = scope
+        token = _scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _scope.reset(token)
+            del _request_frames[key]
@@ -0,0 +1,148 @@
+import os
+import gzip
+import json
+import hashlib
+import metrics
+from decimal import Decimal
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FAST_JSON = os.getenv("FAST_JSON", "1") != "0"
+# Bodies smaller than this are sent as-is; 0 turns compression off.
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "3"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Lets browsers and CDNs reuse catalog reads for a short while, then revalidate with If-None-Match.
+CACHE_MAX_AGE = int(os.getenv("CACHE_MAX_AGE", "60"))
+CACHE_CONTROL = f"public, max-age={CACHE_MAX_AGE}"
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj) -> bytes:
+    if orjson is not None and FAST_JSON:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    wildcard = weights.get("*", 0.0)
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if weights.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+def should_compress(content_type: Optional[str], content_encoding: Optional[str], size: int) -> bool:
+    return (
+        0 < COMPRESS_MIN_BYTES <= size
+        and not content_encoding
+        and bool(content_type)
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+    )
+
+def compress(body: bytes, encoding: str) -> bytes:
+    with metrics.timer("compress"):
+        if encoding == "br":
+            return brotli.compress(body, quality=BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+def make_etag(*parts, encoding: Optional[str] = None) -> str:
+    """A strong validator of parts; each content-coding of the body gets its own, e.g. "<hash>-gzip"."""
+    digest = hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+    if encoding:
+        return f'"{digest[:32]}-{encoding}"'
+    return f'"{digest[:32]}"'
+
+def etag_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The content-coding a catalog response to this Accept-Encoding may be sent in."""
+    if COMPRESS_MIN_BYTES <= 0:
+        return None
+    return choose_encoding(accept_encoding)
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _header(headers, name):
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete (non-streamed) responses with br or gzip.
+
+    Streamed bodies such as server-sent events pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or COMPRESS_MIN_BYTES <= 0:
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(_header(scope["headers"], b"accept-encoding"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                return await send(message)
+            headers = list(start["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body") or not should_compress(
+                _header(headers, b"content-type"), _header(headers, b"content-encoding"), len(body)
+            ):
+                await send(start)
+                start = None
+                return await send(message)
+            body = compress(body, encoding)
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers += [
+                (b"content-length", str(len(body)).encode()),
+                (b"content-encoding", encoding.encode()),
+            ]
+            if "accept-encoding" not in (_header(headers, b"vary") or "").lower():
+                headers.append((b"vary", b"Accept-Encoding"))
+            await send({**start, "headers": headers})
+            start = None
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
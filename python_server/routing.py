@@ -0,0 +1,207 @@
+import os
+
+import numpy as np
+
+from geo import haversine_km
+import delivery
+import db
+
+ROUTING_MAX_KM = float(os.getenv("ROUTING_MAX_KM", "25"))
+ROUTING_DEFAULT_FEE = float(os.getenv("ROUTING_DEFAULT_FEE", "0"))
+MAX_LOCAL_SEARCH_ROUNDS = 20
+# Rows kept for the search: the cheapest few per item plus the best all-rounders.
+SHORTLIST_PER_ITEM = 8
+SHORTLIST_BY_COVERAGE = 64
+
+def selection_cost(costs, fees, selected):
+    """Delivery fees plus the cheapest line cost per item over `selected` rows (inf if not covered)."""
+    if not selected:
+        return np.inf
+    return fees[selected].sum() + costs[selected].min(axis=0).sum()
+
+def greedy_cover(costs, fees):
+    """Weighted greedy set cover: repeatedly take the row with the lowest cost per newly covered item."""
+    available = np.isfinite(costs)
+    filled = np.where(available, costs, 0.0)
+    covered = np.zeros(costs.shape[1], dtype=bool)
+    selected = []
+    while not covered.all():
+        new = available & ~covered
+        counts = new.sum(axis=1)
+        if not counts.any():
+            break
+        spend = fees + (filled * new).sum(axis=1)
+        ratio = np.divide(spend, counts, out=np.full(len(counts), np.inf), where=counts > 0)
+        row = int(np.argmin(ratio))
+        selected.append(row)
+        covered |= available[row]
+    return selected
+
+def local_search(costs, fees, selected, rounds=MAX_LOCAL_SEARCH_ROUNDS):
+    """Best-improvement add / drop / swap moves until no single move lowers the cost."""
+    cost = selection_cost(costs, fees, selected)
+    for _ in range(rounds):
+        best_cost, best = cost, None
+        current = costs[selected].min(axis=0)
+        fee_total = fees[selected].sum()
+
+        added = fee_total + fees + np.minimum(costs, current).sum(axis=1)
+        added[selected] = np.inf
+        row = int(np.argmin(added))
+        if added[row] < best_cost - 1e-9:
+            best_cost, best = added[row], selected + [row]
+
+        for k, dropped in enumerate(selected):
+            rest = selected[:k] + selected[k + 1:]
+            rest_min = costs[rest].min(axis=0) if rest else np.full(costs.shape[1], np.inf)
+            rest_fees = fee_total - fees[dropped]
+            if rest and rest_fees + rest_min.sum() < best_cost - 1e-9:
+                best_cost, best = rest_fees + rest_min.sum(), rest
+            swapped = rest_fees + fees + np.minimum(costs, rest_min).sum(axis=1)
+            swapped[selected] = np.inf
+            row = int(np.argmin(swapped))
+            if swapped[row] < best_cost - 1e-9:
+                best_cost, best = swapped[row], rest + [row]
+
+        if best is None:
+            break
+        selected, cost = best, best_cost
+    return selected, cost
+
+def shortlist(costs, fees):
+    """Indexes of the rows worth searching; the rest are dominated for every practical cart."""
+    if len(fees) <= SHORTLIST_BY_COVERAGE:
+        return np.arange(len(fees))
+    k = min(SHORTLIST_PER_ITEM, len(fees) - 1)
+    cheapest = np.argpartition(costs, k, axis=0)[:k].ravel()
+    available = np.isfinite(costs)
+    counts = available.sum(axis=1)
+    spend = fees + np.where(available, costs, 0.0).sum(axis=1)
+    ratio = np.divide(spend, counts, out=np.full(len(counts), np.inf), where=counts > 0)
+    rounders = np.argpartition(ratio, SHORTLIST_BY_COVERAGE)[:SHORTLIST_BY_COVERAGE]
+    rows = np.union1d(cheapest, rounders)
+    return rows[np.isfinite(costs[rows]).any(axis=1)]
+
+def plan(costs, fees, distances, objective="cheapest"):
+    """Rows of `costs` (pharmacies x items, line cost or inf) chosen to cover every coverable item.
+
+    "cheapest" minimises fees plus item costs. "fastest" first finds the
+    smallest delivery radius whose pharmacies can still cover the cart, then
+    minimises cost inside it.
+    """
+    rows = np.arange(len(fees))
+    if objective == "fastest":
+        order = np.argsort(distances, kind="stable")
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        first = np.where(np.isfinite(costs), rank[:, None], len(order)).min(axis=0)
+        first = first[first < len(order)]
+        if len(first):
+            rows = order[:first.max() + 1]
+    rows = rows[shortlist(costs[rows], fees[rows])]
+    selected = greedy_cover(costs[rows], fees[rows])
+    selected, _ = local_search(costs[rows], fees[rows], selected)
+    return [int(rows[s]) for s in selected]
+
+class CartRouter:
+    """Quotes which pharmacies should fulfil a cart, from StockIndex offers and pharmacy locations."""
+
+    def __init__(self, stock_index):
+        self.stock = stock_index
+        self.locator = stock_index.locator
+
+    def _candidates(self, needed, lat, lng, radius_km):
+        index = self.locator.index
+        medication_ids = list(needed)
+        batches = [self.stock.batches(medication_id) for medication_id in medication_ids]
+        positions = np.unique(np.concatenate([batch[1] for batch in batches] or [np.empty(0, dtype=np.int64)]))
+        positions = positions[index.alive[positions]]
+        distances = haversine_km(lat, lng, index.lats[positions], index.lngs[positions])
+        keep = distances <= radius_km
+        positions, distances = positions[keep], distances[keep]
+
+        costs = np.full((len(positions), len(medication_ids)), np.inf)
+        for j, (_, batch_positions, prices, quantities) in enumerate(batches):
+            # Checkout's rule: the first batch (in pick order) holding the whole quantity, at its price.
+            enough = np.flatnonzero(quantities >= needed[medication_ids[j]])
+            offer_positions, first = np.unique(batch_positions[enough], return_index=True)
+            offer_prices = prices[enough[first]]
+            rows = np.searchsorted(positions, offer_positions)
+            found = rows < len(positions)
+            found[found] = positions[rows[found]] == offer_positions[found]
+            costs[rows[found], j] = offer_prices[found] * needed[medication_ids[j]]
+        return index, medication_ids, positions, distances, costs
+
+    def _fee(self, row):
+        try:
+            return float(row.get("delivery_fee") or ROUTING_DEFAULT_FEE)
+        except (TypeError, ValueError):
+            return ROUTING_DEFAULT_FEE
+
+    def _quote(self, items, lat, lng, objective, radius_km):
+        self.locator.sync()
+        needed = {}
+        for item in items:
+            needed[item["medication_id"]] = needed.get(item["medication_id"], 0) + int(item.get("quantity") or 1)
+        index, medication_ids, positions, distances, costs = self._candidates(
+            needed, lat, lng, ROUTING_MAX_KM if radius_km is None else radius_km)
+        pharmacies = [self.locator.directory.by_id.get(index.ids[p]) or {"id": index.ids[p]} for p in positions]
+        fees, etas = delivery.quote(distances, np.array([self._fee(row) for row in pharmacies], dtype=float))
+        # With DELIVERY_FEE_TIERS set, pharmacies past the last tier do not deliver here.
+        reachable = np.flatnonzero(~np.isnan(fees))
+        if len(reachable) < len(fees):
+            pharmacies = [pharmacies[i] for i in reachable]
+            distances, costs, fees, etas = distances[reachable], costs[reachable], fees[reachable], etas[reachable]
+
+        coverable = np.flatnonzero(np.isfinite(costs).any(axis=0))
+        selected = plan(costs[:, coverable], fees, distances, objective) if len(coverable) else []
+
+        stops = {}
+        routes = {}
+        if selected:
+            chosen = np.array(selected)[np.argmin(costs[np.ix_(selected, coverable)], axis=0)]
+            for j, row in zip(coverable, chosen):
+                medication_id = medication_ids[j]
+                stop = stops.get(row)
+                if stop is None:
+                    stop = stops[row] = {
+                        "pharmacy": pharmacies[row],
+                        "distance_km": round(float(distances[row]), 3),
+                        "eta_minutes": round(float(etas[row])),
+                        "delivery_fee": float(fees[row]),
+                        "items": [],
+                        "subtotal": 0.0,
+                    }
+                line_total = float(costs[row, j])
+                stop["items"].append({
+                    "medication_id": medication_id,
+                    "quantity": needed[medication_id],
+                    "unit_price": round(line_total / needed[medication_id], 2),
+                    "total_price": round(line_total, 2),
+                })
+                # Money is summed and shown in 2-decimal amounts, without float residue like 2657.6400000000003.
+                stop["subtotal"] = round(stop["subtotal"] + line_total, 2)
+                routes[medication_id] = pharmacies[row]["id"]
+
+        items_total = round(sum(stop["subtotal"] for stop in stops.values()), 2)
+        delivery_total = round(sum(stop["delivery_fee"] for stop in stops.values()), 2)
+        return {
+            "objective": objective,
+            "pharmacies": list(stops.values()),
+            "routes": routes,
+            "unavailable": [medication_id for medication_id in medication_ids if medication_id not in routes],
+            "items_total": items_total,
+            "delivery_total": delivery_total,
+            "total": round(items_total + delivery_total, 2),
+            "eta_minutes": max((stop["eta_minutes"] for stop in stops.values()), default=None),
+        }
+
+    def quote(self, items, lat, lng, objective="cheapest", radius_km=None):
+        self.locator.directory.get()
+        self.stock.ensure_loaded()
+        return self._quote(items, lat, lng, objective, radius_km)
+
+    async def aquote(self, items, lat, lng, objective="cheapest", radius_km=None):
+        await self.locator.directory.aget()
+        await self.stock.aensure_loaded()
+        return await db.run_sync(self._quote, items, lat, lng, objective, radius_km)
@@ -12,4 +12,4 @@ python seed_database.py
 
 # Start the Flask server
 echo "Starting Python backend on port 5001..."
-python app.py
+exec ./serve.sh flask
@@ -0,0 +1,267 @@
+import re
+import bisect
+import threading
+
+import numpy as np
+
+import db
+
+SEARCH_FIELDS = {"name": 3.0, "manufacturer": 1.5, "category": 1.5, "strength": 1.0, "dosage": 1.0}
+MAX_QUERY_TOKENS = 5
+# Upper bound on postings gathered for one query term, so one- and two-letter
+# prefixes stay cheap on large catalogs.
+MAX_CANDIDATES = 20000
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    return _TOKEN.findall(str(text).lower()) if text else []
+
+def trigrams(token):
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def max_typos(token):
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance, or limit + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        best = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            best = min(best, value)
+        if best > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+class SearchIndex:
+    """Token index over medication rows with prefix and typo-tolerant lookup.
+
+    Every document gets an integer slot. `postings` maps each token to the
+    slots (and field weights) containing it; scoring a query is a handful of
+    NumPy operations over those postings. `vocabulary` is the sorted token list
+    used for prefix ranges and `grams` maps trigrams to tokens for fuzzy lookup.
+    add() and remove() change these structures in place, so they and search()
+    hold `lock`: a search never sees a posting or array half updated.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.docs = []
+        self.slot_of = {}
+        self.doc_tokens = {}
+        self.alive = []
+        self.name_lengths = []
+        self.postings = {}
+        self.vocabulary = []
+        self.grams = {}
+        self._arrays = {}
+        self._dense = None
+
+    def build(self, rows):
+        with self.lock:
+            self._reset()
+            for row in rows:
+                self._index(row)
+            self.vocabulary = sorted(self.postings)
+
+    def _index(self, row):
+        weights = {}
+        for field, weight in SEARCH_FIELDS.items():
+            for token in tokenize(row.get(field)):
+                weights[token] = max(weights.get(token, 0.0), weight)
+        slot = len(self.docs)
+        self.docs.append(row)
+        self.slot_of[row["id"]] = slot
+        self.doc_tokens[slot] = weights
+        self.alive.append(True)
+        self.name_lengths.append(len(row.get("name") or ""))
+        self._dense = None
+        new_tokens = []
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                new_tokens.append(token)
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, set()).add(token)
+            posting[slot] = weight
+            self._arrays.pop(token, None)
+        return new_tokens
+
+    def add(self, row):
+        with self.lock:
+            self._remove(row["id"])
+            for token in self._index(row):
+                bisect.insort(self.vocabulary, token)
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        slot = self.slot_of.pop(doc_id, None)
+        if slot is None:
+            return
+        self.alive[slot] = False
+        self._dense = None
+        for token in self.doc_tokens.pop(slot):
+            posting = self.postings[token]
+            posting.pop(slot, None)
+            self._arrays.pop(token, None)
+            if not posting:
+                del self.postings[token]
+                position = bisect.bisect_left(self.vocabulary, token)
+                if position < len(self.vocabulary) and self.vocabulary[position] == token:
+                    del self.vocabulary[position]
+                for gram in trigrams(token):
+                    tokens = self.grams.get(gram)
+                    if tokens is not None:
+                        tokens.discard(token)
+
+    def _posting_arrays(self, token):
+        arrays = self._arrays.get(token)
+        if arrays is None:
+            posting = self.postings[token]
+            arrays = (np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                      np.fromiter(posting.values(), dtype=float, count=len(posting)))
+            self._arrays[token] = arrays
+        return arrays
+
+    def _doc_arrays(self):
+        if self._dense is None:
+            self._dense = (np.array(self.alive, dtype=bool), np.array(self.name_lengths, dtype=float))
+        return self._dense
+
+    def _fuzzy(self, term):
+        limit = max_typos(term)
+        if not limit:
+            return []
+        grams = trigrams(term)
+        shared = {}
+        for gram in grams:
+            for token in self.grams.get(gram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        # Each edit destroys at most three trigrams.
+        needed = max(1, len(grams) - 3 * limit)
+        matches = []
+        for token, count in shared.items():
+            if count >= needed and token != term:
+                distance = edit_distance(term, token, limit)
+                if distance <= limit:
+                    matches.append((token, distance))
+        return matches
+
+    def _term_tokens(self, term):
+        """(token, match quality) pairs for one query term: exact, prefix, then fuzzy."""
+        tokens = []
+        gathered = 0
+        if term in self.postings:
+            tokens.append((term, 1.0))
+            gathered += len(self.postings[term])
+        position = bisect.bisect_left(self.vocabulary, term)
+        while position < len(self.vocabulary) and gathered < MAX_CANDIDATES:
+            token = self.vocabulary[position]
+            if not token.startswith(term):
+                break
+            if token != term:
+                tokens.append((token, 0.6 + 0.3 * len(term) / len(token)))
+                gathered += len(self.postings[token])
+            position += 1
+        if gathered < MAX_CANDIDATES:
+            tokens.extend((token, 0.5 - 0.15 * (distance - 1)) for token, distance in self._fuzzy(term))
+        return tokens
+
+    def search(self, query, limit=10):
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+        if not terms:
+            return []
+        with self.lock:
+            return self._search(terms, limit)
+
+    def _search(self, terms, limit):
+        if not self.docs:
+            return []
+        alive, name_lengths = self._doc_arrays()
+        total = None
+        for term in terms:
+            scores = np.zeros(len(self.docs))
+            for token, quality in self._term_tokens(term):
+                slots, weights = self._posting_arrays(token)
+                scores[slots] = np.maximum(scores[slots], weights * quality)
+            if total is None:
+                total, matched = scores, scores > 0
+            else:
+                total += scores
+                matched &= scores > 0
+        candidates = np.flatnonzero(matched & alive)
+        if not len(candidates):
+            return []
+        # Shorter names win ties; the penalty is too small to reorder real score gaps.
+        ranking = total[candidates] - name_lengths[candidates] * 1e-6
+        if len(candidates) > limit:
+            top = np.argpartition(-ranking, limit)[:limit]
+            candidates, ranking = candidates[top], ranking[top]
+        order = sorted(range(len(candidates)), key=lambda i: (-ranking[i], self.docs[candidates[i]].get("name") or ""))
+        return [self.docs[candidates[i]] for i in order]
+
+class MedicationSearch:
+    """Keeps a SearchIndex in step with the medication SnapshotCache."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.index = SearchIndex()
+        self.index_version = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        if self.index_version == self.catalog.version:
+            return
+        # While another thread rebuilds, keep answering from the previous index.
+        if not self._lock.acquire(blocking=self.index_version is None):
+            return
+        try:
+            if self.index_version != self.catalog.version:
+                version = self.catalog.version
+                index = SearchIndex()
+                index.build(self.catalog.rows)
+                self.index = index
+                self.index_version = version
+        finally:
+            self._lock.release()
+
+    def add(self, row):
+        """Write a created or updated medication through to the catalog and the index."""
+        with self._lock:
+            in_sync = self.index_version == self.catalog.version
+            self.catalog.put(row)
+            if in_sync:
+                self.index.add(row)
+                self.index_version = self.catalog.version
+
+    def search(self, query, limit=10):
+        self.catalog.get()
+        self.sync()
+        return self.index.search(query, limit)
+
+    async def asearch(self, query, limit=10):
+        await self.catalog.aget()
+        if self.index_version != self.catalog.version:
+            await db.run_sync(self.sync)
+        return self.index.search(query, limit)
@@ -1,17 +1,10 @@
-import os
-from supabase import create_client, Client
 from dotenv import load_dotenv
+import storage
 
 load_dotenv()
 load_dotenv("../.env")
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase = storage.create_client()
 
 OTC_MEDICATIONS = [
     {
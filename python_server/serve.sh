@@ -0,0 +1,29 @@
+#!/bin/bash
+# Runs a backend under gunicorn with pre-forked workers (settings in gunicorn.conf.py).
+#
+#   ./serve.sh [flask|fastapi]           start in the foreground (default flask)
+#   ./serve.sh reload [flask|fastapi]    graceful reload onto the current code
+#
+# SERVER_MODE=dev runs the single-process development server with code
+# reloading instead (Flask debug mode, or uvicorn --reload).
+cd "$(dirname "$0")"
+
+if [ "$1" = "reload" ]; then
+  APP="${2:-flask}"
+  kill -HUP "$(cat "${GUNICORN_PIDFILE:-/tmp/bokpharm-$APP.pid}")"
+  exit
+fi
+
+export SERVER_APP="${1:-${SERVER_APP:-flask}}"
+export PORT="${PORT:-5001}"
+export GUNICORN_PIDFILE="${GUNICORN_PIDFILE:-/tmp/bokpharm-$SERVER_APP.pid}"
+
+if [ "$SERVER_MODE" = "dev" ]; then
+  if [ "$SERVER_APP" = "fastapi" ]; then
+    exec python -m uvicorn fastapi_app:app --host 0.0.0.0 --port "$PORT" --reload
+  fi
+  export FLASK_DEBUG=1
+  exec python app.py
+fi
+
+exec python -m gunicorn -c gunicorn.conf.py
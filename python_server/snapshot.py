@@ -0,0 +1,135 @@
+import os
+import time
+import hashlib
+import threading
+
+import db
+import responses
+
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "300"))
+
+class SnapshotCache:
+    """In-memory copy of a small, rarely written table: the full row list plus an id index.
+
+    Reads are served from memory until the snapshot is older than `ttl`. Only one
+    caller reloads on a miss; concurrent callers wait for that load and share it.
+    Writes made by this process are applied with put()/remove() or invalidate().
+    """
+
+    def __init__(self, loader, ttl=CATALOG_TTL_SECONDS, key="id"):
+        self.loader = loader
+        self.ttl = ttl
+        self.key = key
+        self.rows = []
+        self.by_id = {}
+        self.version = 0
+        self.loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_errors = 0
+        self._generation = 0
+        self._ordered = None
+        self._etag = None
+        self._lock = threading.Lock()
+
+    def fresh(self):
+        return self.loaded_at > 0 and time.monotonic() - self.loaded_at < self.ttl
+
+    def get(self):
+        if self.fresh():
+            self.hits += 1
+            return self.rows
+        self.misses += 1
+        with self._lock:
+            if not self.fresh():
+                self._load()
+            return self.rows
+
+    async def aget(self):
+        if self.fresh():
+            self.hits += 1
+            return self.rows
+        return await db.run_sync(self.get)
+
+    def get_by_id(self, row_id):
+        self.get()
+        return self.by_id.get(row_id)
+
+    async def aget_by_id(self, row_id):
+        await self.aget()
+        return self.by_id.get(row_id)
+
+    def ordered(self):
+        """(ids, rows) sorted by key for keyset pagination, computed once per version."""
+        ordered = self._ordered
+        version = self.version
+        if ordered is None or ordered[0] != version:
+            rows = sorted(self.rows, key=lambda row: row[self.key])
+            ordered = (version, [row[self.key] for row in rows], rows)
+            self._ordered = ordered
+        return ordered[1], ordered[2]
+
+    def etag(self):
+        """Content hash of the rows, computed once per version; equal across processes holding equal rows."""
+        tagged = self._etag
+        version = self.version
+        if tagged is None or tagged[0] != version:
+            ids, rows = self.ordered()
+            tagged = (version, hashlib.sha256(responses.dumps(rows)).hexdigest()[:32])
+            self._etag = tagged
+        return tagged[1]
+
+    async def aetag(self):
+        tagged = self._etag
+        if tagged is not None and tagged[0] == self.version:
+            return tagged[1]
+        return await db.run_sync(self.etag)
+
+    def _load(self):
+        generation = self._generation
+        try:
+            rows = self.loader()
+        except Exception:
+            self.load_errors += 1
+            raise
+        self._replace(rows)
+        self.loads += 1
+        # A write that landed while we were loading may be missing from `rows`;
+        # keep the data but let the next reader load again.
+        self.loaded_at = time.monotonic() if generation == self._generation else 0.0
+
+    def _replace(self, rows):
+        self.rows = list(rows)
+        self.by_id = {row[self.key]: row for row in self.rows}
+        self.version += 1
+
+    def put(self, row):
+        with self._lock:
+            rows = [r for r in self.rows if r[self.key] != row[self.key]]
+            rows.append(row)
+            self._replace(rows)
+            self._generation += 1
+
+    def remove(self, row_id):
+        with self._lock:
+            self._replace([r for r in self.rows if r[self.key] != row_id])
+            self._generation += 1
+
+    def invalidate(self):
+        self._generation += 1
+        self.loaded_at = 0.0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.rows),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "age_seconds": time.monotonic() - self.loaded_at if self.loaded_at else None,
+            "ttl_seconds": self.ttl,
+        }
@@ -0,0 +1,594 @@
+import os
+import threading
+import uuid
+import enum
+from datetime import datetime, date, timezone
+from typing import Any, Dict
+
+from postgrest.exceptions import APIError
+from sqlalchemy import create_engine, event, select, insert, update, delete, func, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+
+import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+import db
+
+# Handlers talk to storage through the PostgREST query-builder subset they
+# already use (table().select/insert/upsert/update/delete with filters,
+# order, limit; rpc() for the functions in functions.sql). STORAGE_BACKEND
+# picks the implementation: "supabase" (default) is the hosted PostgREST
+# client; "sqlmodel" runs the same calls against the models.py tables on
+# SQLite or Postgres through a pooled SQLAlchemy engine.
+
+# One connection per executor thread, so offloaded queries never queue for a connection.
+STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", str(max(db.SUPABASE_EXECUTOR_WORKERS, 5))))
+STORAGE_ECHO = os.getenv("STORAGE_ECHO", "0") == "1"
+
+def create_client():
+    # Read at call time so settings from .env (loaded by the apps) apply.
+    backend = os.getenv("STORAGE_BACKEND", "supabase")
+    if backend == "sqlmodel":
+        return SQLModelClient(os.getenv("STORAGE_URL", "sqlite:///bokpharm.db"))
+    if backend != "supabase":
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected 'supabase' or 'sqlmodel'")
+
+    from supabase import create_client as create_supabase_client
+
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
+    if not supabase_url or not supabase_key:
+        raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY environment variables are required")
+    return create_supabase_client(supabase_url, supabase_key)
+
+class StorageResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+def api_error(message, code="P0001", details=None, hint=None):
+    return APIError({"message": message, "code": code, "details": details, "hint": hint})
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+FLOAT_COLUMNS = frozenset(
+    column.name for table in SQLModel.metadata.tables.values() for column in table.c
+    if _python_type(column) is float
+)
+
+def _to_json(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _row(row) -> Dict[str, Any]:
+    data = {key: _to_json(value) for key, value in row._mapping.items()}
+    # SQLite hands back RETURNING values before REAL affinity is applied (101 rather than 101.0).
+    for key in FLOAT_COLUMNS.intersection(data):
+        if isinstance(data[key], int):
+            data[key] = float(data[key])
+    return data
+
+def _coerce(column, value):
+    if value is None or not isinstance(value, str):
+        return value
+    kind = _python_type(column)
+    if kind is datetime:
+        # TIMESTAMP columns hold naive UTC; an offset-bearing value is converted, not truncated.
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    if kind is bool:
+        return value.lower() in ("true", "t", "1")
+    if kind in (int, float):
+        return kind(value)
+    return value
+
+class SQLQuery:
+    """postgrest-py style request builder executed against a SQLAlchemy table."""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.method = "select"
+        self.columns = list(table.c)
+        self.count = None
+        self.filters = []
+        self.orders = []
+        self.limit_rows = None
+        self.offset_rows = None
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.returning = "representation"
+
+    def _column(self, name):
+        name = name.strip()
+        if name not in self.table.c:
+            raise api_error(f"column {self.table.name}.{name} does not exist", code="42703")
+        return self.table.c[name]
+
+    def _rows(self, json):
+        rows = json if isinstance(json, list) else [json]
+        columns = {}
+        for row in rows:
+            for key in row:
+                if key not in columns:
+                    columns[key] = self._column(key)
+        # Only strings are coerced (ISO datetimes, "true", numeric strings); bulk payloads are mostly typed already.
+        return [{key: _coerce(columns[key], value) if isinstance(value, str) else value for key, value in row.items()}
+                for row in rows]
+
+    def select(self, *columns, count=None, **kwargs):
+        wanted = ",".join(columns) or "*"
+        if wanted.strip() != "*":
+            self.columns = [self._column(name) for name in wanted.split(",") if name.strip()]
+        self.count = count
+        return self
+
+    def insert(self, json, *, count=None, returning="representation", upsert=False, **kwargs):
+        self.method = "insert"
+        self.payload = self._rows(json)
+        self.returning = returning
+        return self
+
+    def upsert(self, json, *, count=None, returning="representation", ignore_duplicates=False,
+               on_conflict="", **kwargs):
+        self.method = "upsert"
+        self.payload = self._rows(json)
+        self.returning = returning
+        self.on_conflict = [self._column(name).name for name in on_conflict.split(",") if name.strip()] or \
+            [column.name for column in self.table.primary_key]
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, json, *, count=None, returning="representation", **kwargs):
+        self.method = "update"
+        self.payload = self._rows(json)[0]
+        self.returning = returning
+        return self
+
+    def delete(self, *, count=None, returning="representation", **kwargs):
+        self.method = "delete"
+        self.returning = returning
+        return self
+
+    def _filter(self, clause):
+        self.filters.append(clause)
+        return self
+
+    def eq(self, column, value):
+        column = self._column(column)
+        return self._filter(column == _coerce(column, value))
+
+    def neq(self, column, value):
+        column = self._column(column)
+        return self._filter(column != _coerce(column, value))
+
+    def gt(self, column, value):
+        column = self._column(column)
+        return self._filter(column > _coerce(column, value))
+
+    def gte(self, column, value):
+        column = self._column(column)
+        return self._filter(column >= _coerce(column, value))
+
+    def lt(self, column, value):
+        column = self._column(column)
+        return self._filter(column < _coerce(column, value))
+
+    def lte(self, column, value):
+        column = self._column(column)
+        return self._filter(column <= _coerce(column, value))
+
+    def in_(self, column, values):
+        column = self._column(column)
+        return self._filter(column.in_([_coerce(column, value) for value in values]))
+
+    def is_(self, column, value):
+        column = self._column(column)
+        if value is None or value == "null":
+            return self._filter(column.is_(None))
+        return self._filter(column.is_(_coerce(column, str(value))))
+
+    def ilike(self, column, pattern):
+        return self._filter(self._column(column).ilike(pattern.replace("*", "%")))
+
+    def order(self, column, *, desc=False, nullsfirst=None, **kwargs):
+        column = self._column(column)
+        ordered = column.desc() if desc else column.asc()
+        # Postgres puts NULLs last ascending and first descending; SQLite does the opposite.
+        nulls_first = desc if nullsfirst is None else nullsfirst
+        self.orders.append(ordered.nulls_first() if nulls_first else ordered.nulls_last())
+        return self
+
+    def limit(self, size, **kwargs):
+        self.limit_rows = size
+        return self
+
+    def offset(self, size, **kwargs):
+        self.offset_rows = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset_rows = start
+        self.limit_rows = end - start + 1
+        return self
+
+    def _select(self, conn):
+        query = select(*self.columns).where(*self.filters).order_by(*self.orders)
+        if self.limit_rows is not None:
+            query = query.limit(self.limit_rows)
+        if self.offset_rows is not None:
+            query = query.offset(self.offset_rows)
+        data = [_row(row) for row in conn.execute(query)]
+        count = None
+        if self.count:
+            count = conn.execute(select(func.count()).select_from(self.table).where(*self.filters)).scalar_one()
+        return StorageResponse(data, count)
+
+    def _write(self, conn, statement, parameters=None):
+        # returning="minimal" answers with no rows, as PostgREST does, and skips RETURNING.
+        if self.returning == "minimal":
+            result = conn.execute(statement, parameters) if parameters is not None else conn.execute(statement)
+            return [], result.rowcount
+        rows = conn.execute(statement.returning(*self.columns), parameters) if parameters is not None else \
+            conn.execute(statement.returning(*self.columns))
+        data = [_row(row) for row in rows]
+        return data, len(data)
+
+    def _insert(self, conn):
+        data = []
+        written = 0
+        # Multi-row statements need one key set, so rows are grouped by the columns they set.
+        groups = {}
+        for row in self.payload:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for keys, rows in groups.items():
+            statement = self.client.dialect_insert(self.table)
+            if self.method == "upsert":
+                changed = {key: statement.excluded[key] for key in keys if key not in self.on_conflict}
+                if self.ignore_duplicates or not changed:
+                    statement = statement.on_conflict_do_nothing(index_elements=self.on_conflict)
+                else:
+                    statement = statement.on_conflict_do_update(index_elements=self.on_conflict, set_=changed)
+            rows, count = self._write(conn, statement, rows)
+            data += rows
+            written += count
+        return StorageResponse(data, written if self.count else None)
+
+    def _update(self, conn):
+        data, count = self._write(conn, update(self.table).where(*self.filters).values(**self.payload))
+        return StorageResponse(data, count if self.count else None)
+
+    def _delete(self, conn):
+        data, count = self._write(conn, delete(self.table).where(*self.filters))
+        return StorageResponse(data, count if self.count else None)
+
+    def execute(self):
+        if self.method == "select":
+            with self.client.transaction() as conn:
+                return self._select(conn)
+        run = {"insert": self._insert, "upsert": self._insert, "update": self._update, "delete": self._delete}
+        with self.client.transaction(write=True) as conn:
+            return run[self.method](conn)
+
+class RPCQuery:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params or {}
+
+    def execute(self):
+        function = RPC_FUNCTIONS.get(self.name)
+        if function is None:
+            raise api_error(f"Could not find the function public.{self.name}", code="PGRST202")
+        with self.client.transaction(write=True) as conn:
+            return StorageResponse(function(self.client.tables, conn, self.params))
+
+class _Transaction:
+    def __init__(self, engine, write, lock=None):
+        self.engine = engine
+        self.write = write
+        self.lock = lock
+
+    def __enter__(self):
+        if self.lock is not None:
+            self.lock.acquire()
+        self.conn = self.engine.connect().execution_options(storage_write=self.write)
+        self.trans = self.conn.begin()
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.trans.commit()
+            else:
+                self.trans.rollback()
+        finally:
+            self.conn.close()
+            if self.lock is not None:
+                self.lock.release()
+        if isinstance(exc, IntegrityError):
+            code = getattr(exc.orig, "pgcode", None) or "23505"
+            raise api_error(str(exc.orig), code=code) from exc
+        return False
+
+class SQLModelClient:
+    """Supabase-compatible client over the models.py tables (SQLite or Postgres)."""
+
+    def __init__(self, url, pool_size=STORAGE_POOL_SIZE):
+        self.url = url
+        # An in-memory database is one connection shared by every thread, so transactions take turns.
+        self.lock = None
+        if url.startswith("sqlite"):
+            memory = url in ("sqlite://", "sqlite:///:memory:")
+            if memory:
+                self.lock = threading.Lock()
+            self.engine = create_engine(
+                url,
+                echo=STORAGE_ECHO,
+                connect_args={"check_same_thread": False, "timeout": 30},
+                **({"poolclass": StaticPool} if memory else {"pool_size": pool_size, "max_overflow": pool_size}),
+            )
+            event.listen(self.engine, "connect", _sqlite_connect)
+            event.listen(self.engine, "begin", _sqlite_begin)
+        else:
+            self.engine = create_engine(url, echo=STORAGE_ECHO, pool_size=pool_size, max_overflow=pool_size,
+                                        pool_pre_ping=True)
+        SQLModel.metadata.create_all(self.engine)
+        self.tables = SQLModel.metadata.tables
+        if self.lock is None:
+            # A forked worker (gunicorn --preload) must not share the parent's pooled connections.
+            os.register_at_fork(after_in_child=lambda: self.engine.dispose(close=False))
+
+    def dialect_insert(self, table):
+        return _dialect_insert(self.engine.dialect.name, table)
+
+    def transaction(self, write=False):
+        return _Transaction(self.engine, write, self.lock)
+
+    def table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            raise api_error(f"relation public.{name} does not exist", code="42P01")
+        return SQLQuery(self, table)
+
+    from_ = table
+
+    def rpc(self, name, params=None):
+        return RPCQuery(self, name, params)
+
+def _sqlite_connect(dbapi_connection, connection_record):
+    # Hand transaction control to the "begin" listener below.
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def _dialect_insert(dialect, table):
+    """An INSERT with on_conflict_do_nothing / on_conflict_do_update where the dialect has them."""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(table)
+    return dialect_insert(table)
+
+def _sqlite_begin(conn):
+    # Writers take the write lock up front; a deferred BEGIN that upgrades
+    # later can fail with SQLITE_BUSY instead of waiting.
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("storage_write") else "BEGIN")
+
+# Python versions of the functions in functions.sql, each run in one transaction.
+
+def _user_cart_items(tables, user_id):
+    cart, cart_item = tables["cart"], tables["cart_item"]
+    return select(cart_item.c.id).join(cart, cart.c.id == cart_item.c.cart_id).where(cart.c.user_id == user_id)
+
+def add_to_cart(tables, conn, params):
+    medication, cart, cart_item = tables["medication"], tables["cart"], tables["cart_item"]
+    med = conn.execute(select(medication).where(medication.c.id == params["p_medication_id"])).first()
+    if med is None:
+        return []
+    quantity = int(params["p_quantity"])
+    now = datetime.utcnow()
+    cart_id = conn.execute(
+        select(cart.c.id).where(cart.c.user_id == params["p_user_id"]).with_for_update()
+    ).scalar_one_or_none()
+    if cart_id is None:
+        cart_id = conn.execute(insert(cart).values(user_id=params["p_user_id"]).returning(cart.c.id)).scalar_one()
+    else:
+        conn.execute(update(cart).where(cart.c.id == cart_id).values(updated_at=now))
+    price = med.price or 0
+    existing = conn.execute(
+        update(cart_item)
+        .where(cart_item.c.cart_id == cart_id, cart_item.c.medication_id == med.id)
+        .values(quantity=cart_item.c.quantity + quantity, unit_price=price,
+                total_price=(cart_item.c.quantity + quantity) * price)
+        .returning(*cart_item.c)
+    ).all()
+    if existing:
+        return [_row(row) for row in existing]
+    return [_row(row) for row in conn.execute(insert(cart_item).values(
+        cart_id=cart_id, medication_id=med.id, medication_name=med.name, dosage=med.dosage,
+        quantity=quantity, unit_price=price, total_price=quantity * price,
+    ).returning(*cart_item.c))]
+
+def update_cart_item(tables, conn, params):
+    cart_item = tables["cart_item"]
+    quantity = int(params["p_quantity"])
+    statement = (
+        update(cart_item)
+        .where(cart_item.c.id == params["p_item_id"],
+               cart_item.c.id.in_(_user_cart_items(tables, params["p_user_id"])))
+        .values(quantity=quantity, total_price=quantity * cart_item.c.unit_price)
+        .returning(*cart_item.c)
+    )
+    return [_row(row) for row in conn.execute(statement)]
+
+def remove_cart_item(tables, conn, params):
+    cart_item = tables["cart_item"]
+    statement = (
+        delete(cart_item)
+        .where(cart_item.c.id == params["p_item_id"],
+               cart_item.c.id.in_(_user_cart_items(tables, params["p_user_id"])))
+        .returning(*cart_item.c)
+    )
+    return [_row(row) for row in conn.execute(statement)]
+
+def checkout(tables, conn, params):
+    cart, cart_item, inventory = tables["cart"], tables["cart_item"], tables["inventory"]
+    order, order_item = tables["order"], tables["order_item"]
+    user_id = params["p_user_id"]
+    routes = params.get("p_routes") or {}
+    delivery = params.get("p_delivery") or {}
+
+    conn.execute(select(cart.c.id).where(cart.c.user_id == user_id).with_for_update())
+    lines = [dict(row._mapping) for row in conn.execute(
+        select(cart_item).join(cart, cart.c.id == cart_item.c.cart_id)
+        .where(cart.c.user_id == user_id).order_by(cart_item.c.id)
+    )]
+    if not lines:
+        raise api_error("empty_cart")
+    for line in lines:
+        line["pharmacy_id"] = routes.get(line["medication_id"]) or params.get("p_pharmacy_id")
+    if any(not line["pharmacy_id"] for line in lines):
+        raise api_error("unrouted_item")
+
+    # Lock every candidate inventory row in id order, as the SQL function does.
+    conn.execute(
+        select(inventory.c.id)
+        .where(or_(*(and_(inventory.c.pharmacy_id == line["pharmacy_id"],
+                          inventory.c.medication_id == line["medication_id"]) for line in lines)))
+        .order_by(inventory.c.id)
+        .with_for_update()
+    )
+
+    now = datetime.utcnow()
+    reserved = []
+    for line in lines:
+        picked = conn.execute(
+            select(inventory.c.id)
+            .where(inventory.c.pharmacy_id == line["pharmacy_id"], inventory.c.medication_id == line["medication_id"],
+                   inventory.c.in_stock.is_(True), inventory.c.quantity >= line["quantity"])
+            .order_by(inventory.c.expiry_date.asc().nulls_last(), inventory.c.id)
+            .limit(1)
+        ).scalar_one_or_none()
+        row = None
+        if picked is not None:
+            row = conn.execute(
+                update(inventory)
+                .where(inventory.c.id == picked, inventory.c.quantity >= line["quantity"])
+                .values(quantity=inventory.c.quantity - line["quantity"],
+                        in_stock=inventory.c.quantity > line["quantity"], last_updated=now)
+                .returning(*inventory.c)
+            ).first()
+        if row is None:
+            raise api_error("insufficient_stock")
+        reserved.append(_row(row))
+        line["inventory_id"] = row.id
+        line["unit_price"] = row.price
+        line["subtotal"] = row.price * line["quantity"]
+
+    orders = {}
+    for line in lines:
+        if line["pharmacy_id"] not in orders:
+            orders[line["pharmacy_id"]] = {
+                "id": str(uuid.uuid4()), "user_id": user_id, "pharmacy_id": line["pharmacy_id"],
+                "status": models.OrderStatus.created, "total": 0.0,
+                "delivery_address": delivery.get("delivery_address"),
+                "delivery_city": delivery.get("delivery_city"),
+                "delivery_state": delivery.get("delivery_state"),
+                "delivery_latitude": delivery.get("delivery_latitude"),
+                "delivery_longitude": delivery.get("delivery_longitude"),
+            }
+        orders[line["pharmacy_id"]]["total"] += line["subtotal"]
+    created = {row.pharmacy_id: _row(row) for row in conn.execute(insert(order).returning(*order.c), list(orders.values()))}
+
+    items = [{
+        "id": str(uuid.uuid4()), "order_id": orders[line["pharmacy_id"]]["id"],
+        "medication_id": line["medication_id"], "medication_name": line["medication_name"], "dosage": line["dosage"],
+        "quantity": line["quantity"], "unit_price": line["unit_price"], "subtotal": line["subtotal"],
+        "inventory_id": line["inventory_id"],
+    } for line in lines]
+    for row in created.values():
+        row["items"] = []
+    by_order = {row["id"]: row for row in created.values()}
+    for row in conn.execute(insert(order_item).returning(*order_item.c), items):
+        by_order[row.order_id]["items"].append(_row(row))
+    conn.execute(delete(cart_item).where(cart_item.c.id.in_([line["id"] for line in lines])))
+    return {"orders": list(created.values()), "inventory": reserved}
+
+def cancel_order(tables, conn, params):
+    order, order_item, inventory = tables["order"], tables["order_item"], tables["inventory"]
+    now = datetime.utcnow()
+    cancelled = conn.execute(
+        update(order)
+        .where(order.c.id == params["p_order_id"], order.c.status == params["p_from_status"])
+        .values(status=models.OrderStatus.cancelled, updated_at=now)
+        .returning(*order.c)
+    ).first()
+    if cancelled is None:
+        return None
+
+    returned = {}
+    for item in conn.execute(select(order_item).where(order_item.c.order_id == cancelled.id)):
+        inventory_id = item.inventory_id or conn.execute(
+            select(inventory.c.id)
+            .where(inventory.c.pharmacy_id == cancelled.pharmacy_id, inventory.c.medication_id == item.medication_id)
+            .order_by(inventory.c.expiry_date.desc().nulls_first(), inventory.c.id)
+            .limit(1)
+        ).scalar_one_or_none()
+        if inventory_id is not None:
+            returned[inventory_id] = returned.get(inventory_id, 0) + item.quantity
+    if returned:
+        conn.execute(select(inventory.c.id).where(inventory.c.id.in_(returned)).order_by(inventory.c.id).with_for_update())
+    restocked = [_row(conn.execute(
+        update(inventory)
+        .where(inventory.c.id == inventory_id)
+        # A batch that expired meanwhile takes its units back but stays off sale.
+        .values(quantity=inventory.c.quantity + quantity,
+                in_stock=or_(inventory.c.expiry_date.is_(None), inventory.c.expiry_date > now), last_updated=now)
+        .returning(*inventory.c)
+    ).first()) for inventory_id, quantity in sorted(returned.items())]
+    return {"order": _row(cancelled), "inventory": restocked}
+
+SYNC_USER_COLUMNS = ("id", "firebase_uid", "email", "name", "surname", "mobile_number", "date_of_birth",
+                     "first_name", "last_name", "profile_image_url")
+
+def sync_user(tables, conn, params):
+    user = tables["user"]
+    profile = params["p_user"]
+    now = datetime.utcnow()
+    values = {column: _coerce(user.c[column], profile[column]) for column in SYNC_USER_COLUMNS
+              if profile.get(column) is not None}
+    values.update(role="customer", created_at=now, updated_at=now)
+    # SQLite has no xmax to tell an insert from a conflict, so a conflict is followed
+    # by a select in the same transaction; the caller still makes one call.
+    created = conn.execute(
+        _dialect_insert(conn.dialect.name, user).values(**values)
+        .on_conflict_do_nothing(index_elements=["firebase_uid"]).returning(*user.c)
+    ).first()
+    if created is not None:
+        return {"user": _row(created), "created": True}
+    existing = conn.execute(select(user).where(user.c.firebase_uid == profile["firebase_uid"])).first()
+    return {"user": _row(existing), "created": False}
+
+RPC_FUNCTIONS = {
+    "add_to_cart": add_to_cart,
+    "update_cart_item": update_cart_item,
+    "remove_cart_item": remove_cart_item,
+    "checkout": checkout,
+    "cancel_order": cancel_order,
+    "sync_user": sync_user,
+}
@@ -0,0 +1,60 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+# The Supabase schema and functions, in the order SETUP_GUIDE.md runs them.
+SCHEMA_FILES = ["create_tables.sql", "add_cart_tables.sql", "add_order_columns.sql", "add_user_columns.sql", "functions.sql"]
+
+@pytest.fixture
+def pg():
+    """A connection to TEST_DATABASE_URL with the schema loaded into a schema of its own, dropped afterwards."""
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set (e.g. postgresql+psycopg://postgres@localhost/postgres)")
+    from sqlalchemy import create_engine
+
+    engine = create_engine(url, isolation_level="AUTOCOMMIT")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f"CREATE SCHEMA {schema}")
+        conn.exec_driver_sql(f"SET search_path TO {schema}")
+        for name in SCHEMA_FILES:
+            with open(os.path.join(SERVER_DIR, name)) as f:
+                conn.exec_driver_sql(f.read())
+        try:
+            yield conn
+        finally:
+            conn.exec_driver_sql(f"DROP SCHEMA {schema} CASCADE")
+    engine.dispose()
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """fastapi_app on a SQLite database (STORAGE_BACKEND=sqlmodel) behind a TestClient, with stub Firebase tokens."""
+    from types import SimpleNamespace
+
+    from fastapi.testclient import TestClient
+
+    from benchmarks.stub_firebase import StubFirebase
+
+    firebase = StubFirebase("test-project").start()
+    database = tmp_path_factory.mktemp("storage") / "bokpharm.db"
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("STORAGE_BACKEND", "sqlmodel")
+        env.setenv("STORAGE_URL", f"sqlite:///{database}")
+        env.setenv("VITE_FIREBASE_PROJECT_ID", "test-project")
+        env.setenv("FIREBASE_CERTS_URL", firebase.certs_url)
+        import fastapi_app
+
+        with TestClient(fastapi_app.app) as client:
+            yield SimpleNamespace(
+                app=fastapi_app,
+                client=client,
+                storage=fastapi_app.supabase,
+                auth=lambda uid, ttl=3600: {"Authorization": f"Bearer {firebase.token(uid, ttl)}"},
+            )
+    firebase.stop()
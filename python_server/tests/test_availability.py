@@ -0,0 +1,29 @@
+import threading
+
+from availability import StockIndex
+
+def stock(row_id, quantity):
+    return {"id": row_id, "pharmacy_id": "pharm-1", "medication_id": "med-1", "quantity": quantity,
+            "price": 10.0, "in_stock": True}
+
+def test_writes_during_a_reload_are_kept():
+    index = StockIndex(None, locator=None, ttl=0)
+    writes = []
+
+    def loader():
+        # The select read its rows; these writes commit before it returns.
+        rows = [stock("inv-1", 5), stock("inv-2", 5)]
+        writer = threading.Thread(target=lambda: (index.apply(stock("inv-1", 1)), index.apply(stock("inv-3", 7)),
+                                                  index.discard("inv-2")))
+        writer.start()
+        writer.join(timeout=5)
+        writes.append(not writer.is_alive())
+        return rows
+
+    index.loader = loader
+    index.ensure_loaded()
+
+    # Writers are not held up by the reload, and it does not overwrite what they wrote.
+    assert writes == [True]
+    assert {row_id: row["quantity"] for row_id, row in index.by_medication["med-1"].items()} == {"inv-1": 1, "inv-3": 7}
+    assert index.medication_of == {"inv-1": "med-1", "inv-3": "med-1"}
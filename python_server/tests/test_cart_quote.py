@@ -0,0 +1,72 @@
+def test_quote_totals_are_rounded_to_cents(api):
+    storage, app = api.storage, api.app
+    pharmacy = {"id": "pharm-quote", "name": "Marina", "address": "Lagos", "phone": "0800",
+                "latitude": 6.45, "longitude": 3.39, "delivery_fee": 0.2, "is_active": True}
+    storage.table("pharmacy").upsert(pharmacy).execute()
+    app.pharmacy_locator.add(pharmacy)
+    for i, price in enumerate((0.1, 885.88)):
+        storage.table("medication").upsert({"id": f"med-quote-{i}", "name": f"Quote {i}", "price": price}).execute()
+        row = {"id": f"inv-quote-{i}", "pharmacy_id": "pharm-quote", "medication_id": f"med-quote-{i}",
+               "quantity": 10, "price": price, "in_stock": True}
+        storage.table("inventory").upsert(row).execute()
+        app.stock_index.ensure_loaded()
+        app.stock_index.apply(row)
+    customer = api.auth("quote-1")
+    for i in range(2):
+        assert api.client.post("/cart/add", json={"medication_id": f"med-quote-{i}", "quantity": 3},
+                               headers=customer).status_code == 200
+
+    quote = api.client.post("/cart/quote", json={"lat": 6.45, "lng": 3.39}, headers=customer).json()
+
+    # 3 x 0.1 and 3 x 885.88 are 0.30000000000000004 and 2657.6400000000003 in floats.
+    assert quote["items_total"] == 2657.94
+    assert quote["delivery_total"] == 0.2
+    assert quote["total"] == 2658.14
+    stop = quote["pharmacies"][0]
+    assert stop["subtotal"] == 2657.94
+    assert sorted(item["total_price"] for item in stop["items"]) == [0.3, 2657.64]
+
+def test_quote_routes_each_line_to_the_batch_checkout_takes(api):
+    storage, app = api.storage, api.app
+    # Near holds 2 + 2 of the first item and two batches of the second: the soonest to
+    # expire dearer than the later one. Far holds one batch of 5 of the first.
+    for pharmacy_id, lat in (("pharm-batch-near", 9.05), ("pharm-batch-far", 9.10)):
+        pharmacy = {"id": pharmacy_id, "name": pharmacy_id, "address": "Abuja", "phone": "0800",
+                    "latitude": lat, "longitude": 7.49, "delivery_fee": 0, "is_active": True}
+        storage.table("pharmacy").upsert(pharmacy).execute()
+        app.pharmacy_locator.add(pharmacy)
+    for i in range(2):
+        storage.table("medication").upsert({"id": f"med-batch-{i}", "name": f"Batch {i}", "price": 1}).execute()
+    rows = [
+        {"id": "inv-batch-a", "pharmacy_id": "pharm-batch-near", "medication_id": "med-batch-0",
+         "quantity": 2, "price": 1, "expiry_date": "2099-01-01T00:00:00"},
+        {"id": "inv-batch-b", "pharmacy_id": "pharm-batch-near", "medication_id": "med-batch-0",
+         "quantity": 2, "price": 1, "expiry_date": "2099-02-01T00:00:00"},
+        {"id": "inv-batch-c", "pharmacy_id": "pharm-batch-far", "medication_id": "med-batch-0",
+         "quantity": 5, "price": 2, "expiry_date": None},
+        {"id": "inv-batch-d", "pharmacy_id": "pharm-batch-near", "medication_id": "med-batch-1",
+         "quantity": 5, "price": 4, "expiry_date": None},
+        {"id": "inv-batch-e", "pharmacy_id": "pharm-batch-near", "medication_id": "med-batch-1",
+         "quantity": 5, "price": 9, "expiry_date": "2099-01-01T00:00:00"},
+    ]
+    app.stock_index.ensure_loaded()
+    for row in rows:
+        row["in_stock"] = True
+        storage.table("inventory").upsert(row).execute()
+        app.stock_index.apply(row)
+    customer = api.auth("batch-1")
+    for i in range(2):
+        assert api.client.post("/cart/add", json={"medication_id": f"med-batch-{i}", "quantity": 3},
+                               headers=customer).status_code == 200
+
+    quote = api.client.post("/cart/quote", json={"lat": 9.05, "lng": 7.49}, headers=customer).json()
+
+    # No single batch at the near pharmacy holds 3 of the first item, and checkout takes
+    # the second item from the batch that expires first, at its price.
+    assert quote["routes"] == {"med-batch-0": "pharm-batch-far", "med-batch-1": "pharm-batch-near"}
+    assert quote["items_total"] == 3 * 2 + 3 * 9
+    response = api.client.post("/checkout", json={"routes": quote["routes"], "delivery_address": "Abuja"},
+                               headers=customer)
+    assert response.status_code == 201
+    orders = response.json()["orders"]
+    assert sum(order["total"] for order in orders) == quote["items_total"]
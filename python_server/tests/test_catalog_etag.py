@@ -0,0 +1,17 @@
+def test_each_content_coding_gets_its_own_etag(api):
+    gzipped = api.client.get("/medications", headers={"Accept-Encoding": "gzip"})
+    identity = api.client.get("/medications", headers={"Accept-Encoding": "identity"})
+
+    assert gzipped.status_code == identity.status_code == 200
+    assert gzipped.headers["etag"].endswith('-gzip"')
+    assert identity.headers["etag"] == gzipped.headers["etag"].removesuffix('-gzip"') + '"'
+    assert gzipped.headers["vary"] == identity.headers["vary"] == "Accept-Encoding"
+
+    # A cached gzip body only revalidates for a client that takes gzip.
+    etag = gzipped.headers["etag"]
+    unchanged = api.client.get("/medications", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["etag"] == etag
+    assert unchanged.headers["vary"] == "Accept-Encoding"
+    changed = api.client.get("/medications", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert changed.status_code == 200
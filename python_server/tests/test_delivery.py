@@ -0,0 +1,21 @@
+import math
+
+import numpy as np
+
+import delivery
+from delivery import FeeTiers, quote
+
+def test_stored_fee_is_quoted_without_tiers():
+    fee, eta = quote(np.array([1.0, 40.0, 400.0]), np.array([0.0, 750.0, 300.0]))
+
+    assert fee.tolist() == [0.0, 750.0, 300.0]
+    assert eta.tolist() == sorted(eta.tolist())
+
+def test_tiers_price_by_distance_with_stored_fee_as_minimum():
+    tiers = FeeTiers("3:500,7:800,15:1200")
+    road = delivery.DELIVERY_ROAD_FACTOR
+
+    fee, _ = quote(np.array([1 / road, 5 / road, 5 / road, 20 / road]), np.array([0.0, 0.0, 950.0, 0.0]), tiers)
+
+    assert fee[:3].tolist() == [500.0, 800.0, 950.0]
+    assert math.isnan(fee[3])
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import os
+import runpy
+import subprocess
+import sys
+
+import events
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_unix_backend_survives_malformed_and_oversize_events(tmp_path):
+    async def scenario():
+        received = []
+        worker = events.UnixSocketBackend(str(tmp_path))
+        worker.start(lambda topic, event: received.append((topic, event)))
+        # Another worker's socket in the same directory.
+        other = events.UnixSocketBackend(str(tmp_path))
+        other.path = str(tmp_path / "other.sock")
+        other.sock = events.socket.socket(events.socket.AF_UNIX, events.socket.SOCK_DGRAM)
+        other.sock.bind(other.path)
+        try:
+            other.sock.sendto(b"not json", worker.path)
+            other.sock.sendto(b"[1]", worker.path)
+            other.sock.sendto(b'["order:1", {"status": "pending"}]', worker.path)
+            await asyncio.sleep(0.05)
+            assert received == [("order:1", {"status": "pending"})]
+            assert worker.dropped == 2
+
+            delivered = []
+            worker.deliver = lambda topic, event: delivered.append(topic)
+            worker.publish("order:2", {"blob": "x" * (4 * events.MAX_DATAGRAM)})
+            assert delivered == ["order:2"]
+            assert worker.dropped == 3
+        finally:
+            other.sock.close()
+            worker.stop()
+
+    asyncio.run(scenario())
+
+WORKER = """
+import asyncio, json, sys
+import events
+
+async def main():
+    broker = events.Broker(events.UnixSocketBackend(sys.argv[1]))
+    broker.start()
+    subscription = broker.subscribe("order:7")
+    print("ready", flush=True)
+    print(json.dumps(await subscription.next(10)), flush=True)
+    broker.stop()
+
+asyncio.run(main())
+"""
+
+def test_unix_backend_fans_out_to_another_process(tmp_path):
+    worker = subprocess.Popen([sys.executable, "-c", WORKER, str(tmp_path)], cwd=SERVER_DIR,
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        assert worker.stdout.readline().strip() == "ready"
+
+        async def publish():
+            received = []
+            broker = events.Broker(events.UnixSocketBackend(str(tmp_path)))
+            broker.start()
+            broker.backend.deliver = lambda topic, event: received.append(topic)
+            broker.publish("order:7", {"status": "confirmed"})
+            broker.stop()
+            return received
+
+        assert asyncio.run(publish()) == ["order:7"]
+        assert json.loads(worker.stdout.readline()) == {"status": "confirmed"}
+    finally:
+        worker.kill()
+        worker.wait()
+
+def test_gunicorn_shares_events_between_workers(monkeypatch):
+    for concurrency, backend in (("4", "unix"), ("1", "local")):
+        monkeypatch.setenv("WEB_CONCURRENCY", concurrency)
+        # Set first so the value gunicorn.conf.py writes is undone after the test.
+        monkeypatch.setenv("EVENTS_BACKEND", "")
+        monkeypatch.delenv("EVENTS_BACKEND")
+        runpy.run_path(os.path.join(SERVER_DIR, "gunicorn.conf.py"))
+        assert os.environ["EVENTS_BACKEND"] == backend
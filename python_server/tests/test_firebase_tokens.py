@@ -0,0 +1,43 @@
+import time
+
+import jwt
+import pytest
+
+from benchmarks.stub_firebase import StubFirebase
+
+@pytest.fixture(scope="module")
+def firebase(api):
+    # After `api`: firebase_tokens reads FIREBASE_CERTS_URL when first imported.
+    stub = StubFirebase("tokens-project").start()
+    yield stub
+    stub.stop()
+
+def signed(firebase, **overrides):
+    now = int(time.time())
+    claims = {"iss": "https://securetoken.google.com/tokens-project", "aud": "tokens-project",
+              "sub": "uid-1", "auth_time": now, "iat": now, "exp": now + 3600, **overrides}
+    claims = {name: value for name, value in claims.items() if value is not None}
+    return jwt.encode(claims, firebase.private_key, algorithm="RS256", headers={"kid": firebase.kid})
+
+@pytest.mark.parametrize("overrides", [
+    {"auth_time": None},
+    {"auth_time": int(time.time()) + 3600},
+    {"sub": ""},
+    {"sub": "x" * 129},
+])
+def test_tokens_firebase_admin_would_reject_are_rejected(firebase, overrides):
+    import firebase_tokens
+
+    verifier = firebase_tokens.TokenVerifier("tokens-project", firebase_tokens.PublicKeyCache(firebase.certs_url))
+
+    assert verifier.verify(signed(firebase))["uid"] == "uid-1"
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(signed(firebase, **overrides))
+
+def test_health_reports_token_cache_hits(api):
+    headers = api.auth("tokens-health")
+    for _ in range(2):
+        api.client.get("/cart", headers=headers)
+
+    token_cache = api.client.get("/health").json()["token_cache"]
+    assert token_cache["hits"] >= 1 and token_cache["misses"] >= 1
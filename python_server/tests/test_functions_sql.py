@@ -0,0 +1,166 @@
+import json
+import os
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+DELIVERY = {"delivery_address": "1 Marina Rd", "delivery_city": "Lagos", "delivery_state": "Lagos",
+            "delivery_latitude": 6.4541, "delivery_longitude": 3.3947}
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_file(pg, name):
+    with open(os.path.join(SERVER_DIR, name)) as f:
+        pg.exec_driver_sql(f.read())
+
+def seed(pg, stock=5):
+    pg.execute(text("""INSERT INTO "user" (id, email) VALUES ('user-1', 'ada@example.com')"""))
+    pg.execute(text("INSERT INTO pharmacy (id, name, address, phone) VALUES ('pharm-1', 'Ocean', 'Lagos', '0800')"))
+    pg.execute(text("""INSERT INTO medication (id, name, strength, manufacturer)
+                       VALUES ('med-1', 'Paracetamol', '500mg', 'Emzor'), ('med-2', 'Ibuprofen', '200mg', 'Emzor')"""))
+    # Two batches of med-1: checkout takes the one that expires first.
+    pg.execute(text("""INSERT INTO inventory (id, pharmacy_id, medication_id, quantity, price, expiry_date) VALUES
+                       ('inv-1a', 'pharm-1', 'med-1', :stock, 150.00, '2031-01-01'),
+                       ('inv-1b', 'pharm-1', 'med-1', :stock, 150.00, '2030-01-01'),
+                       ('inv-2', 'pharm-1', 'med-2', :stock, 99.95, NULL)"""), {"stock": stock})
+
+def add_to_cart(pg, medication_id, quantity):
+    pg.execute(text("SELECT add_to_cart('user-1', :med, :qty)"), {"med": medication_id, "qty": quantity})
+
+def checkout(pg, pharmacy_id="pharm-1"):
+    return pg.execute(text("SELECT checkout('user-1', :pharmacy, '{}'::jsonb, CAST(:delivery AS JSONB))"),
+                      {"pharmacy": pharmacy_id, "delivery": json.dumps(DELIVERY)}).scalar_one()
+
+def quantities(pg):
+    return dict(pg.execute(text("SELECT id, quantity FROM inventory ORDER BY id")).all())
+
+def test_checkout_writes_orders_and_reserves_stock(pg):
+    seed(pg)
+    add_to_cart(pg, "med-1", 2)
+    add_to_cart(pg, "med-2", 3)
+
+    result = checkout(pg)
+
+    [order] = result["orders"]
+    assert order["status"] == "created"
+    assert float(order["total"]) == pytest.approx(2 * 150.00 + 3 * 99.95)
+    assert order["delivery_city"] == "Lagos"
+    assert float(order["delivery_latitude"]) == pytest.approx(6.4541)
+    items = {item["medication_id"]: item for item in order["items"]}
+    assert float(items["med-2"]["subtotal"]) == pytest.approx(299.85)
+    assert items["med-1"]["medication_name"] == "Paracetamol"
+    assert quantities(pg) == {"inv-1a": 5, "inv-1b": 3, "inv-2": 2}
+    assert pg.execute(text("SELECT count(*) FROM cart_item")).scalar_one() == 0
+    stored = pg.execute(text("""SELECT total FROM "order" WHERE id = :id"""), {"id": order["id"]}).scalar_one()
+    assert float(stored) == pytest.approx(599.85)
+
+def test_migration_renames_the_totals_of_the_old_guide_schema(pg):
+    # The order tables as an older SETUP_GUIDE.md created them.
+    pg.exec_driver_sql("""ALTER TABLE "order" RENAME COLUMN total TO total_amount;
+                          ALTER TABLE "order" DROP COLUMN payment_method;
+                          ALTER TABLE order_item RENAME COLUMN subtotal TO total_price""")
+    run_file(pg, "add_order_columns.sql")
+    run_file(pg, "add_order_columns.sql")
+    seed(pg)
+    add_to_cart(pg, "med-2", 2)
+
+    [order] = checkout(pg)["orders"]
+
+    assert float(order["total"]) == pytest.approx(199.90)
+    assert float(order["items"][0]["subtotal"]) == pytest.approx(199.90)
+    assert "total_amount" not in order and order["payment_method"] is None
+
+def test_checkout_rolls_back_on_insufficient_stock(pg):
+    seed(pg, stock=1)
+    add_to_cart(pg, "med-1", 1)
+    add_to_cart(pg, "med-2", 2)
+
+    with pytest.raises(DBAPIError, match="insufficient_stock"):
+        checkout(pg)
+
+    assert quantities(pg) == {"inv-1a": 1, "inv-1b": 1, "inv-2": 1}
+    assert pg.execute(text('SELECT count(*) FROM "order"')).scalar_one() == 0
+    assert pg.execute(text("SELECT count(*) FROM cart_item")).scalar_one() == 2
+
+def test_checkout_rejects_empty_and_unrouted_carts(pg):
+    seed(pg)
+    with pytest.raises(DBAPIError, match="empty_cart"):
+        checkout(pg)
+    add_to_cart(pg, "med-1", 1)
+    with pytest.raises(DBAPIError, match="unrouted_item"):
+        checkout(pg, pharmacy_id=None)
+
+def order_status(pg, order_id):
+    return pg.execute(text('SELECT status FROM "order" WHERE id = :id'), {"id": order_id}).scalar_one()
+
+def cancel(pg, order_id, from_status="created"):
+    return pg.execute(text("SELECT cancel_order(:id, :status)"), {"id": order_id, "status": from_status}).scalar_one()
+
+def test_cancel_order_restocks_the_batches_checkout_took(pg):
+    seed(pg)
+    add_to_cart(pg, "med-1", 2)
+    add_to_cart(pg, "med-2", 5)
+    [order] = checkout(pg)["orders"]
+    assert quantities(pg) == {"inv-1a": 5, "inv-1b": 3, "inv-2": 0}
+
+    result = cancel(pg, order["id"])
+
+    assert result["order"]["status"] == "cancelled"
+    assert result["order"]["updated_at"] != order["updated_at"]
+    assert quantities(pg) == {"inv-1a": 5, "inv-1b": 5, "inv-2": 5}
+    assert {row["id"]: row["in_stock"] for row in result["inventory"]} == {"inv-1b": True, "inv-2": True}
+
+def test_cancel_order_keeps_expired_batches_out_of_stock(pg):
+    seed(pg)
+    add_to_cart(pg, "med-1", 2)
+    add_to_cart(pg, "med-2", 5)
+    [order] = checkout(pg)["orders"]
+    pg.execute(text("UPDATE inventory SET expiry_date = '2020-01-01' WHERE id = 'inv-1b'"))
+
+    result = cancel(pg, order["id"])
+
+    assert quantities(pg) == {"inv-1a": 5, "inv-1b": 5, "inv-2": 5}
+    assert {row["id"]: row["in_stock"] for row in result["inventory"]} == {"inv-1b": False, "inv-2": True}
+
+def test_cancel_order_only_from_the_expected_status(pg):
+    seed(pg)
+    add_to_cart(pg, "med-1", 1)
+    [order] = checkout(pg)["orders"]
+    pg.execute(text("""UPDATE "order" SET status = 'confirmed' WHERE id = :id"""), {"id": order["id"]})
+
+    assert cancel(pg, order["id"], from_status="created") is None
+    assert order_status(pg, order["id"]) == "confirmed"
+    assert quantities(pg)["inv-1b"] == 4
+
+    assert cancel(pg, order["id"], from_status="confirmed")["order"]["status"] == "cancelled"
+    assert cancel(pg, order["id"], from_status="confirmed") is None
+    assert quantities(pg)["inv-1b"] == 5
+
+def test_cancel_order_restocks_items_without_inventory_id(pg):
+    seed(pg)
+    add_to_cart(pg, "med-1", 2)
+    [order] = checkout(pg)["orders"]
+    # Recorded before add_order_columns.sql added inventory_id: the latest batch gets the stock.
+    pg.execute(text("UPDATE order_item SET inventory_id = NULL"))
+
+    cancel(pg, order["id"])
+
+    assert quantities(pg) == {"inv-1a": 7, "inv-1b": 3, "inv-2": 5}
+
+def sync_user(pg, **profile):
+    return pg.execute(text("SELECT sync_user(CAST(:profile AS JSONB))"), {"profile": json.dumps(profile)}).scalar_one()
+
+def test_sync_user_creates_then_returns_the_stored_row(pg):
+    first = sync_user(pg, firebase_uid="uid-1", email="ada@example.com", name="Ada", date_of_birth="1990-05-01T00:00:00")
+    again = sync_user(pg, firebase_uid="uid-1", email="other@example.com", name="Changed")
+
+    assert first["created"] is True and again["created"] is False
+    assert again["user"] == first["user"]
+    assert first["user"]["name"] == "Ada" and first["user"]["role"] == "customer"
+    assert pg.execute(text("""SELECT count(*) FROM "user" WHERE firebase_uid = 'uid-1'""")).scalar_one() == 1
+
+def test_sync_user_keeps_a_given_id(pg):
+    result = sync_user(pg, id="uid-2", firebase_uid="uid-2", email="grace@example.com", first_name="Grace")
+
+    assert result["user"]["id"] == "uid-2" and result["user"]["first_name"] == "Grace"
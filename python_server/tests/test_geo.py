@@ -0,0 +1,67 @@
+import random
+import sys
+import threading
+
+from geo import GridIndex
+
+def test_nearest_points_across_the_antimeridian():
+    index = GridIndex()
+    index.build([("east", -17.0, 179.995), ("west", -17.0, -179.995), ("far", -17.0, 170.0)])
+    assert [pid for pid, _ in index.query(-17.0, 179.999, radius_km=5)] == ["east", "west"]
+    assert [pid for pid, _ in index.query(-17.0, -179.999, limit=2)] == ["west", "east"]
+
+def test_query_while_points_are_added_and_removed():
+    random.seed(5)
+    index = GridIndex()
+    index.build((f"p{i}", 6.5 + random.uniform(-0.3, 0.3), 3.4 + random.uniform(-0.3, 0.3)) for i in range(500))
+    errors = []
+    done = threading.Event()
+
+    def write():
+        try:
+            for round in range(300):
+                for i in range(500, 540):
+                    index.add(f"p{i}", 6.5 + random.uniform(-0.3, 0.3), 3.4 + random.uniform(-0.3, 0.3))
+                for i in range(500, 540):
+                    index.remove(f"p{i}")
+        except Exception as error:
+            errors.append(error)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                # Near the points, and far enough away that every point is ranked.
+                for lat, lng in ((6.5, 3.4), (40.0, 3.4)):
+                    results = index.query(lat, lng, limit=10)
+                    assert len(results) == len({pid for pid, _ in results}) == 10
+        except Exception as error:
+            errors.append(error)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert index.size == 500
+
+def test_wide_radius_queries_walk_rings_instead_of_every_point():
+    index = GridIndex()
+    # Beyond the 16 rings nearest-k queries walk, and far from everything else.
+    index.build([("near", 6.5, 3.4), ("ring-60km", 7.0, 3.6)] + [(f"far-{i}", 40.0, i * 0.01) for i in range(500)])
+    ranked = []
+    rank = index._rank
+    index._rank = lambda lat, lng, candidates, radius_km, limit: ranked.append(len(candidates)) or rank(
+        lat, lng, candidates, radius_km, limit)
+
+    assert [pid for pid, _ in index.query(6.5, 3.4, radius_km=80)] == ["near", "ring-60km"]
+    assert ranked == [2]
+    assert [pid for pid, _ in index.query(89.99, 0.0, radius_km=50)] == []
+    assert [pid for pid, _ in index.query(6.5, 3.4, radius_km=30000, limit=3)][:2] == ["near", "ring-60km"]
@@ -0,0 +1,68 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import idempotency
+
+@pytest.fixture
+def medication(api):
+    api.storage.table("medication").upsert({"id": "med-idem", "name": "Ibuprofen", "price": 90.0}).execute()
+    return "med-idem"
+
+def add_to_cart(api, headers, key):
+    return api.client.post("/cart/add", json={"medication_id": "med-idem", "quantity": 2},
+                           headers={**headers, "Idempotency-Key": key})
+
+def test_retry_with_a_refreshed_token_replays(api, medication):
+    first = add_to_cart(api, api.auth("idem-1"), "add-1")
+    # The client refreshed its ID token before retrying: same uid, different token.
+    retry = add_to_cart(api, api.auth("idem-1", ttl=1800), "add-1")
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+    assert retry.json() == first.json() and retry.json()["quantity"] == 2
+
+def test_keys_are_per_user(api, medication):
+    add_to_cart(api, api.auth("idem-2"), "add-2")
+    other = add_to_cart(api, api.auth("idem-3"), "add-2")
+
+    assert other.status_code == 200
+    assert "Idempotent-Replayed" not in other.headers
+    assert other.json()["quantity"] == 2
+
+def test_unauthenticated_requests_do_not_share_keys(api):
+    responses = [
+        api.client.post("/auth/sync-user", json={"firebase_uid": uid, "email": f"{uid}@example.com", "name": uid},
+                        headers={"Idempotency-Key": "sync"})
+        for uid in ("idem-sync-1", "idem-sync-2")
+    ]
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert [response.json()["firebase_uid"] for response in responses] == ["idem-sync-1", "idem-sync-2"]
+    assert all("Idempotent-Replayed" not in response.headers for response in responses)
+
+def test_a_claim_whose_lease_ran_out_is_taken_over(api):
+    def store():
+        worker = idempotency.IdempotencyStore(lease=0.2, ttl=3600)
+        worker.table = api.storage
+        return worker
+
+    first, second, later = store(), store(), store()
+    response = idempotency.StoredResponse("fp", 201, [["content-type", "application/json"]], b"{}")
+
+    assert first.begin("lease-key", "fp") == (idempotency.RUN, None)
+    assert second.begin("lease-key", "fp") == (idempotency.BUSY, None)
+    time.sleep(0.3)
+    # The first worker looks dead: its key is claimed again rather than locked for the TTL.
+    assert second.begin("lease-key", "fp") == (idempotency.RUN, None)
+    first.finish("lease-key", response)
+    row = api.storage.table("idempotency_key").select("*").eq("key", "lease-key").execute().data[0]
+    assert row["status"] is None
+
+    second.finish("lease-key", response)
+    row = api.storage.table("idempotency_key").select("*").eq("key", "lease-key").execute().data[0]
+    assert row["status"] == 201
+    assert datetime.fromisoformat(row["expires_at"]) > datetime.utcnow() + timedelta(seconds=3000)
+    state, stored = later.begin("lease-key", "fp")
+    assert state == idempotency.REPLAY and stored.status == 201
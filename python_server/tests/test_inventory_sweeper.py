@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+
+import storage
+from inventory_sweeper import InventorySweeper
+
+NOW = datetime(2026, 3, 1, 12, 0)
+
+@pytest.fixture
+def client(tmp_path):
+    return storage.SQLModelClient(f"sqlite:///{tmp_path / 'sweep.db'}")
+
+def stock(client, inventory_id):
+    return client.table("inventory").select("in_stock").eq("id", inventory_id).execute().data[0]["in_stock"]
+
+def test_sweep_compares_offset_bearing_expiry_dates_in_utc(client):
+    client.table("inventory").insert([
+        # 15:00 at +05:00 is 10:00 UTC: expired two hours ago.
+        {"id": "east", "pharmacy_id": "p1", "medication_id": "m1", "quantity": 50, "price": 1.0,
+         "in_stock": True, "expiry_date": "2026-03-01T15:00:00+05:00"},
+        # 09:00 at -05:00 is 14:00 UTC: still good.
+        {"id": "west", "pharmacy_id": "p1", "medication_id": "m1", "quantity": 50, "price": 1.0,
+         "in_stock": True, "expiry_date": "2026-03-01T09:00:00-05:00"},
+        {"id": "utc", "pharmacy_id": "p1", "medication_id": "m1", "quantity": 50, "price": 1.0,
+         "in_stock": True, "expiry_date": "2026-03-01T11:59:00Z"},
+    ]).execute()
+    sweeper = InventorySweeper(client, interval=0)
+
+    flipped = sweeper.sweep(now=NOW)
+
+    assert sorted(row["id"] for row in flipped) == ["east", "utc"]
+    assert [stock(client, i) for i in ("east", "west", "utc")] == [False, True, False]
+    alerts = sweeper.alerts("p1", now=NOW)
+    assert [row["id"] for row in alerts["expiring"]["items"]] == ["west"]
+    assert sorted(row["id"] for row in alerts["expired"]["items"]) == ["east", "utc"]
+
+def test_imported_expiry_dates_are_stored_as_utc():
+    from inventory_import import validate
+
+    row, errors = validate({"medication_id": "m1", "price": "1", "expiry_date": "2026-03-01T15:00:00+05:00"},
+                           "p1", lambda medication_id: True)
+
+    assert errors == []
+    assert row["expiry_date"] == "2026-03-01T10:00:00"
+
+def test_failed_sweeps_are_logged_and_counted(client, caplog):
+    import metrics
+
+    sweeper = InventorySweeper(client, interval=0.01)
+    sweeper.sweep = lambda: 1 / 0
+    sweeper._stopped.set()
+    before = metrics.BACKGROUND_ERRORS.values.get(("inventory_sweep",), 0)
+
+    sweeper._sweep_loop()
+
+    assert sweeper.errors == 1
+    assert metrics.BACKGROUND_ERRORS.values[("inventory_sweep",)] == before + 1
+    assert [record.getMessage() for record in caplog.records] == ["Inventory sweep failed"]
+    assert caplog.records[0].exc_info[0] is ZeroDivisionError
@@ -0,0 +1,63 @@
+import pytest
+
+@pytest.fixture
+def order(api):
+    storage = api.storage
+    storage.table("user").upsert([
+        {"firebase_uid": "customer-1", "email": "ada@example.com"},
+        {"firebase_uid": "owner-1", "email": "owner@example.com", "pharmacy_id": "pharm-1"},
+    ], on_conflict="firebase_uid").execute()
+    storage.table("pharmacy").upsert({"id": "pharm-1", "name": "Ocean", "address": "Lagos", "phone": "0800"}).execute()
+    storage.table("medication").upsert({"id": "med-1", "name": "Paracetamol", "price": 150.0}).execute()
+    storage.table("inventory").upsert(
+        {"id": "inv-1", "pharmacy_id": "pharm-1", "medication_id": "med-1", "quantity": 3, "price": 150.0}).execute()
+    customer = api.auth("customer-1")
+    assert api.client.post("/cart/add", json={"medication_id": "med-1", "quantity": 3}, headers=customer).status_code == 200
+    response = api.client.post("/checkout", json={"pharmacy_id": "pharm-1", "delivery_address": "1 Marina Rd"},
+                               headers=customer)
+    assert response.status_code == 201
+    return response.json()["orders"][0]
+
+def stock(api):
+    return api.storage.table("inventory").select("quantity,in_stock").eq("id", "inv-1").execute().data[0]
+
+def test_customer_cancel_restocks(api, order):
+    assert stock(api) == {"quantity": 0, "in_stock": False}
+
+    response = api.client.patch(f"/orders/{order['id']}/status", json={"status": "cancelled"},
+                                headers=api.auth("customer-1"))
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+    assert stock(api) == {"quantity": 3, "in_stock": True}
+    assert "inv-1" in api.app.stock_index.by_medication.get("med-1", {})
+
+def test_cancel_after_cancel_conflicts_without_restocking_twice(api, order):
+    customer = api.auth("customer-1")
+    assert api.client.patch(f"/orders/{order['id']}/status", json={"status": "cancelled"}, headers=customer).status_code == 200
+
+    response = api.client.patch(f"/orders/{order['id']}/status", json={"status": "cancelled"}, headers=customer)
+
+    assert response.status_code == 409
+    assert stock(api)["quantity"] == 3
+
+def test_pharmacy_cancel_of_confirmed_order_restocks(api, order):
+    owner = api.auth("owner-1")
+    assert api.client.patch(f"/orders/{order['id']}/status", json={"status": "confirmed"}, headers=owner).status_code == 200
+    assert api.client.patch(f"/orders/{order['id']}/status", json={"status": "cancelled"},
+                            headers=api.auth("customer-1")).status_code == 403
+
+    response = api.client.patch(f"/orders/{order['id']}/status", json={"status": "cancelled"}, headers=owner)
+
+    assert response.status_code == 200
+    assert stock(api)["quantity"] == 3
+
+def test_cancel_keeps_an_expired_batch_off_sale(api, order):
+    api.storage.table("inventory").update({"expiry_date": "2020-01-01T00:00:00"}).eq("id", "inv-1").execute()
+
+    response = api.client.patch(f"/orders/{order['id']}/status", json={"status": "cancelled"},
+                                headers=api.auth("customer-1"))
+
+    assert response.status_code == 200
+    assert stock(api) == {"quantity": 3, "in_stock": False}
+    assert "inv-1" not in api.app.stock_index.by_medication.get("med-1", {})
@@ -0,0 +1,26 @@
+import base64
+
+import pytest
+
+from pagination import PageRequestError, decode_cursor, encode_cursor
+
+def b64(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("med-42")) == "med-42"
+    assert decode_cursor(None) is None and decode_cursor("") is None
+
+@pytest.mark.parametrize("cursor", [
+    b64(b'{"after":1}'), b64(b'{"after":null}'), b64(b'{"after":["a"]}'), b64(b'["after"]'),
+    b64(b'{"before":"a"}'), b64(b"not json"), b64(b"\xff\xfe"), "***", "é",
+])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(PageRequestError):
+        decode_cursor(cursor)
+
+@pytest.mark.parametrize("path", ["/medications", "/pharmacies"])
+def test_wrong_typed_cursor_is_a_bad_request(api, path):
+    response = api.client.get(path, params={"cursor": b64(b'{"after":1}')})
+
+    assert response.status_code == 400
@@ -0,0 +1,48 @@
+import sys
+import threading
+
+from search_index import SearchIndex
+
+def medication(i):
+    return {"id": f"med-{i}", "name": f"Paracetamol {i} extra{i % 50}", "manufacturer": f"Maker{i % 7}",
+            "category": "Analgesic", "strength": f"{i}mg", "dosage": "tablet"}
+
+def test_search_while_rows_are_added_and_removed():
+    index = SearchIndex()
+    index.build([medication(i) for i in range(200)])
+    errors = []
+    done = threading.Event()
+
+    def write():
+        try:
+            for round in range(300):
+                for i in range(200, 260):
+                    index.add(medication(i + round % 3))
+                for i in range(200, 262):
+                    index.remove(f"med-{i}")
+        except Exception as error:
+            errors.append(error)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                for query in ("extra", "ex", "paracetmol", "maker3 extra1"):
+                    for row in index.search(query, 20):
+                        assert row["id"].startswith("med-")
+        except Exception as error:
+            errors.append(error)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert [row["id"] for row in index.search("paracetamol 5 extra5", 1)] == ["med-5"]
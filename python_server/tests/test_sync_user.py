@@ -0,0 +1,15 @@
+def sync(api, uid, **profile):
+    return api.client.post("/auth/sync-user", json={"firebase_uid": uid, "email": f"{uid}@example.com", "name": uid,
+                                                    **profile})
+
+def test_sync_user_returns_the_existing_profile_unchanged(api):
+    created = sync(api, "sync-1", surname="Lovelace")
+    # Another worker, or this one after the cache entry expired, goes to the database.
+    api.app.known_users.changed("sync-1")
+    again = sync(api, "sync-1", name="Someone else", surname="Else")
+
+    assert created.status_code == again.status_code == 200
+    assert again.json()["id"] == created.json()["id"]
+    assert again.json()["surname"] == "Lovelace"
+    rows = api.storage.table("user").select("id").eq("firebase_uid", "sync-1").execute().data
+    assert len(rows) == 1
@@ -0,0 +1,375 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+import db
+import metrics
+
+# Guards the storage client of both apps. Identical reads in flight at the
+# same time (same table, columns, filters, order and limit) are merged into
+# one upstream call whose result every caller gets. At most
+# UPSTREAM_MAX_CONCURRENCY calls run against storage at once; the rest queue
+# in arrival order for up to UPSTREAM_QUEUE_TIMEOUT seconds, and while
+# UPSTREAM_MAX_QUEUE calls are waiting new ones are refused. A request that
+# had a call refused is answered 503 with Retry-After instead of whatever
+# error its handler made of it. UPSTREAM_MAX_CONCURRENCY=0 turns the limit
+# off and UPSTREAM_COALESCE=0 the merging. Keep the limit below
+# SUPABASE_EXECUTOR_WORKERS so queued calls wait here, where they are counted
+# and bounded, rather than in the executor's queue.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", "256"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "2"))
+UPSTREAM_RETRY_AFTER = int(os.getenv("UPSTREAM_RETRY_AFTER", "1"))
+UPSTREAM_COALESCE = os.getenv("UPSTREAM_COALESCE", "1") != "0"
+
+WRITE_METHODS = {"insert", "upsert", "update", "delete"}
+OVERLOADED_DETAIL = "The server is busy; retry shortly"
+
+class Overloaded(Exception):
+    def __init__(self, reason):
+        super().__init__(OVERLOADED_DETAIL)
+        self.reason = reason
+
+class _RequestState:
+    __slots__ = ("shed",)
+
+    def __init__(self):
+        self.shed = False
+
+# Set per request by the middleware / Flask hooks; the state object is shared
+# with the executor threads the request's calls run in.
+_request: ContextVar[Optional[_RequestState]] = ContextVar("upstream_request", default=None)
+
+def _mark_shed():
+    state = _request.get()
+    if state is not None:
+        state.shed = True
+
+class Limiter:
+    """First-come, first-served slots for upstream calls, taken from threads or from the event loop.
+
+    A released slot is handed straight to the oldest waiter by resolving its
+    Future, which both threads (result()) and coroutines (wrap_future) can wait on.
+    """
+
+    def __init__(self, limit=UPSTREAM_MAX_CONCURRENCY, max_queue=UPSTREAM_MAX_QUEUE, timeout=UPSTREAM_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()
+        self.queued = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+        metrics.UPSTREAM_IN_FLIGHT.set(0)
+        metrics.UPSTREAM_QUEUE_DEPTH.set(0)
+
+    def _enter(self) -> Optional[Future]:
+        """None once a slot is taken, else the Future that resolves when one is handed over."""
+        with self._lock:
+            if self.active < self.limit and not self.waiters:
+                self.active += 1
+                metrics.UPSTREAM_IN_FLIGHT.set(self.active)
+                return None
+            if len(self.waiters) >= self.max_queue:
+                self._refuse("queue_full")
+            grant = Future()
+            self.waiters.append(grant)
+            self.queued += 1
+            metrics.UPSTREAM_QUEUE_DEPTH.set(len(self.waiters))
+            return grant
+
+    def _withdraw(self, grant):
+        """Takes a waiter out of the queue; False if it was handed a slot in the meantime."""
+        with self._lock:
+            if grant.done():
+                return False
+            self.waiters.remove(grant)
+            metrics.UPSTREAM_QUEUE_DEPTH.set(len(self.waiters))
+            return True
+
+    def _refuse(self, reason):
+        self.shed += 1
+        metrics.UPSTREAM_SHED.inc(reason)
+        raise Overloaded(reason)
+
+    def _waited(self, seconds):
+        metrics.UPSTREAM_QUEUE_SECONDS.observe(seconds)
+        if metrics.METRICS_ENABLED:
+            metrics.record("queue", seconds)
+
+    def acquire(self):
+        grant = self._enter()
+        if grant is None:
+            return
+        start = perf_counter()
+        try:
+            grant.result(self.timeout)
+        except FutureTimeout:
+            if self._withdraw(grant):
+                self._refuse("timeout")
+        self._waited(perf_counter() - start)
+
+    async def aacquire(self):
+        grant = self._enter()
+        if grant is None:
+            return
+        start = perf_counter()
+        try:
+            done, _ = await asyncio.wait((asyncio.wrap_future(grant),), timeout=self.timeout)
+        except BaseException:
+            # Cancelled while queued: leave the queue, or pass on a slot already handed over.
+            if not self._withdraw(grant):
+                self.release()
+            raise
+        if not done and self._withdraw(grant):
+            self._refuse("timeout")
+        self._waited(perf_counter() - start)
+
+    def release(self):
+        with self._lock:
+            if self.waiters:
+                self.waiters.popleft().set_result(None)
+                metrics.UPSTREAM_QUEUE_DEPTH.set(len(self.waiters))
+            else:
+                self.active -= 1
+                metrics.UPSTREAM_IN_FLIGHT.set(self.active)
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "waiting": len(self.waiters),
+                "queued": self.queued, "shed": self.shed}
+
+class Upstream:
+    """Runs storage calls under a Limiter, merging identical reads that are in flight together."""
+
+    def __init__(self, limiter=None, coalesce=UPSTREAM_COALESCE):
+        if limiter is None and UPSTREAM_MAX_CONCURRENCY > 0:
+            limiter = Limiter()
+        self.limiter = limiter
+        self.coalesce = coalesce
+        self.inflight = {}
+        self.calls = 0
+        self.merged = 0
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def _join(self, key, table):
+        """(future, leader): the in-flight read for `key`, and whether this caller has to run it."""
+        with self._lock:
+            future = self.inflight.get(key)
+            if future is not None:
+                self.merged += 1
+                metrics.UPSTREAM_COALESCED.inc(table)
+                return future, False
+            future = self.inflight[key] = Future()
+            self.calls += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        # Later reads must not join a call that has already answered.
+        with self._lock:
+            self.inflight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _run(self, fn):
+        if self.limiter is None:
+            return fn()
+        self.limiter.acquire()
+        try:
+            return fn()
+        finally:
+            self.limiter.release()
+
+    async def _arun(self, fn):
+        if self.limiter is None:
+            return await db.run_sync(fn)
+        await self.limiter.aacquire()
+        try:
+            return await db.run_sync(fn)
+        finally:
+            self.limiter.release()
+
+    async def _alead(self, key, future, fn):
+        try:
+            result = await self._arun(fn)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+        else:
+            self._finish(key, future, result)
+
+    def call(self, fn, key=None, table=None):
+        try:
+            if key is None or not self.coalesce:
+                return self._run(fn)
+            future, leader = self._join(key, table)
+            if leader:
+                try:
+                    result = self._run(fn)
+                except BaseException as e:
+                    self._finish(key, future, error=e)
+                    raise
+                self._finish(key, future, result)
+                return result
+            return future.result()
+        except Overloaded:
+            _mark_shed()
+            raise
+
+    async def acall(self, fn, key=None, table=None):
+        try:
+            if key is None or not self.coalesce:
+                return await self._arun(fn)
+            future, leader = self._join(key, table)
+            if leader:
+                # A task of its own, so the leader's client going away does not cancel the call for the rest.
+                task = asyncio.ensure_future(self._alead(key, future, fn))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except Overloaded:
+            _mark_shed()
+            raise
+
+    def stats(self):
+        stats = {"calls": self.calls, "merged": self.merged, "in_flight_reads": len(self.inflight)}
+        if self.limiter is not None:
+            stats.update(self.limiter.stats())
+        return stats
+
+class _GuardedQuery:
+    """Wraps a postgrest-style builder, recording its chain so identical reads share one key."""
+
+    __slots__ = ("_query", "_table", "_calls", "_read", "_upstream")
+
+    def __init__(self, query, table, upstream, read=True):
+        self._query = query
+        self._table = table
+        self._calls = []
+        self._read = read
+        self._upstream = upstream
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def _key(self):
+        return (self._table, repr(self._calls)) if self._read else None
+
+    def execute(self):
+        return self._upstream.call(self._query.execute, self._key(), self._table)
+
+    async def aexecute(self):
+        """Used by db.execute: queueing and merging happen on the event loop, the call in the executor."""
+        return await self._upstream.acall(self._query.execute, self._key(), self._table)
+
+def _chained(name):
+    def method(self, *args, **kwargs):
+        self._query = getattr(self._query, name)(*args, **kwargs)
+        self._calls.append((name, args, kwargs))
+        if name in WRITE_METHODS:
+            self._read = False
+        return self
+    method.__name__ = name
+    return method
+
+for _name in metrics.QUERY_METHODS:
+    setattr(_GuardedQuery, _name, _chained(_name))
+
+class GuardedClient:
+    def __init__(self, client, upstream=None):
+        self.client = client
+        self.upstream = upstream or Upstream()
+
+    def table(self, name):
+        return _GuardedQuery(self.client.table(name), name, self.upstream)
+
+    from_ = table
+
+    def rpc(self, name, *args, **kwargs):
+        # Functions may write, so their calls are limited but never merged.
+        return _GuardedQuery(self.client.rpc(name, *args, **kwargs), name, self.upstream, read=False)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+def guard(client):
+    if UPSTREAM_MAX_CONCURRENCY <= 0 and not UPSTREAM_COALESCE:
+        return client
+    return GuardedClient(client)
+
+def overloaded_body(key):
+    return json.dumps({key: OVERLOADED_DETAIL}).encode()
+
+class SheddingMiddleware:
+    """ASGI middleware: a request that had a storage call refused gets 503 with Retry-After."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        state = _RequestState()
+        token = _request.set(state)
+        started = False
+        replaced = False
+
+        async def send_or_shed(message):
+            nonlocal started, replaced
+            if message["type"] == "http.response.start":
+                started = True
+                if state.shed and message["status"] >= 500:
+                    replaced = True
+                    await self.unavailable(send)
+                    return
+            if not replaced:
+                await send(message)
+
+        try:
+            await self.app(scope, receive, send_or_shed)
+        except Overloaded:
+            if started:
+                raise
+            await self.unavailable(send)
+        finally:
+            _request.reset(token)
+
+    @staticmethod
+    async def unavailable(send):
+        body = overloaded_body("detail")
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(UPSTREAM_RETRY_AFTER).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+def install_flask(app):
+    """Registers the Flask hooks. Call after other after_request hooks so this one runs first."""
+    from flask import g
+
+    @app.before_request
+    def track_upstream_calls():
+        g.upstream_token = _request.set(_RequestState())
+
+    @app.after_request
+    def shed_overloaded(response):
+        state = _request.get()
+        if state is not None and state.shed and response.status_code >= 500:
+            return app.response_class(overloaded_body("error"), status=503, mimetype="application/json",
+                                      headers={"Retry-After": str(UPSTREAM_RETRY_AFTER)})
+        return response
+
+    @app.teardown_request
+    def reset_upstream_calls(exc):
+        token = g.pop("upstream_token", None)
+        if token is not None:
+            _request.reset(token)
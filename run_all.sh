@@ -6,10 +6,8 @@ lsof -ti:5001 | xargs kill -9 2>/dev/null || true
 
 # Start Python backend in background
 echo "Starting Python backend on port 5001..."
-cd python_server
-python app.py > ../python_server.log 2>&1 &
+./python_server/serve.sh flask > python_server.log 2>&1 &
 PYTHON_PID=$!
-cd ..
 
 # Give Python server time to start
 sleep 3
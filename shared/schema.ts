@@ -105,6 +105,10 @@ export const orders = pgTable("orders", {
   status: text("status").notNull().default("pending"),
   total: decimal("total", { precision: 10, scale: 2 }).notNull(),
   deliveryAddress: text("delivery_address").notNull(),
+  deliveryCity: text("delivery_city"),
+  deliveryState: text("delivery_state"),
+  deliveryLatitude: decimal("delivery_latitude", { precision: 10, scale: 8 }),
+  deliveryLongitude: decimal("delivery_longitude", { precision: 11, scale: 8 }),
   paymentMethod: text("payment_method"),
   createdAt: timestamp("created_at").notNull().default(sql`now()`),
 });
@@ -121,6 +125,8 @@ export const orderItems = pgTable("order_items", {
   id: varchar("id").primaryKey().default(sql`gen_random_uuid()`),
   orderId: varchar("order_id").notNull().references(() => orders.id),
   medicationId: varchar("medication_id").notNull().references(() => medications.id),
+  medicationName: text("medication_name"),
+  dosage: text("dosage"),
   quantity: integer("quantity").notNull(),
   unitPrice: decimal("unit_price", { precision: 10, scale: 2 }).notNull(),
   subtotal: decimal("subtotal", { precision: 10, scale: 2 }).notNull(),
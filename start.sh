@@ -2,7 +2,7 @@
 
 # Start Python backend
 echo "Starting Python backend on port 5001..."
-cd python_server && python app.py &
+./python_server/serve.sh flask &
 PYTHON_PID=$!
 
 # Wait a moment for Python backend to start
@@ -10,7 +10,6 @@ sleep 2
 
 # Start Node.js/Vite frontend
 echo "Starting Vite frontend..."
-cd ..
 npm run dev &
 VITE_PID=$!
 